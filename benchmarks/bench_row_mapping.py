@@ -0,0 +1,74 @@
+"""
+Row to model mapping benchmark (ismdb.misc_utils) on synthetic monitor log event rows, no database is needed.
+
+Compares the per row column name lookup with full pydantic validation, as the query helpers did before,
+against the column names read once per result set, with a validating and a trusted (model_construct) mapper.
+
+    python benchmarks/bench_row_mapping.py --rows 10000
+"""
+import argparse
+import datetime as dt
+import time
+
+from ismcore.model.base_model import MonitorLogEvent
+
+from ismdb.misc_utils import map_rows, model_mapper
+
+COLUMNS = ["log_id", "log_type", "log_time", "internal_reference_id", "user_id", "project_id", "exception", "data"]
+
+
+class SyntheticCursor:
+    description = [(column, None, None, None, None, None, None) for column in COLUMNS]
+
+
+def create_rows(rows: int):
+    now = dt.datetime.now()
+    return [
+        (index, "processor_error", now, index, "user", "project", None, f"log data {index}")
+        for index in range(rows)
+    ]
+
+
+def map_rows_per_row_columns(cursor, rows, mapper):
+    results = []
+    for row in rows:
+        columns = [col[0] for col in cursor.description]
+        results.append(mapper(dict(zip(columns, row))))
+    return results
+
+
+def measure(name: str, run, repeat: int) -> float:
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        run()
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+
+    print(f"{name:>36}: {best * 1000:8.2f} ms")
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=10_000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    cursor = SyntheticCursor()
+    rows = create_rows(args.rows)
+    validating = model_mapper(MonitorLogEvent)
+    trusted = model_mapper(MonitorLogEvent, trusted=True)
+
+    print(f"{args.rows} rows, best of {args.repeat}:")
+    before = measure("per row columns, validated (before)",
+                     lambda: map_rows_per_row_columns(cursor, rows, lambda row: MonitorLogEvent(**row)), args.repeat)
+    measure("columns once, validated",
+            lambda: map_rows(cursor, rows, validating), args.repeat)
+    after = measure("columns once, trusted",
+                    lambda: map_rows(cursor, rows, trusted), args.repeat)
+    print(f"{'speedup':>36}: {before / after:8.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+"""
+Throughput benchmark of the streaming state export (ismdb.state_export) on a synthetic state.
+
+The synthetic state data is generated server side (generate_series), the benchmark then exports
+it to parquet and arrow and reports the rows/sec and the peak memory of the export process.
+
+    DATABASE_URL=postgresql://... python benchmarks/bench_state_export.py --rows 1000000
+"""
+import argparse
+import os
+import resource
+import tempfile
+import time
+
+from ismcore.model.processor_state import State, StateConfig, StateDataColumnDefinition
+
+from ismdb.state_export import export_state_data
+from ismdb.state_storage import StateDatabaseStorage
+
+STATE_ID = "bench000-0000-0000-0000-000000export"
+
+
+def create_synthetic_state(storage: StateDatabaseStorage, rows: int, columns: int) -> State:
+    storage.delete_state_cascade(state_id=STATE_ID)
+
+    state = State(id=STATE_ID, config=StateConfig(name="benchmark export state"))
+    state.columns = {
+        f"column_{index}": StateDataColumnDefinition(name=f"column_{index}", data_type="str")
+        for index in range(columns)
+    }
+
+    storage.insert_state(state=state)
+    storage.insert_state_columns(state=state)
+
+    conn = storage.create_connection()
+    try:
+        with conn.cursor() as cursor:
+            for column in state.columns.values():
+                cursor.execute("""
+                    INSERT INTO state_column_data (column_id, data_index, data_value)
+                    SELECT %s, series.index, md5(series.index::text || %s)
+                      FROM generate_series(0, %s - 1) AS series(index)
+                """, [column.id, column.name, rows])
+        conn.commit()
+    finally:
+        storage.release_connection(conn)
+
+    state.count = rows
+    storage.update_state_count(state=state)
+    return state
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--columns", type=int, default=5)
+    parser.add_argument("--chunk-size", type=int, default=50_000)
+    parser.add_argument("--keep", action="store_true", help="keep the synthetic state after the run")
+    args = parser.parse_args()
+
+    storage = StateDatabaseStorage(database_url=os.environ["DATABASE_URL"])
+
+    started = time.monotonic()
+    create_synthetic_state(storage=storage, rows=args.rows, columns=args.columns)
+    print(f"generated {args.rows} rows x {args.columns} columns in {time.monotonic() - started:.1f}s")
+
+    with tempfile.TemporaryDirectory() as directory:
+        for file_format in ("parquet", "arrow"):
+            path = os.path.join(directory, f"export.{file_format}")
+
+            started = time.monotonic()
+            exported = export_state_data(storage=storage, state_id=STATE_ID, sink=path,
+                                         file_format=file_format, chunk_size=args.chunk_size)
+            elapsed = time.monotonic() - started
+
+            print(f"{file_format:>8}: {exported} rows in {elapsed:.1f}s, "
+                  f"{exported / elapsed:,.0f} rows/sec, {os.path.getsize(path) / 2 ** 20:.1f} MiB")
+
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(f"peak rss: {peak_rss:.0f} MiB (chunk size {args.chunk_size})")
+
+    if not args.keep:
+        storage.delete_state_cascade(state_id=STATE_ID)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+"""
+Latency benchmark of the usage reports read from the USAGE_*_V views against the rollup tables
+(bootstrap/migrations/004_add_usage_report_rollups.sql) on synthetic usage.
+
+The synthetic usage rows are generated server side (generate_series) for one benchmark user, spread over
+the given number of days and projects, the usage triggers maintain the minute rollup as they are inserted.
+The benchmark times the initial rollup build, an incremental refresh and the hourly, daily and monthly
+reports of the benchmark user from the views and from the rollup tables.
+
+    DATABASE_URL=postgresql://... python benchmarks/bench_usage_rollups.py --rows 10000000
+"""
+import argparse
+import datetime as dt
+import os
+import statistics
+import time
+
+from ismdb.usage_storage import UsageDatabaseStorage, usage_report_sql
+
+USER_ID = "bench000-0000-0000-0000-0000000usage"
+PROJECT_ID_PREFIX = "bench000-0000-0000-0000-00000proj"
+
+
+def project_ids(projects: int):
+    return [f"{PROJECT_ID_PREFIX}{index:03d}" for index in range(projects)]
+
+
+def execute(storage: UsageDatabaseStorage, sql: str, params=None):
+    conn = storage.create_connection()
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute(sql, params)
+        conn.commit()
+    finally:
+        storage.release_connection(conn)
+
+
+def delete_synthetic_usage(storage: UsageDatabaseStorage, projects: int):
+    ids = project_ids(projects)
+    execute(storage, "DELETE FROM usage WHERE project_id = ANY(%s)", [ids])
+    execute(storage, "DELETE FROM usage_minute_rollup WHERE user_id = %s", [USER_ID])
+    for table in ["usage_report_minutely", "usage_report_hourly", "usage_report_daily", "usage_report_monthly"]:
+        execute(storage, f"DELETE FROM {table} WHERE user_id = %s", [USER_ID])
+    execute(storage, "DELETE FROM user_project WHERE project_id = ANY(%s)", [ids])
+    execute(storage, "DELETE FROM user_profile WHERE user_id = %s", [USER_ID])
+
+
+def create_synthetic_usage(storage: UsageDatabaseStorage, rows: int, days: int, projects: int, batch: int):
+    execute(storage, "INSERT INTO user_profile (user_id, name) VALUES (%s, 'usage benchmark')", [USER_ID])
+    for project_id in project_ids(projects):
+        execute(storage, "INSERT INTO user_project (project_id, project_name, user_id) VALUES (%s, %s, %s)",
+                [project_id, project_id, USER_ID])
+
+    for offset in range(0, rows, batch):
+        started = time.perf_counter()
+        execute(storage, """
+            INSERT INTO usage (transaction_time, project_id, resource_id, resource_type,
+                               unit_type, unit_subtype, unit_count)
+            SELECT (NOW() AT TIME ZONE 'UTC') - (random() * %s * INTERVAL '1 day'),
+                   %s || LPAD((series.index %% %s)::TEXT, 3, '0'),
+                   'resource-' || (series.index %% 5),
+                   'openai',
+                   'TOKEN',
+                   (CASE WHEN series.index %% 2 = 0 THEN 'INPUT' ELSE 'OUTPUT' END)::USAGE_UNIT_SUBTYPE,
+                   (random() * 2000)::INT
+              FROM generate_series(%s, %s - 1) AS series(index)
+        """, [days, PROJECT_ID_PREFIX, projects, offset, min(offset + batch, rows)])
+        print(f"inserted {min(offset + batch, rows):,} / {rows:,} usage rows "
+              f"({batch / (time.perf_counter() - started):,.0f} rows/sec)")
+
+
+def median_ms(function, repeat: int) -> float:
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        function()
+        timings.append((time.perf_counter() - started) * 1000)
+    return statistics.median(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=10_000_000)
+    parser.add_argument("--days", type=int, default=90)
+    parser.add_argument("--projects", type=int, default=20)
+    parser.add_argument("--batch", type=int, default=1_000_000)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--reuse", action="store_true", help="reuse the synthetic usage of a previous --keep run")
+    parser.add_argument("--keep", action="store_true", help="keep the synthetic usage after the run")
+    args = parser.parse_args()
+
+    storage = UsageDatabaseStorage(database_url=os.environ["DATABASE_URL"])
+
+    if not args.reuse:
+        delete_synthetic_usage(storage, args.projects)
+        create_synthetic_usage(storage, args.rows, args.days, args.projects, args.batch)
+
+    # the synthetic usage is backdated, rebuild the rollups over its whole range
+    since = dt.datetime.now(dt.timezone.utc) - dt.timedelta(days=args.days + 1)
+    started = time.perf_counter()
+    storage.refresh_usage_rollups(since=None if args.reuse else since)
+    print(f"rollup refresh (rebuild of {args.days} days): {(time.perf_counter() - started) * 1000:,.1f} ms")
+    print(f"rollup refresh (incremental): {median_ms(storage.refresh_usage_rollups, args.repeat):,.1f} ms")
+
+    conditions = {"user_id": USER_ID}
+    for granularity, view in [("hour", "USAGE_HOURLY_V"), ("day", "USAGE_DAILY_V"), ("month", "USAGE_MONTHLY_V")]:
+        view_ms = median_ms(lambda: storage.execute_query_many(
+            f"SELECT * FROM {view}", conditions, lambda row: row), args.repeat)
+        rollup_ms = median_ms(lambda: storage.execute_query_many(
+            usage_report_sql(granularity), conditions, lambda row: row), args.repeat)
+        print(f"{granularity:>5} report: view {view_ms:10,.1f} ms  rollup {rollup_ms:8,.1f} ms  "
+              f"speedup {view_ms / max(rollup_ms, 0.001):8,.1f}x")
+
+    if not args.keep:
+        delete_synthetic_usage(storage, args.projects)
+
+
+if __name__ == "__main__":
+    main()
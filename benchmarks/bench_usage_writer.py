@@ -0,0 +1,120 @@
+"""
+Throughput benchmark of the usage event writes, one INSERT and commit per event (as the processors write
+usage today) against the buffered usage writer of UsageDatabaseStorage.record_usage, by COPY and by
+multi-row INSERT, with the events recorded from a number of threads.
+
+    DATABASE_URL=postgresql://... python benchmarks/bench_usage_writer.py --events 100000 --threads 4
+"""
+import argparse
+import os
+import threading
+import time
+
+from ismcore.model.base_model_usage_and_limits import Usage, UnitType, UnitSubType
+
+from ismdb import usage_storage
+from ismdb.usage_storage import UsageDatabaseStorage, USAGE_COLUMNS, usage_row
+
+USER_ID = "bench000-0000-0000-0000-0000000usage"
+PROJECT_ID = "bench000-0000-0000-0000-00000proj000"
+
+
+def execute(storage: UsageDatabaseStorage, sql: str, params=None):
+    conn = storage.create_connection()
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute(sql, params)
+        conn.commit()
+    finally:
+        storage.release_connection(conn)
+
+
+def delete_synthetic_usage(storage: UsageDatabaseStorage):
+    execute(storage, "DELETE FROM usage WHERE project_id = %s", [PROJECT_ID])
+    execute(storage, "DELETE FROM usage_minute_rollup WHERE project_id = %s", [PROJECT_ID])
+    execute(storage, "DELETE FROM user_project WHERE project_id = %s", [PROJECT_ID])
+    execute(storage, "DELETE FROM user_profile WHERE user_id = %s", [USER_ID])
+
+
+def create_synthetic_user(storage: UsageDatabaseStorage):
+    execute(storage, "INSERT INTO user_profile (user_id, name) VALUES (%s, 'usage benchmark')", [USER_ID])
+    execute(storage, "INSERT INTO user_project (project_id, project_name, user_id) VALUES (%s, %s, %s)",
+            [PROJECT_ID, PROJECT_ID, USER_ID])
+
+
+def create_usage(index: int) -> Usage:
+    return Usage(project_id=PROJECT_ID,
+                 resource_id=f"resource-{index % 5}",
+                 resource_type="openai",
+                 unit_type=UnitType.TOKEN,
+                 unit_subtype=UnitSubType.INPUT if index % 2 == 0 else UnitSubType.OUTPUT,
+                 unit_count=index % 2000)
+
+
+def insert_usage(storage: UsageDatabaseStorage, usage: Usage):
+    execute(storage, f"INSERT INTO usage ({', '.join(USAGE_COLUMNS)}) VALUES (%s, %s, %s, %s, %s, %s, %s, %s)",
+            usage_row(usage))
+
+
+def run_threads(threads: int, events: int, record) -> float:
+    """Record the events from the threads, returns the elapsed seconds."""
+    def run(offset: int):
+        for index in range(offset, events, threads):
+            record(create_usage(index))
+
+    started = time.perf_counter()
+    workers = [threading.Thread(target=run, args=(offset,)) for offset in range(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    return time.perf_counter() - started
+
+
+def count_usage(storage: UsageDatabaseStorage) -> int:
+    return storage.execute_query_fixed(
+        "SELECT COUNT(*) AS count FROM usage WHERE project_id = %s", [PROJECT_ID], lambda row: row["count"])[0]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--events", type=int, default=100_000)
+    parser.add_argument("--threads", type=int, default=4)
+    parser.add_argument("--single-events", type=int, default=5_000, help="events written one commit each")
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument("--flush-interval", type=float, default=1.0)
+    args = parser.parse_args()
+
+    storage = UsageDatabaseStorage(database_url=os.environ["DATABASE_URL"])
+    delete_synthetic_usage(storage)
+    create_synthetic_user(storage)
+
+    try:
+        elapsed = run_threads(args.threads, args.single_events, lambda usage: insert_usage(storage, usage))
+        print(f"insert per event: {args.single_events / elapsed:12,.0f} events/sec")
+
+        for method in ["copy", "insert"]:
+            usage_storage.USAGE_WRITER_METHOD = method
+            usage_storage.USAGE_WRITER_BATCH_SIZE = args.batch_size
+            usage_storage.USAGE_WRITER_FLUSH_SECONDS = args.flush_interval
+            usage_storage.USAGE_WRITER_MAX_BUFFERED = max(args.events, args.batch_size)
+            execute(storage, "DELETE FROM usage WHERE project_id = %s", [PROJECT_ID])
+
+            recorded = run_threads(args.threads, args.events, storage.record_usage)
+            writer = storage.usage_writer()
+            depth = writer.stats()["buffered"]
+            UsageDatabaseStorage.close_usage_writers(timeout=None)
+            elapsed = time.perf_counter() - writer.started
+            stats = writer.stats()
+
+            assert count_usage(storage) == stats["rows"]
+            print(f"buffered {method:>6}: {stats['rows'] / elapsed:12,.0f} events/sec written, "
+                  f"{args.events / recorded:12,.0f} events/sec recorded, depth after recording {depth:,}, "
+                  f"flush mean {stats['mean_flush_seconds'] * 1000:.1f} ms max "
+                  f"{stats['max_flush_seconds'] * 1000:.1f} ms, {stats['dropped']:,} dropped")
+    finally:
+        delete_synthetic_usage(storage)
+
+
+if __name__ == "__main__":
+    main()
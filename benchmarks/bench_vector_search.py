@@ -0,0 +1,118 @@
+"""
+Recall and latency benchmark of the approximate nearest neighbour search (ismdb.vector_storage) against
+brute force search, on synthetic random vectors.
+
+The exact neighbours are computed by brute force search before the index is built, the index is then
+built and the same queries are run at increasing ef_search (hnsw) or probes (ivfflat) settings.
+
+    DATABASE_URL=postgresql://... python benchmarks/bench_vector_search.py --rows 100000 --dims 64
+"""
+import argparse
+import os
+import random
+import statistics
+import time
+
+from ismdb.vector_storage import VectorDatabaseStorage
+
+TABLE = "bench_vector_search"
+
+
+def create_synthetic_vectors(storage: VectorDatabaseStorage, rows: int, dims: int):
+    conn = storage.create_connection()
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute("CREATE EXTENSION IF NOT EXISTS vector")
+            cursor.execute(f"DROP TABLE IF EXISTS {TABLE}")
+            cursor.execute(f"CREATE TABLE {TABLE} (id INT PRIMARY KEY, embedding VECTOR({dims}))")
+
+            # the correlated subquery is evaluated per row, each row gets its own random vector
+            cursor.execute(f"""
+                INSERT INTO {TABLE} (id, embedding)
+                SELECT row.id, (SELECT array_agg(random() - 0.5)
+                                  FROM generate_series(1, %s)
+                                 WHERE row.id IS NOT NULL)::vector
+                  FROM generate_series(1, %s) AS row(id)
+            """, [dims, rows])
+            cursor.execute(f"ANALYZE {TABLE}")
+        conn.commit()
+    finally:
+        storage.release_connection(conn)
+
+
+def run_queries(storage: VectorDatabaseStorage, queries, k: int, metric: str, **settings):
+    latencies = []
+    results = []
+    for query in queries:
+        started = time.perf_counter()
+        neighbours = storage.search(TABLE, "embedding", query, k=k, metric=metric, **settings)
+        latencies.append((time.perf_counter() - started) * 1000)
+        results.append([neighbour["id"] for neighbour in neighbours])
+
+    return results, latencies
+
+
+def recall(exact, approximate) -> float:
+    found = sum(len(set(expected) & set(actual)) for expected, actual in zip(exact, approximate))
+    return found / sum(len(expected) for expected in exact)
+
+
+def report(name: str, latencies, recall_at_k: float = None):
+    latencies = sorted(latencies)
+    p95 = latencies[int(len(latencies) * 0.95) - 1]
+    recall_text = f", recall: {recall_at_k:.3f}" if recall_at_k is not None else ""
+    print(f"{name:>24}: p50 {statistics.median(latencies):7.2f} ms, p95 {p95:7.2f} ms{recall_text}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=100_000)
+    parser.add_argument("--dims", type=int, default=64)
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--metric", default="cosine")
+    parser.add_argument("--method", default="hnsw", choices=["hnsw", "ivfflat"])
+    parser.add_argument("--settings", default="10,20,40,100,200",
+                        help="comma separated ef_search (hnsw) or probes (ivfflat) values")
+    parser.add_argument("--keep", action="store_true", help="keep the synthetic table after the run")
+    args = parser.parse_args()
+
+    storage = VectorDatabaseStorage(database_url=os.environ["DATABASE_URL"])
+
+    started = time.monotonic()
+    create_synthetic_vectors(storage=storage, rows=args.rows, dims=args.dims)
+    print(f"generated {args.rows} vectors of {args.dims} dimensions in {time.monotonic() - started:.1f}s")
+
+    queries = [[random.random() - 0.5 for _ in range(args.dims)] for _ in range(args.queries)]
+
+    exact, latencies = run_queries(storage, queries, k=args.k, metric=args.metric)
+    report("brute force", latencies)
+
+    started = time.monotonic()
+    storage.create_vector_index(TABLE, "embedding", method=args.method, metric=args.metric,
+                                lists=max(args.rows // 1000, 1))
+    print(f"built {args.method} index in {time.monotonic() - started:.1f}s")
+
+    setting_name = "ef_search" if args.method == "hnsw" else "probes"
+    for value in [int(value) for value in args.settings.split(",")]:
+        approximate, latencies = run_queries(storage, queries, k=args.k, metric=args.metric,
+                                             **{setting_name: value})
+        report(f"{args.method} {setting_name}={value}", latencies, recall(exact, approximate))
+
+    started = time.perf_counter()
+    storage.search_many(TABLE, "embedding", queries, k=args.k, metric=args.metric)
+    elapsed = (time.perf_counter() - started) * 1000
+    print(f"{'search_many':>24}: {elapsed:.2f} ms for {len(queries)} queries in one statement")
+
+    if not args.keep:
+        conn = storage.create_connection()
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute(f"DROP TABLE IF EXISTS {TABLE}")
+            conn.commit()
+        finally:
+            storage.release_connection(conn)
+
+
+if __name__ == "__main__":
+    main()
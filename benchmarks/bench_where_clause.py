@@ -0,0 +1,72 @@
+"""
+Per-call overhead benchmark of the where clause compiler (ismdb.base.compile_where) against building
+the where clauses from the conditions on every call, as the query helpers did before. No database is needed.
+
+    python benchmarks/bench_where_clause.py --calls 200000
+"""
+import argparse
+import time
+
+from ismdb.base import compile_where, Condition, SQLNull, SQLNotNull
+
+
+def build_where_uncached(conditions: dict):
+    params = []
+    where_clauses = []
+
+    for field, value in conditions.items():
+        if value is not None:
+            if value is SQLNull:
+                where_clauses.append(f"{field} IS NULL")
+            elif value is SQLNotNull:
+                where_clauses.append(f"{field} IS NOT NULL")
+            elif isinstance(value, Condition):
+                where_clauses.append(f"{field} {value.operator} %s")
+                params.append(value.value)
+            elif isinstance(value, tuple) and len(value) == 2:
+                where_clauses.append(f"{field} BETWEEN %s AND %s")
+                params.extend(value)
+            else:
+                where_clauses.append(f"{field} = %s")
+                params.append(value)
+
+    return " AND ".join(where_clauses), params
+
+
+def measure(name: str, build, conditions: dict, calls: int) -> float:
+    started = time.perf_counter()
+    for _ in range(calls):
+        build(conditions)
+    elapsed = time.perf_counter() - started
+
+    per_call = elapsed / calls * 1_000_000
+    print(f"{name:>24}: {per_call:6.2f} us/call")
+    return per_call
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--calls", type=int, default=200_000)
+    args = parser.parse_args()
+
+    shapes = {
+        "single key": {"id": "b0000000-0000-0000-0000-0000000000b1"},
+        "usage report": {
+            "user_id": "u", "project_id": "p", "resource_id": None, "resource_type": None,
+            "year": 2026, "month": 10, "day": 16, "hour": None, "minute": None,
+        },
+        "mixed operators": {
+            "user_id": "u", "deleted_at": SQLNull, "log_type": SQLNotNull,
+            "log_id": Condition(">", 100), "log_time": (1, 2),
+        },
+    }
+
+    for shape, conditions in shapes.items():
+        print(f"{shape}:")
+        uncached = measure("uncached", build_where_uncached, conditions, args.calls)
+        compiled = measure("compiled (cached)", compile_where, conditions, args.calls)
+        print(f"{'speedup':>24}: {uncached / compiled:6.2f}x")
+
+
+if __name__ == "__main__":
+    main()
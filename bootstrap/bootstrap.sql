@@ -607,4 +607,16 @@ ALTER TABLE USER_PROFILE ADD COLUMN IF NOT EXISTS SETTINGS JSONB NULL;
 ALTER TABLE USER_PROJECT ADD COLUMN IF NOT EXISTS SETTINGS JSONB NULL;
 
 -- Add properties JSONB column to STATE for StateProperties model
-ALTER TABLE STATE ADD COLUMN IF NOT EXISTS PROPERTIES JSONB NULL;
\ No newline at end of file
+ALTER TABLE STATE ADD COLUMN IF NOT EXISTS PROPERTIES JSONB NULL;
+
+----------------------------------------
+------ EMBEDDING CACHE ------
+----------------------------------------
+-- Persistent cache of text embeddings by content hash and embedding model
+CREATE TABLE IF NOT EXISTS EMBEDDING_CACHE (
+    CONTENT_HASH VARCHAR(64) NOT NULL,
+    MODEL_NAME VARCHAR(255) NOT NULL,
+    EMBEDDING TEXT NOT NULL,
+    CREATE_DATE TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (CONTENT_HASH, MODEL_NAME)
+);
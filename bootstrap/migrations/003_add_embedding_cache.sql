@@ -0,0 +1,15 @@
+-- Migration: Add embedding cache table
+-- Date: 2026-10-16
+-- Description: Persistent cache of text embeddings by content hash and embedding model, shared by all processors
+
+CREATE TABLE IF NOT EXISTS EMBEDDING_CACHE (
+    CONTENT_HASH VARCHAR(64) NOT NULL,
+    MODEL_NAME VARCHAR(255) NOT NULL,
+    EMBEDDING TEXT NOT NULL,
+    CREATE_DATE TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (CONTENT_HASH, MODEL_NAME)
+);
+
+COMMENT ON TABLE EMBEDDING_CACHE IS 'Text embeddings by sha256 of the text and the embedding model name, see ismdb.embedding_cache';
+
+COMMIT;
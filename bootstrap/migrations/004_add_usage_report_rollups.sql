@@ -0,0 +1,123 @@
+-- Migration: Add usage report rollup tables
+-- Date: 2026-10-16
+-- Description: Physical minute, hour, day and month usage reports, maintained incrementally from a watermark by
+--              UsageDatabaseStorage.refresh_usage_rollups, read by the fetch_usage_report_* methods in place of the
+--              USAGE_*_V views. Buckets before the watermark of a granularity are closed and never recomputed.
+
+CREATE TABLE IF NOT EXISTS USAGE_REPORT_MINUTELY (
+    BUCKET_UTC     TIMESTAMPTZ  NOT NULL,
+    USER_ID        VARCHAR(36)  NOT NULL,
+    PROJECT_ID     VARCHAR(36)  NOT NULL,
+    YEAR           INTEGER      NOT NULL,
+    MONTH          INTEGER      NOT NULL,
+    DAY            INTEGER      NOT NULL,
+    HOUR           INTEGER      NOT NULL,
+    MINUTE         INTEGER      NOT NULL,
+    RESOURCE_TYPE  VARCHAR(255) NOT NULL,
+    RESOURCE_ID    VARCHAR(255) NOT NULL,
+    INPUT_COST     NUMERIC,
+    INPUT_PRICE    NUMERIC,
+    INPUT_TOKENS   NUMERIC,
+    INPUT_COUNT    NUMERIC,
+    OUTPUT_COST    NUMERIC,
+    OUTPUT_PRICE   NUMERIC,
+    OUTPUT_TOKENS  NUMERIC,
+    OUTPUT_COUNT   NUMERIC,
+    TOTAL_COST     NUMERIC,
+    TOTAL_TOKENS   NUMERIC,
+    PRIMARY KEY (BUCKET_UTC, USER_ID, PROJECT_ID, RESOURCE_TYPE, RESOURCE_ID)
+);
+
+CREATE INDEX IF NOT EXISTS USAGE_REPORT_MINUTELY_USER_IDX
+    ON USAGE_REPORT_MINUTELY (USER_ID, YEAR, MONTH, DAY, HOUR, MINUTE);
+CREATE INDEX IF NOT EXISTS USAGE_REPORT_MINUTELY_PROJECT_IDX ON USAGE_REPORT_MINUTELY (PROJECT_ID, BUCKET_UTC);
+
+CREATE TABLE IF NOT EXISTS USAGE_REPORT_HOURLY (
+    BUCKET_UTC     TIMESTAMPTZ  NOT NULL,
+    USER_ID        VARCHAR(36)  NOT NULL,
+    PROJECT_ID     VARCHAR(36)  NOT NULL,
+    YEAR           INTEGER      NOT NULL,
+    MONTH          INTEGER      NOT NULL,
+    DAY            INTEGER      NOT NULL,
+    HOUR           INTEGER      NOT NULL,
+    RESOURCE_TYPE  VARCHAR(255) NOT NULL,
+    RESOURCE_ID    VARCHAR(255) NOT NULL,
+    INPUT_COST     NUMERIC,
+    INPUT_PRICE    NUMERIC,
+    INPUT_TOKENS   NUMERIC,
+    INPUT_COUNT    NUMERIC,
+    OUTPUT_COST    NUMERIC,
+    OUTPUT_PRICE   NUMERIC,
+    OUTPUT_TOKENS  NUMERIC,
+    OUTPUT_COUNT   NUMERIC,
+    TOTAL_COST     NUMERIC,
+    TOTAL_TOKENS   NUMERIC,
+    PRIMARY KEY (BUCKET_UTC, USER_ID, PROJECT_ID, RESOURCE_TYPE, RESOURCE_ID)
+);
+
+CREATE INDEX IF NOT EXISTS USAGE_REPORT_HOURLY_USER_IDX ON USAGE_REPORT_HOURLY (USER_ID, YEAR, MONTH, DAY, HOUR);
+CREATE INDEX IF NOT EXISTS USAGE_REPORT_HOURLY_PROJECT_IDX ON USAGE_REPORT_HOURLY (PROJECT_ID, BUCKET_UTC);
+
+CREATE TABLE IF NOT EXISTS USAGE_REPORT_DAILY (
+    BUCKET_UTC     TIMESTAMPTZ  NOT NULL,
+    USER_ID        VARCHAR(36)  NOT NULL,
+    PROJECT_ID     VARCHAR(36)  NOT NULL,
+    YEAR           INTEGER      NOT NULL,
+    MONTH          INTEGER      NOT NULL,
+    DAY            INTEGER      NOT NULL,
+    RESOURCE_TYPE  VARCHAR(255) NOT NULL,
+    RESOURCE_ID    VARCHAR(255) NOT NULL,
+    INPUT_COST     NUMERIC,
+    INPUT_PRICE    NUMERIC,
+    INPUT_TOKENS   NUMERIC,
+    INPUT_COUNT    NUMERIC,
+    OUTPUT_COST    NUMERIC,
+    OUTPUT_PRICE   NUMERIC,
+    OUTPUT_TOKENS  NUMERIC,
+    OUTPUT_COUNT   NUMERIC,
+    TOTAL_COST     NUMERIC,
+    TOTAL_TOKENS   NUMERIC,
+    PRIMARY KEY (BUCKET_UTC, USER_ID, PROJECT_ID, RESOURCE_TYPE, RESOURCE_ID)
+);
+
+CREATE INDEX IF NOT EXISTS USAGE_REPORT_DAILY_USER_IDX ON USAGE_REPORT_DAILY (USER_ID, YEAR, MONTH, DAY);
+CREATE INDEX IF NOT EXISTS USAGE_REPORT_DAILY_PROJECT_IDX ON USAGE_REPORT_DAILY (PROJECT_ID, BUCKET_UTC);
+
+CREATE TABLE IF NOT EXISTS USAGE_REPORT_MONTHLY (
+    BUCKET_UTC     TIMESTAMPTZ  NOT NULL,
+    USER_ID        VARCHAR(36)  NOT NULL,
+    PROJECT_ID     VARCHAR(36)  NOT NULL,
+    YEAR           INTEGER      NOT NULL,
+    MONTH          INTEGER      NOT NULL,
+    RESOURCE_TYPE  VARCHAR(255) NOT NULL,
+    RESOURCE_ID    VARCHAR(255) NOT NULL,
+    INPUT_COST     NUMERIC,
+    INPUT_PRICE    NUMERIC,
+    INPUT_TOKENS   NUMERIC,
+    INPUT_COUNT    NUMERIC,
+    OUTPUT_COST    NUMERIC,
+    OUTPUT_PRICE   NUMERIC,
+    OUTPUT_TOKENS  NUMERIC,
+    OUTPUT_COUNT   NUMERIC,
+    TOTAL_COST     NUMERIC,
+    TOTAL_TOKENS   NUMERIC,
+    PRIMARY KEY (BUCKET_UTC, USER_ID, PROJECT_ID, RESOURCE_TYPE, RESOURCE_ID)
+);
+
+CREATE INDEX IF NOT EXISTS USAGE_REPORT_MONTHLY_USER_IDX ON USAGE_REPORT_MONTHLY (USER_ID, YEAR, MONTH);
+CREATE INDEX IF NOT EXISTS USAGE_REPORT_MONTHLY_PROJECT_IDX ON USAGE_REPORT_MONTHLY (PROJECT_ID, BUCKET_UTC);
+
+-- the first bucket of each granularity that is not closed yet, the rollup rows before it are final
+CREATE TABLE IF NOT EXISTS USAGE_REPORT_ROLLUP_WATERMARK (
+    GRANULARITY        VARCHAR(16) NOT NULL PRIMARY KEY,
+    CLOSED_BEFORE_UTC  TIMESTAMPTZ,
+    REFRESHED_UTC      TIMESTAMPTZ NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+GRANT SELECT, INSERT, UPDATE, DELETE ON USAGE_REPORT_MINUTELY TO ISM_DB_USER;
+GRANT SELECT, INSERT, UPDATE, DELETE ON USAGE_REPORT_HOURLY TO ISM_DB_USER;
+GRANT SELECT, INSERT, UPDATE, DELETE ON USAGE_REPORT_DAILY TO ISM_DB_USER;
+GRANT SELECT, INSERT, UPDATE, DELETE ON USAGE_REPORT_MONTHLY TO ISM_DB_USER;
+GRANT SELECT, INSERT, UPDATE, DELETE ON USAGE_REPORT_ROLLUP_WATERMARK TO ISM_DB_USER;
+
+COMMIT;
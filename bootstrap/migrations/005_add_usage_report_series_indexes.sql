@@ -0,0 +1,11 @@
+-- Migration: Add usage report series indexes
+-- Date: 2026-10-16
+-- Description: Time range indexes of the usage report rollup tables by user, for the bucket_utc range predicate of
+--              UsageDatabaseStorage.fetch_usage_series
+
+CREATE INDEX IF NOT EXISTS USAGE_REPORT_MINUTELY_USER_TIME_IDX ON USAGE_REPORT_MINUTELY (USER_ID, BUCKET_UTC);
+CREATE INDEX IF NOT EXISTS USAGE_REPORT_HOURLY_USER_TIME_IDX ON USAGE_REPORT_HOURLY (USER_ID, BUCKET_UTC);
+CREATE INDEX IF NOT EXISTS USAGE_REPORT_DAILY_USER_TIME_IDX ON USAGE_REPORT_DAILY (USER_ID, BUCKET_UTC);
+CREATE INDEX IF NOT EXISTS USAGE_REPORT_MONTHLY_USER_TIME_IDX ON USAGE_REPORT_MONTHLY (USER_ID, BUCKET_UTC);
+
+COMMIT;
@@ -0,0 +1,468 @@
+import asyncio
+import collections
+import contextvars
+import logging as log
+import os
+from contextlib import asynccontextmanager
+
+import psycopg2
+from psycopg2 import extensions, pool
+from ismcore.storage.processor_state_storage import FieldConfig
+from typing import List, Any, Dict, Optional, Callable, Union, Tuple
+
+from ismdb.base import (Condition, append_where, append_order_by, grouped_query_sql, insert_query_sql,
+                        update_query_sql, MIN_DB_CONNECTIONS, DB_CONNECTION_TIMEOUT)
+from ismdb.connection_pool import ConnectionPoolTimeout, _live_pools, _discard_inherited, is_inherited_connection
+from ismdb.misc_utils import map_rows
+
+logging = log.getLogger(__name__)
+
+# async connections are cheap to share, a small pool serves many concurrent tasks
+MAX_ASYNC_DB_CONNECTIONS = int(os.environ.get("MAX_ASYNC_DB_CONNECTIONS", 10))
+
+
+async def wait_connection(conn):
+    """
+    Drive an asynchronous psycopg2 connection until the pending operation (connect or query) completes,
+    waiting on the connection socket through the running event loop instead of blocking it.
+    """
+    loop = asyncio.get_running_loop()
+
+    while True:
+        state = conn.poll()
+        if state == extensions.POLL_OK:
+            return
+
+        if state == extensions.POLL_READ:
+            add_waiter, remove_waiter = loop.add_reader, loop.remove_reader
+        elif state == extensions.POLL_WRITE:
+            add_waiter, remove_waiter = loop.add_writer, loop.remove_writer
+        else:
+            raise psycopg2.OperationalError(f'unexpected connection poll state: {state}')
+
+        fd = conn.fileno()
+        ready = loop.create_future()
+        add_waiter(fd, lambda: ready.done() or ready.set_result(None))
+        try:
+            await ready
+        finally:
+            remove_waiter(fd)
+
+
+async def execute_async(conn, sql: str, params: Any = None):
+    """Execute a statement on an asynchronous connection, returns the cursor holding the results."""
+    cursor = conn.cursor()
+    cursor.execute(sql, params)
+    await wait_connection(conn)
+    return cursor
+
+
+class AsyncConnectionPool:
+    """
+    Asyncio postgres connection pool of asynchronous psycopg2 connections, the asyncio counterpart
+    of BlockingConnectionPool. A checkout waits when all connections are in use until one is released
+    or the timeout expires, waiting tasks are served in FIFO order.
+
+    Asynchronous connections run in autocommit mode, transactions are explicit (BEGIN / COMMIT),
+    see AsyncBaseDatabaseAccess.transaction.
+
+    Like BlockingConnectionPool, a forked child process discards the inherited connections without closing them.
+    """
+
+    def __init__(self, minconn: int, maxconn: int, dsn: str, timeout: Optional[float] = None, **kwargs):
+        if maxconn < 1 or minconn < 0 or minconn > maxconn:
+            raise ValueError(f'invalid pool size, minconn: {minconn}, maxconn: {maxconn}')
+
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.timeout = timeout
+        self.closed = False
+
+        self._dsn = dsn
+        self._kwargs = kwargs
+        self._idle = collections.deque()
+        self._used = {}
+        self._waiters = collections.deque()  # futures resolved with a connection, or None to connect
+        self._size = 0
+        self._pid = os.getpid()
+        _live_pools.add(self)
+
+    def _reset_after_fork(self):
+        """Discard the state inherited from the parent process, the waiting futures belong to its event loop."""
+        if self._pid == os.getpid():
+            return
+
+        _discard_inherited(list(self._idle) + list(self._used.values()))
+        self._idle = collections.deque()
+        self._used = {}
+        self._waiters = collections.deque()
+        self._size = 0
+        self._pid = os.getpid()
+
+    async def _connect(self):
+        conn = psycopg2.connect(self._dsn, async_=True, **self._kwargs)
+        await wait_connection(conn)
+        return conn
+
+    async def _connect_reserved(self):
+        """Establish a connection for a reserved slot, releasing the slot if the connection fails."""
+        try:
+            conn = await self._connect()
+        except BaseException:
+            self._size -= 1
+            self._hand_over_slot()
+            raise
+
+        self._used[id(conn)] = conn
+        return conn
+
+    def _hand_over_slot(self):
+        """Pass a free connection slot to the first waiting task."""
+        while self._waiters and self._size < self.maxconn:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                self._size += 1
+                waiter.set_result(None)
+                return
+
+    async def open(self):
+        """Establish the minimum number of connections."""
+        while self._size < self.minconn:
+            self._size += 1
+            try:
+                conn = await self._connect()
+            except BaseException:
+                self._size -= 1
+                raise
+            self._idle.append(conn)
+
+    async def getconn(self, timeout: Optional[float] = None):
+        timeout = self.timeout if timeout is None else timeout
+        self._reset_after_fork()
+
+        if self.closed:
+            raise pool.PoolError('connection pool is closed')
+
+        if not self._waiters:
+            if self._idle:
+                conn = self._idle.pop()
+                self._used[id(conn)] = conn
+                return conn
+
+            if self._size < self.maxconn:
+                self._size += 1
+                return await self._connect_reserved()
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+
+        try:
+            conn = await asyncio.wait_for(asyncio.shield(waiter), timeout)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            if waiter.done() and not waiter.cancelled():
+                # handed a connection or slot at the same moment the wait ended, pass it on
+                handed = waiter.result()
+                if handed is not None:
+                    self.putconn(handed)
+                else:
+                    self._size -= 1
+                    self._hand_over_slot()
+            else:
+                waiter.cancel()
+                if waiter in self._waiters:
+                    self._waiters.remove(waiter)
+
+            if isinstance(e, asyncio.TimeoutError):
+                raise ConnectionPoolTimeout(
+                    f'no connection available within {timeout} seconds, '
+                    f'pool size: {self.maxconn}, waiting: {len(self._waiters)}')
+            raise
+
+        if conn is not None:
+            return conn
+
+        if self.closed:
+            self._size -= 1
+            raise pool.PoolError('connection pool is closed')
+
+        return await self._connect_reserved()
+
+    def putconn(self, conn, close: bool = False):
+        """Return a connection to the pool, connections that are broken or in a transaction are closed."""
+        self._reset_after_fork()
+        if is_inherited_connection(conn):
+            return
+
+        if self._used.pop(id(conn), None) is None:
+            if self.closed:
+                return
+            raise pool.PoolError('trying to put unkeyed connection')
+
+        if not close and not conn.closed:
+            # an asynchronous connection can not be rolled back synchronously, discard it instead
+            close = conn.isexecuting() or \
+                conn.info.transaction_status != extensions.TRANSACTION_STATUS_IDLE
+
+        if self.closed or close or conn.closed:
+            self._size -= 1
+            if not conn.closed:
+                conn.close()
+            self._hand_over_slot()
+            return
+
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                self._used[id(conn)] = conn
+                waiter.set_result(conn)
+                return
+
+        self._idle.append(conn)
+
+    def closeall(self):
+        self._reset_after_fork()
+        self.closed = True
+        connections = list(self._idle) + list(self._used.values())
+        self._idle.clear()
+        self._used.clear()
+        self._size = 0
+
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                self._size += 1
+                waiter.set_result(None)
+
+        for conn in connections:
+            try:
+                conn.close()
+            except Exception as e:
+                logging.warning(f'failed to close pooled connection: {e}')
+
+    def stats(self) -> Dict[str, int]:
+        self._reset_after_fork()
+        return {
+            'size': self._size,
+            'max': self.maxconn,
+            'idle': len(self._idle),
+            'in_use': len(self._used),
+            'waiting': len([waiter for waiter in self._waiters if not waiter.done()]),
+        }
+
+
+class AsyncTransaction:
+    """The connection of a unit of work in progress, see AsyncBaseDatabaseAccess.transaction."""
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.depth = 1
+
+
+# the active unit of work of the current task, by connection pool
+_async_transactions = contextvars.ContextVar('ismdb_async_transactions', default=None)
+
+
+class AsyncBaseDatabaseAccess:
+    """
+    Asyncio counterpart of BaseDatabaseAccessSinglePool, all instances with the same database url
+    share one AsyncConnectionPool.
+
+    Statements run on asynchronous psycopg2 connections in autocommit mode, each statement is committed
+    on its own unless it runs within a unit of work, see transaction.
+    """
+
+    # Class-level dictionary to store connection pools
+    _pools = {}
+
+    def __init__(self, database_url, incremental: bool = False):
+        self.database_url = database_url
+        self.incremental = incremental
+
+        if database_url in AsyncBaseDatabaseAccess._pools:
+            self.connection_pool = AsyncBaseDatabaseAccess._pools[database_url]
+        else:
+            logging.info(f"establishing async connection pool with max connections: {MAX_ASYNC_DB_CONNECTIONS}")
+            self.connection_pool = AsyncConnectionPool(
+                MIN_DB_CONNECTIONS, MAX_ASYNC_DB_CONNECTIONS, database_url, timeout=DB_CONNECTION_TIMEOUT)
+            AsyncBaseDatabaseAccess._pools[database_url] = self.connection_pool
+
+    @classmethod
+    def close_pool(cls, database_url: str):
+        connection_pool = cls._pools.pop(database_url, None)
+        if connection_pool:
+            connection_pool.closeall()
+
+    @classmethod
+    def close_all_pools(cls):
+        """Close the connection pools of all database urls, e.g. on shutdown."""
+        while cls._pools:
+            cls.close_pool(next(iter(cls._pools)))
+
+    def _active_transaction(self) -> Optional[AsyncTransaction]:
+        active = _async_transactions.get()
+        return active.get(id(self.connection_pool)) if active else None
+
+    @asynccontextmanager
+    async def transaction(self):
+        """
+        Unit of work, all storage calls made by the current task within the context, on any storage
+        instance sharing this connection pool, run on one connection in one transaction, which is
+        committed on exit or rolled back if any of the calls fail. Nested units of work join the outer one.
+
+        Tasks started within the unit of work must not use the storage concurrently, a connection
+        runs one statement at a time.
+
+        Example:
+            async with storage.transaction():
+                await storage.insert_state(state=state)
+                await storage.insert_state_columns(state=state)
+        """
+        active = self._active_transaction()
+        if active:
+            active.depth += 1
+            try:
+                yield active
+            finally:
+                active.depth -= 1
+            return
+
+        conn = await self.connection_pool.getconn()
+        transaction = AsyncTransaction(conn)
+        token = _async_transactions.set({**(_async_transactions.get() or {}), id(self.connection_pool): transaction})
+
+        close = False
+        try:
+            await execute_async(conn, "BEGIN")
+            try:
+                yield transaction
+            except BaseException:
+                try:
+                    if not conn.closed and not conn.isexecuting():
+                        await execute_async(conn, "ROLLBACK")
+                    else:
+                        close = True
+                except BaseException as e:
+                    logging.error(f'failed to rollback unit of work: {e}')
+                    close = True
+                raise
+
+            # a failed commit ends the transaction, there is nothing left to roll back
+            await execute_async(conn, "COMMIT")
+        except BaseException:
+            # a statement interrupted midway leaves the connection unusable
+            close = close or conn.closed or conn.isexecuting()
+            raise
+        finally:
+            _async_transactions.reset(token)
+            self.connection_pool.putconn(conn, close=close)
+
+    async def create_connection(self):
+        active = self._active_transaction()
+        if active:
+            return active.connection
+
+        return await self.connection_pool.getconn()
+
+    def release_connection(self, conn):
+        # the connection of a unit of work is released when the unit of work completes
+        active = self._active_transaction()
+        if active and active.connection is conn:
+            return
+
+        try:
+            self.connection_pool.putconn(conn)
+        except Exception as e:
+            logging.error(f'failed to release connection as a result of {e}')
+
+    async def execute(self, sql: str, params: Any = None) -> int:
+        """Execute a single statement, returns the number of affected rows."""
+        conn = await self.create_connection()
+        try:
+            cursor = await execute_async(conn, sql, params)
+            return cursor.rowcount
+        except Exception as e:
+            logging.error(f"Database statement failed: {e}")
+            raise
+        finally:
+            self.release_connection(conn)
+
+    async def execute_returning(self, sql: str, params: Any = None) -> Optional[tuple]:
+        """Execute a single statement, returns the first row of its result (e.g. of a RETURNING clause)."""
+        conn = await self.create_connection()
+        try:
+            cursor = await execute_async(conn, sql, params)
+            return cursor.fetchone()
+        except Exception as e:
+            logging.error(f"Database statement failed: {e}")
+            raise
+        finally:
+            self.release_connection(conn)
+
+    async def execute_delete_query(self, sql: str, conditions: Dict[str, Any]) -> int:
+        sql, params = append_where(sql, conditions)
+
+        return await self.execute(sql, params)
+
+    async def execute_insert_query(self, table: str, insert_values: Dict[str, Any]) -> int:
+        sql, params = insert_query_sql(table, insert_values)
+        return await self.execute(sql, params)
+
+    async def execute_update(self, table: str, update_values: dict, conditions: dict) -> int | None:
+        sql, params = update_query_sql(table, update_values, conditions)
+        return await self.execute(sql, params)
+
+    async def _fetch_mapped(self, sql: str, params: Any, mapper: Callable) -> List[Any]:
+        conn = await self.create_connection()
+        try:
+            cursor = await execute_async(conn, sql, params)
+            rows = cursor.fetchall()
+            return map_rows(cursor, rows, mapper)
+        except Exception as e:
+            logging.error(f"Database query failed: {e}")
+            raise
+        finally:
+            self.release_connection(conn)
+
+    async def execute_query_one(self, sql: str, conditions: dict, mapper: Callable) -> Optional[Any]:
+        sql, params = append_where(sql, conditions)
+
+        results = await self._fetch_mapped(sql, params, mapper)
+        if len(results) > 1:
+            raise ValueError("Multiple rows returned when expecting a single value.")
+
+        return results[0] if results else None
+
+    async def execute_query_many(self, sql: str, conditions: dict, mapper: Callable) -> Optional[List[Any]]:
+        sql, params = append_where(sql, conditions)
+
+        results = await self._fetch_mapped(sql, params, mapper)
+        return results if results else None
+
+    async def execute_query_many2(self,
+                                  sql: str,
+                                  conditions: Dict[str, Union[Any, Condition, Tuple[Any, Any]]],
+                                  mapper: Callable, order_by: [str] = None) \
+            -> Optional[List[Any]]:
+        """See BaseDatabaseAccess.execute_query_many2"""
+        sql, params = append_where(sql, conditions)
+        sql = append_order_by(sql, order_by)
+
+        results = await self._fetch_mapped(sql, params, mapper)
+        return results if results else None
+
+    async def execute_query_grouped(
+            self,
+            base_sql: str,
+            conditions_and_grouping: List[FieldConfig],
+            mapper: Callable[[Dict], Any]
+    ) -> Optional[List[Any]]:
+        """See BaseDatabaseAccess.execute_query_grouped"""
+        final_sql, params = grouped_query_sql(base_sql, conditions_and_grouping)
+
+        results = await self._fetch_mapped(final_sql, params, mapper)
+        return results if results else None
+
+    async def execute_query_fixed(self, sql: str, params: Optional[List[Any]], mapper: Callable) \
+            -> Optional[List[Any]]:
+        results = await self._fetch_mapped(sql, params, mapper)
+        return results if results else None
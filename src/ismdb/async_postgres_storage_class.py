@@ -0,0 +1,76 @@
+import logging as log
+
+from ismdb.async_monitor_storage import AsyncMonitorLogEventDatabaseStorage
+from ismdb.async_processor_state_storage import AsyncProcessorStateDatabaseStorage
+from ismdb.async_session_storage import AsyncSessionDatabaseStorage
+from ismdb.async_state_storage import AsyncStateDatabaseStorage
+from ismdb.async_usage_storage import AsyncUsageDatabaseStorage
+from ismdb.memory_cache import MemoryCache
+
+logging = log.getLogger(__name__)
+
+
+class AsyncPostgresDatabaseStorage:
+    """
+    Asyncio counterpart of PostgresDatabaseStorage for the hot storage paths (state, processor state,
+    monitor, usage and session). All storages share one AsyncConnectionPool per database url, such that
+    many concurrent tasks are served by a small number of connections.
+
+    Storage calls are delegated to the storage defining them, e.g. await storage.load_state_metadata(...)
+
+    Example:
+        storage = AsyncPostgresDatabaseStorage(database_url=DATABASE_URL)
+        await storage.open()
+        state = await storage.append_state_data_direct(state_id=state_id, query_states=query_states)
+        storage.close()
+    """
+
+    def __init__(self, database_url: str, incremental: bool = True, state_metadata_cache: MemoryCache = None,
+                 *args, **kwargs):
+        self.database_url = database_url
+
+        self.state_storage = AsyncStateDatabaseStorage(
+            database_url=database_url, incremental=incremental, metadata_cache=state_metadata_cache)
+        self.processor_state_storage = AsyncProcessorStateDatabaseStorage(
+            database_url=database_url, incremental=incremental)
+        self.monitor_log_event_storage = AsyncMonitorLogEventDatabaseStorage(
+            database_url=database_url, incremental=incremental)
+        self.usage_storage = AsyncUsageDatabaseStorage(database_url=database_url, incremental=incremental)
+        self.session_storage = AsyncSessionDatabaseStorage(database_url=database_url, incremental=incremental)
+
+        self._storages = [
+            self.state_storage,
+            self.processor_state_storage,
+            self.monitor_log_event_storage,
+            self.usage_storage,
+            self.session_storage,
+        ]
+
+    @property
+    def connection_pool(self):
+        return self.state_storage.connection_pool
+
+    async def open(self):
+        """Establish the minimum number of pooled connections, otherwise these are established on demand."""
+        await self.connection_pool.open()
+
+    def close(self):
+        """
+        Release the storages, the pool of the database url is shared with other storages and stays open,
+        close it with AsyncBaseDatabaseAccess.close_pool(database_url) or close_all_pools() on shutdown.
+        """
+
+    def transaction(self):
+        """Unit of work across all the storages, see AsyncBaseDatabaseAccess.transaction."""
+        return self.state_storage.transaction()
+
+    def __getattr__(self, name):
+        # only called for attributes not found on the facade itself
+        for storage in self.__dict__.get('_storages', []):
+            if hasattr(type(storage), name):
+                # bound to the instance, later lookups no longer get here
+                attribute = getattr(storage, name)
+                setattr(self, name, attribute)
+                return attribute
+
+        raise AttributeError(f"'{type(self).__name__}' object has no attribute '{name}'")
@@ -0,0 +1,135 @@
+import json
+import logging as log
+from typing import Optional, List
+
+from ismcore.model.base_model import ProcessorState, ProcessorStateDirection, ProcessorStatusCode, EdgeFunctionConfig
+
+from ismdb.async_base import AsyncBaseDatabaseAccess
+
+logging = log.getLogger(__name__)
+
+
+class AsyncProcessorStateDatabaseStorage(AsyncBaseDatabaseAccess):
+    """Asyncio counterpart of ProcessorStateDatabaseStorage."""
+
+    async def fetch_processor_state_routes_by_project_id(self, project_id) -> Optional[List[ProcessorState]]:
+        return await self.execute_query_fixed(
+            sql="""
+                SELECT * FROM processor_state 
+                 WHERE state_id IN (
+                    SELECT id FROM state 
+                     WHERE project_id = %s
+                 )""",
+            params=[project_id],
+            mapper=lambda row: ProcessorState(**row)
+        )
+
+    async def fetch_processor_state_route_by_route_id(self, route_id: str) -> Optional[ProcessorState]:
+        forward_processor_state = await self.fetch_processor_state_route(route_id=route_id)
+
+        # more than one route found, this must be a storage class implementation issue
+        if forward_processor_state and len(forward_processor_state) > 1:
+            raise ValueError(f'returned too many routes for given {route_id}, there is a problem with the '
+                             f'underlying storage class implementation {type(self)}')
+
+        return forward_processor_state[0] if forward_processor_state else None
+
+    async def fetch_processor_state_route(self,
+                                          route_id: str = None,
+                                          processor_id: str = None,
+                                          state_id: str = None,
+                                          direction: ProcessorStateDirection = None,
+                                          status: ProcessorStatusCode = None) \
+            -> Optional[List[ProcessorState]]:
+        return await self.execute_query_many(
+            sql="SELECT * FROM processor_state",
+            conditions={
+                'id': route_id,
+                'processor_id': processor_id,
+                'state_id': state_id,
+                'direction': direction.value if direction else None,
+                'status': status.value if status else None
+            },
+            mapper=lambda row: ProcessorState(**row))
+
+    async def delete_processor_state_route(self, route_id: str) -> int:
+        return await self.execute_delete_query(
+            "DELETE FROM processor_state",
+            conditions={
+                "id": route_id
+            }
+        )
+
+    async def delete_processor_state_routes_by_state_id(self, state_id: str) -> int:
+        return await self.execute_delete_query(
+            "DELETE FROM processor_state",
+            conditions={
+                "state_id": state_id
+            }
+        )
+
+    async def insert_processor_state_route(self, processor_state: ProcessorState) -> ProcessorState:
+        """See ProcessorStateDatabaseStorage.insert_processor_state_route"""
+        edge_function_json = processor_state.edge_function.model_dump_json() \
+            if processor_state.edge_function else None
+
+        returned = await self.execute_returning(
+            """
+            INSERT INTO processor_state (
+                id,
+                processor_id,
+                state_id,
+                direction,
+                status,
+                count,
+                current_index,
+                maximum_index,
+                edge_function
+            )
+            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
+            ON CONFLICT (processor_id, state_id, direction)
+            DO UPDATE SET
+                count = EXCLUDED.count,
+                status = EXCLUDED.status,
+                current_index = EXCLUDED.current_index,
+                maximum_index = EXCLUDED.maximum_index,
+                edge_function = EXCLUDED.edge_function
+            RETURNING internal_id
+            """,
+            [
+                processor_state.id,
+                processor_state.processor_id,
+                processor_state.state_id,
+                processor_state.direction.value,
+                processor_state.status.value,
+                processor_state.count,
+                processor_state.current_index,
+                processor_state.maximum_index,
+                edge_function_json
+            ])
+
+        processor_state.internal_id = returned[0] \
+            if not processor_state.internal_id \
+            else processor_state.internal_id
+
+        return processor_state
+
+    async def update_processor_state_route_status(self, route_id: str, status: ProcessorStatusCode) -> int:
+        return await self.execute(
+            "UPDATE processor_state SET status = %s WHERE id = %s",
+            [status.value, route_id]
+        )
+
+    async def fetch_edge_function_config(self, route_id: str) -> Optional[EdgeFunctionConfig]:
+        result = await self.execute_query_fixed(
+            sql="SELECT edge_function FROM processor_state WHERE id = %s",
+            params=[route_id],
+            mapper=lambda row: row.get('edge_function')
+        )
+
+        if result and result[0]:
+            edge_function_data = result[0]
+            if isinstance(edge_function_data, str):
+                edge_function_data = json.loads(edge_function_data)
+            return EdgeFunctionConfig(**edge_function_data)
+        return None
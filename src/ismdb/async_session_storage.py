@@ -0,0 +1,112 @@
+import logging as log
+import uuid
+import datetime as dt
+from typing import Optional, List
+
+from ismcore.model.base_model import Session, SessionMessage
+
+from ismdb.async_base import AsyncBaseDatabaseAccess
+from ismdb.misc_utils import model_mapper
+
+logging = log.getLogger(__name__)
+
+
+class AsyncSessionDatabaseStorage(AsyncBaseDatabaseAccess):
+    """Asyncio counterpart of SessionDatabaseStorage."""
+
+    async def create_session(self, user_id: str) -> Optional[Session]:
+        session = Session(
+            session_id=str(uuid.uuid4()),
+            created_date=dt.datetime.utcnow(),
+            owner_user_id=user_id
+        )
+
+        await self.execute(
+            """INSERT INTO session (session_id, created_date, owner_user_id)
+               VALUES (%s, %s, %s)
+                   ON CONFLICT (session_id) 
+                   DO NOTHING""",
+            [
+                session.session_id,
+                session.created_date,
+                session.owner_user_id
+            ])
+
+        return session
+
+    async def fetch_session(self, user_id: str, session_id: str) -> Optional[Session]:
+        sql = """
+            select * from session 
+             where (session_id = %s and owner_user_id = %s) 
+                or session_id in (select session_id 
+                                    from user_session_access 
+                                   where session_id = %s and user_id = %s)
+        """.strip()
+
+        session = await self.execute_query_fixed(
+            sql=sql,
+            params=[session_id, user_id, session_id, user_id],
+            mapper=model_mapper(Session, trusted=True)
+        )
+
+        if not session:
+            return None
+
+        if len(session) == 1:
+            return session[0]
+
+        raise ValueError(f'invalid sessions returned for given session: {session_id},  user: {user_id}')
+
+    async def fetch_user_sessions(self, user_id: str) -> Optional[List[Session]]:
+        sql = """
+            select * from session 
+             where (owner_user_id = %s) 
+                or session_id in (select session_id 
+                                    from user_session_access 
+                                   where user_id = %s)
+        """.strip()
+
+        return await self.execute_query_fixed(
+            sql=sql,
+            params=[user_id, user_id],
+            mapper=model_mapper(Session, trusted=True)
+        )
+
+    async def fetch_user_session_access(self, user_id: str, session_id: str) -> Optional[Session]:
+        session = await self.fetch_session(user_id=user_id, session_id=session_id)
+        if not session:
+            logging.critical(f"attempt access to {session_id} from user {user_id} but no association found")
+            return None
+
+        return session
+
+    async def insert_session_message(self, message: SessionMessage) -> Optional[SessionMessage]:
+        session = await self.fetch_user_session_access(user_id=message.user_id, session_id=message.session_id)
+        if not session:
+            return None
+
+        returned = await self.execute_returning(
+            """
+            INSERT INTO session_message (session_id, user_id, original_content, executed_content, message_date)
+            VALUES (%s, %s, %s, %s, %s) RETURNING message_id
+            """,
+            [
+                message.session_id,
+                message.user_id,
+                message.original_content,
+                message.executed_content,
+                message.message_date
+            ])
+
+        message.message_id = returned[0]
+        return message
+
+    async def fetch_session_messages(self, user_id: str, session_id: str) -> Optional[List[SessionMessage]]:
+        if not await self.fetch_user_session_access(user_id=user_id, session_id=session_id):
+            return None
+
+        return await self.execute_query_many(
+            sql="SELECT * FROM session_message",
+            conditions={
+                "session_id": session_id
+            }, mapper=model_mapper(SessionMessage, trusted=True))
@@ -0,0 +1,404 @@
+import logging as log
+import uuid
+from typing import Any, Optional, Dict, List
+
+from psycopg2.extras import Json
+
+from ismcore.model.processor_state import (
+    State,
+    StateDataRowColumnData,
+    StateDataColumnDefinition,
+    StateDataColumnIndex)
+
+from ismdb.async_base import AsyncBaseDatabaseAccess, execute_async
+from ismdb.memory_cache import MemoryCache
+from ismdb.misc_utils import map_row_to_dict, create_state_id_by_state
+from ismdb.state_storage import (
+    STATE_METADATA_CACHE_SIZE,
+    STATE_METADATA_CACHE_TTL,
+    STATE_UPSERT_SQL,
+    STATE_COLUMN_UPSERT_SQL,
+    STATE_COLUMN_DATA_MAPPING_INSERT_SQL,
+    STATE_DATA_INDEXES_RESERVE_SQL,
+    STATE_DATA_INDEXES_RELEASE_SQL,
+    state_upsert_params,
+    state_column_upsert_params,
+    state_column_data_mappings_sql,
+    group_state_column_data_mappings,
+    state_hydrated_sql,
+    state_with_count,
+    hydrate_state_row,
+    state_data_by_columns_sql,
+    scatter_state_column_data)
+
+logging = log.getLogger(__name__)
+
+
+def to_text_value(value: Any) -> Optional[str]:
+    """The text form of a value for a text data column, as the database casts it on insert."""
+    if value is None or isinstance(value, str):
+        return value
+
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+
+    return str(value)
+
+
+class AsyncStateDatabaseStorage(AsyncBaseDatabaseAccess):
+    """
+    Asyncio counterpart of StateDatabaseStorage, covering the state reads and the incremental append path.
+
+    Asynchronous connections do not support COPY or executemany, column data is written as one
+    set based statement per column, the values are sent as arrays and unnested server side.
+    """
+
+    def __init__(self, database_url, incremental: bool = False, metadata_cache: MemoryCache = None):
+        super().__init__(database_url=database_url, incremental=incremental)
+
+        if metadata_cache is None and STATE_METADATA_CACHE_SIZE > 0:
+            metadata_cache = MemoryCache(maxsize=STATE_METADATA_CACHE_SIZE, ttl=STATE_METADATA_CACHE_TTL)
+
+        self.metadata_cache = metadata_cache
+
+    def invalidate_state_metadata(self, state_id: str, count: int = None, appended: bool = False):
+        """See StateDatabaseStorage.invalidate_state_metadata"""
+        if self.metadata_cache is None or not state_id:
+            return
+
+        # a new entry replaces the cached one, readers may be copying it
+        if count is not None and not self._active_transaction() and self.metadata_cache.replace(
+                state_id, lambda cached: state_with_count(cached, count=count, appended=appended)):
+            return
+
+        self.metadata_cache.delete(state_id)
+
+    async def fetch_states(self, project_id: str = None, state_type: str = None) -> Optional[List[State]]:
+        return await self.execute_query_many(
+            sql="SELECT * FROM state",
+            conditions={
+                'project_id': project_id,
+                'state_type': state_type
+            },
+            mapper=lambda row: State(**row))
+
+    async def fetch_state(self, state_id: str) -> Optional[State]:
+        return await self.execute_query_one(
+            sql="SELECT * FROM state",
+            conditions={
+                'id': state_id
+            },
+            mapper=lambda row: State(**row))
+
+    async def fetch_state_hydrated(self, state_id: str, include_columns: bool = True) -> Optional[State]:
+        """See StateDatabaseStorage.fetch_state_hydrated"""
+        if self.metadata_cache is not None:
+            cached = self.metadata_cache.get(state_id)
+            if cached is None:
+                cached = await self._fetch_state_hydrated(state_id=state_id, include_columns=True)
+
+                # uncommitted metadata of a unit of work in progress must not be cached
+                if cached is not None and not self._active_transaction():
+                    self.metadata_cache.set(state_id, cached)
+
+            if cached is None:
+                return None
+
+            state = cached.model_copy(deep=True)
+            if not include_columns:
+                state.columns = {}
+
+            return state
+
+        return await self._fetch_state_hydrated(state_id=state_id, include_columns=include_columns)
+
+    async def _fetch_state_hydrated(self, state_id: str, include_columns: bool) -> Optional[State]:
+        conn = await self.create_connection()
+
+        try:
+            cursor = await execute_async(conn, state_hydrated_sql(include_columns=include_columns), [state_id])
+            row = cursor.fetchone()
+            if not row:
+                return None
+
+            row = map_row_to_dict(cursor, row)
+        except Exception as e:
+            logging.error(e)
+            raise e
+        finally:
+            self.release_connection(conn)
+
+        return hydrate_state_row(row=row, include_columns=include_columns)
+
+    async def fetch_state_columns(self, state_id: str) -> Optional[Dict[str, StateDataColumnDefinition]]:
+        if self.metadata_cache is not None:
+            state = await self.fetch_state_hydrated(state_id=state_id, include_columns=True)
+            return state.columns if state else {}
+
+        columns = await self.execute_query_fixed(
+            sql="select * from state_column where state_id = %s",
+            params=[state_id],
+            mapper=lambda row: StateDataColumnDefinition.model_validate(row))
+
+        return {column.name: column for column in columns or [] if column.name}
+
+    async def fetch_state_data_by_columns(self, columns: Dict[str, StateDataColumnDefinition], state_count: int,
+                                          offset: int | None = None, limit: int = 1000) \
+            -> Dict[str, StateDataRowColumnData]:
+        """See StateDatabaseStorage.fetch_state_data_by_columns"""
+        column_ids = [definition.id for definition in columns.values() if definition.id is not None]
+        if not column_ids:
+            return scatter_state_column_data(
+                columns=columns, rows=[], state_count=state_count, offset=offset, limit=limit)
+
+        conn = await self.create_connection()
+        try:
+            sql, params = state_data_by_columns_sql(column_ids=column_ids, offset=offset, limit=limit)
+            cursor = await execute_async(conn, sql, params)
+
+            # scattered straight from the cursor, without a list of all the result rows
+            return scatter_state_column_data(
+                columns=columns, rows=cursor, state_count=state_count, offset=offset, limit=limit)
+        except Exception as e:
+            logging.error(e)
+            raise e
+        finally:
+            self.release_connection(conn)
+
+    async def fetch_state_column_data_mappings(self, state_id, offset: int | None = None, limit: int = 1000) \
+            -> Optional[Dict[str, StateDataColumnIndex]]:
+        conn = await self.create_connection()
+        try:
+            sql, params = state_column_data_mappings_sql(state_id=state_id, offset=offset, limit=limit)
+            cursor = await execute_async(conn, sql, params)
+            mappings = group_state_column_data_mappings(cursor)
+        except Exception as e:
+            logging.error(e)
+            raise e
+        finally:
+            self.release_connection(conn)
+
+        if not mappings:
+            logging.debug(f'no mapping found for state_id: {state_id}')
+            return None
+
+        return mappings
+
+    async def load_state_basic(self, state_id: str) -> Optional[State]:
+        return await self.fetch_state_hydrated(state_id=state_id, include_columns=False)
+
+    async def load_state_columns(self, state_id: str) -> Optional[Dict[str, StateDataColumnDefinition]]:
+        return await self.fetch_state_columns(state_id=state_id)
+
+    async def load_state_data(self, columns: Dict[str, StateDataColumnDefinition], state_count: int,
+                              offset: int | None = None, limit: int = 1000) \
+            -> Optional[Dict[str, StateDataRowColumnData]]:
+        return await self.fetch_state_data_by_columns(
+            columns=columns, state_count=state_count, offset=offset, limit=limit)
+
+    async def load_state_data_mappings(self, state_id: str, offset: int | None = None, limit: int = 1000) \
+            -> Optional[Dict[str, StateDataColumnIndex]]:
+        return await self.fetch_state_column_data_mappings(state_id=state_id, offset=offset, limit=limit)
+
+    async def load_state(self, state_id: str, load_data: bool = True, offset: int | None = None, limit: int = 1000):
+        """See StateDatabaseStorage.load_state"""
+        state = await self.fetch_state_hydrated(state_id=state_id, include_columns=True)
+
+        if not state:
+            return None
+
+        if load_data:
+            state.data = await self.load_state_data(
+                columns=state.columns, state_count=state.count, offset=offset, limit=limit)
+            state.mapping = await self.load_state_data_mappings(state_id=state_id)
+        else:
+            state.data = {}
+            state.mapping = {}
+
+        state.persisted_position = state.count - 1
+        return state
+
+    async def load_state_metadata(self, state_id: str):
+        """See StateDatabaseStorage.load_state_metadata"""
+        state = await self.fetch_state_hydrated(state_id=state_id, include_columns=True)
+
+        if not state:
+            return None
+
+        state.data = {}
+        state.mapping = {}
+        state.persisted_position = state.count - 1
+        return state
+
+    async def insert_state(self, state: State, config_uuid=False):
+        if config_uuid:
+            state.id = create_state_id_by_state(state=state)
+        else:
+            state.id = state.id if state.id else str(uuid.uuid4())
+
+        await self.execute(STATE_UPSERT_SQL, state_upsert_params(state))
+
+        self.invalidate_state_metadata(state_id=state.id)
+        return state
+
+    async def insert_state_columns(self, state: State, force_update: bool = False):
+        """See StateDatabaseStorage.insert_state_columns, all columns are written in one unit of work."""
+        state_id = create_state_id_by_state(state)
+
+        create_or_update_columns_definitions = {
+            column_name: column_definition
+            for column_name, column_definition in state.columns.items()
+            if column_definition.id is None
+        } if not force_update else state.columns
+
+        if not create_or_update_columns_definitions:
+            return
+
+        async with self.transaction():
+            for column_definition in create_or_update_columns_definitions.values():
+                returned = await self.execute_returning(
+                    STATE_COLUMN_UPSERT_SQL, state_column_upsert_params(state_id, column_definition))
+
+                if not column_definition.id:
+                    column_definition.id = returned[0]
+
+        self.invalidate_state_metadata(state_id=state_id)
+        return state_id
+
+    async def append_state_data_direct(self, state_id: str, query_states: List[Dict],
+                                       scope_variable_mappings: dict = None) -> Optional[State]:
+        """
+        See StateDatabaseStorage.append_state_data_direct, the index range is reserved up front, the column
+        data and the state key mappings are then written in one unit of work, with one statement per column.
+        """
+        if not query_states:
+            logging.warning(f'no query states provided for state_id: {state_id}')
+            return None
+
+        state = await self.load_state_metadata(state_id=state_id)
+
+        if not state:
+            logging.error(f'state not found: {state_id}')
+            return None
+
+        transformed_query_states = []
+        for entry in query_states:
+            transformed = state.apply_query_state(
+                query_state=entry,
+                skip_data_append=True,
+                scope_variable_mappings=scope_variable_mappings or {}
+            )
+            if isinstance(transformed, list):
+                transformed_query_states.extend(transformed)
+            else:
+                transformed_query_states.append(transformed)
+
+        query_states = transformed_query_states
+
+        columns = state.columns
+        if not columns:
+            logging.error(f'no columns found for state_id: {state_id} even after applying query_states')
+            return None
+
+        insert_sql_text = """
+            INSERT INTO state_column_data (column_id, data_index, data_value)
+            SELECT %s, source.data_index, source.data_value
+              FROM UNNEST(%s::bigint[], %s::text[]) AS source(data_index, data_value)
+            ON CONFLICT (column_id, data_index)
+            DO UPDATE SET data_value = EXCLUDED.data_value
+        """
+        insert_sql_json = """
+            INSERT INTO state_column_data (column_id, data_index, data_json_value)
+            SELECT %s, source.data_index, source.data_json_value
+              FROM UNNEST(%s::bigint[], %s::jsonb[]) AS source(data_index, data_json_value)
+            ON CONFLICT (column_id, data_index)
+            DO UPDATE SET data_json_value = EXCLUDED.data_json_value
+        """
+
+        await self.insert_state_columns(state=state, force_update=False)
+
+        # the index range is reserved up front, committed on its own unless within a unit of work, such that
+        # concurrent appenders do not wait on each other
+        returned = await self.execute_returning(STATE_DATA_INDEXES_RESERVE_SQL, [len(query_states), state_id])
+        new_count = returned[0]
+        start_position = new_count - len(query_states)
+        data_indexes = list(range(start_position, new_count))
+
+        try:
+            async with self.transaction():
+                for column_name, column_def in columns.items():
+                    if column_def.data_type == 'json':
+                        values = [
+                            Json(query_state.get(column_name)) if query_state.get(column_name) is not None else None
+                            for query_state in query_states
+                        ]
+                        await self.execute(insert_sql_json, [column_def.id, data_indexes, values])
+                    else:
+                        values = [to_text_value(query_state.get(column_name)) for query_state in query_states]
+                        await self.execute(insert_sql_text, [column_def.id, data_indexes, values])
+
+                mapping_pairs = [
+                    (query_state['state_key'], start_position + row_offset)
+                    for row_offset, query_state in enumerate(query_states)
+                    if query_state.get('state_key')
+                ]
+
+                if mapping_pairs:
+                    await self.execute(STATE_COLUMN_DATA_MAPPING_INSERT_SQL, [
+                        state_id,
+                        [state_key for state_key, _ in mapping_pairs],
+                        [data_index for _, data_index in mapping_pairs]
+                    ])
+        except Exception as e:
+            logging.error(f'error appending data to state {state_id}: {e}')
+            await self._release_state_data_indexes(
+                state_id=state_id, count=len(query_states), reserved_count=new_count)
+            raise e
+
+        state.count = new_count
+        state.persisted_position = new_count - 1
+        self.invalidate_state_metadata(state_id=state_id, count=new_count, appended=True)
+
+        logging.info(f'appended {len(query_states)} rows to state {state_id}, new count: {new_count}')
+        return state
+
+    async def _release_state_data_indexes(self, state_id: str, count: int, reserved_count: int):
+        """See StateDatabaseStorage._release_state_data_indexes"""
+        if self._active_transaction():
+            # the reservation is rolled back with the unit of work
+            return
+
+        try:
+            released = await self.execute(STATE_DATA_INDEXES_RELEASE_SQL, [count, state_id, reserved_count]) == 1
+        except Exception as e:
+            logging.error(f'error releasing {count} data indexes of state {state_id}: {e}')
+            return
+
+        if not released:
+            logging.warning(f'failed append left a gap of {count} rows before index {reserved_count} '
+                            f'of state {state_id}, later rows were appended since')
+        self.invalidate_state_metadata(state_id=state_id)
+
+    async def update_state_count(self, state: State) -> State:
+        await self.execute_update(
+            table="state",
+            update_values={"count": state.count},
+            conditions={"id": state.id}
+        )
+        state.persisted_position = state.count - 1
+        self.invalidate_state_metadata(state_id=state.id, count=state.count)
+        return state
+
+    async def delete_state_cascade(self, state_id):
+        """Delete the state and all its details, in one unit of work."""
+        async with self.transaction():
+            await self.execute("DELETE FROM state_column_data_mapping WHERE state_id = %s", [state_id])
+            await self.execute(
+                "DELETE FROM state_column_data WHERE column_id in (SELECT id FROM state_column WHERE state_id = %s)",
+                [state_id])
+            await self.execute("DELETE FROM state_column WHERE state_id = %s", [state_id])
+            await self.execute("DELETE FROM state_column_key_definition WHERE state_id = %s", [state_id])
+            await self.execute("DELETE FROM state_config WHERE state_id = %s", [state_id])
+            await self.execute("DELETE FROM state WHERE id = %s", [state_id])
+
+        self.invalidate_state_metadata(state_id=state_id)
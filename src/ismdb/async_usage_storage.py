@@ -0,0 +1,137 @@
+from typing import List, Type, cast, T
+
+from ismcore.model.base_model_usage_and_limits import (UsageReport, UserProjectCurrentUsageReport)
+from ismcore.storage.processor_state_storage import FieldConfig
+
+from ismdb.async_base import AsyncBaseDatabaseAccess
+from ismdb import usage_storage
+from ismdb.usage_storage import (_IDENTIFIER_RE, usage_report_from_sql, usage_report_query, usage_report_source,
+                                 user_project_current_usage_report_fields)
+
+
+class AsyncUsageDatabaseStorage(AsyncBaseDatabaseAccess):
+    """
+    Asyncio counterpart of UsageDatabaseStorage, the reports are read from the rollup tables if
+    USAGE_REPORT_ROLLUPS is set, the buckets after the watermark as of now, see usage_rollup_source_sql.
+    The rollups are refreshed by UsageDatabaseStorage.start_usage_rollup_refresher or refresh_usage_rollups.
+    """
+
+    async def _fetch_usage_report(self, granularity: str, view: str, conditions: dict) -> List[UsageReport]:
+        sql, order_by = usage_report_query(granularity, view, usage_storage.USAGE_REPORT_ROLLUPS)
+        return await self.execute_query_many2(sql, conditions, lambda row: UsageReport(**row), order_by=order_by)
+
+    async def fetch_usage_report_minutely(self, user_id, project_id, resource_id, resource_type, year, month, day, hour, minute) -> List[UsageReport]:
+        conditions = {
+            "user_id": user_id,
+            "project_id": project_id,
+            "resource_id": resource_id,
+            "resource_type": resource_type,
+            "year": year,
+            "month": month,
+            "day": day,
+            "hour": hour,
+            "minute": minute,
+        }
+
+        return await self._fetch_usage_report("minute", "USAGE_MINUTELY_V", conditions)
+
+    async def fetch_usage_report_hourly(self, user_id, project_id, resource_id, resource_type, year, month, day, hour) -> List[UsageReport]:
+        conditions = {
+            "user_id": user_id,
+            "project_id": project_id,
+            "resource_id": resource_id,
+            "resource_type": resource_type,
+            "year": year,
+            "month": month,
+            "day": day,
+            "hour": hour,
+        }
+
+        return await self._fetch_usage_report("hour", "USAGE_HOURLY_V", conditions)
+
+    async def fetch_usage_report_daily(self, user_id, project_id, resource_id, resource_type, year, month, day) -> List[UsageReport]:
+        conditions = {
+            "user_id": user_id,
+            "project_id": project_id,
+            "resource_id": resource_id,
+            "resource_type": resource_type,
+            "year": year,
+            "month": month,
+            "day": day
+        }
+
+        return await self._fetch_usage_report("day", "USAGE_DAILY_V", conditions)
+
+    async def fetch_usage_report_monthly(self, user_id, project_id, resource_id, resource_type, year, month) -> List[UsageReport]:
+        conditions = {
+            "user_id": user_id,
+            "project_id": project_id,
+            "resource_id": resource_id,
+            "resource_type": resource_type,
+            "year": year,
+            "month": month,
+        }
+
+        return await self._fetch_usage_report("month", "USAGE_MONTHLY_V", conditions)
+
+    async def fetch_usage_report_yearly(self, user_id, project_id, resource_id, resource_type, year) -> List[UsageReport]:
+        conditions = {
+            "user_id": user_id,
+            "project_id": project_id,
+            "resource_id": resource_id,
+            "resource_type": resource_type,
+            "year": year,
+        }
+
+        return await self._fetch_usage_report("year", "USAGE_YEARLY_V", conditions)
+
+    async def fetch_usage_report(self, **kwargs) -> List[UsageReport]:
+        """See UsageDatabaseStorage.fetch_usage_report"""
+        conditions_and_grouping = [field_config for field_config in kwargs.values()
+                                   if field_config is not None and isinstance(field_config, FieldConfig)]
+
+        if not conditions_and_grouping:
+            raise ValueError("At least one FieldConfig must be provided")
+
+        table_or_view = usage_report_source("usage_minutely_v", usage_storage.USAGE_REPORT_ROLLUPS)
+        return await self.execute_query_grouped(
+            usage_report_from_sql(table_or_view), conditions_and_grouping, lambda row: UsageReport(**row))
+
+    async def fetch_usage_report_generic(
+            self,
+            table_or_view: str = "usage_minutely_v",
+            model: Type[T] = cast(Type[T], UsageReport),
+            **kwargs
+    ) -> List[T]:
+        """See UsageDatabaseStorage.fetch_usage_report_generic"""
+        if not _IDENTIFIER_RE.match(table_or_view):
+            raise ValueError(f"Invalid table/view name: {table_or_view}")
+
+        table_or_view = usage_report_source(table_or_view, usage_storage.USAGE_REPORT_ROLLUPS)
+
+        conditions_and_grouping = [
+            fc for fc in kwargs.values()
+            if fc is not None and isinstance(fc, FieldConfig)
+        ]
+        if not conditions_and_grouping:
+            raise ValueError("At least one FieldConfig must be provided")
+
+        return await self.execute_query_grouped(
+            usage_report_from_sql(table_or_view),
+            conditions_and_grouping,
+            lambda row: model(**row)
+        )
+
+    async def fetch_user_project_current_usage_report(self, user_id: str,
+                                                      project_id: str = None) -> UserProjectCurrentUsageReport | None:
+        kwargs = user_project_current_usage_report_fields(user_id=user_id, project_id=project_id)
+        report = await self.fetch_usage_report_generic(**kwargs)
+
+        if not report:
+            return None
+
+        if len(report) == 1:
+            return report[0]
+
+        raise ValueError(
+            f"Expected 0 or 1 usage reports for user_id {user_id}, got {len(report)}, which is unexpected.")
@@ -1,17 +1,38 @@
+import functools
+import itertools
 import os
 import logging as log
+import threading
+import time
+from contextlib import contextmanager
 
 from ismcore.storage.processor_state_storage import FieldConfig
-from psycopg2 import pool
 from typing import List, Any, Dict, Optional, Callable, Union, Tuple
 
-from ismdb.misc_utils import map_row_to_dict
+from ismdb.connection_pool import BlockingConnectionPool
+from ismdb.misc_utils import map_rows
 
 logging = log.getLogger(__name__)
 
 MIN_DB_CONNECTIONS = int(os.environ.get("MIN_DB_CONNECTIONS", 1))
 MAX_DB_CONNECTIONS = int(os.environ.get("MAX_DB_CONNECTIONS", 5))
 
+# seconds to wait for a pooled connection when all connections are in use
+DB_CONNECTION_TIMEOUT = float(os.environ.get("DB_CONNECTION_TIMEOUT", 30))
+
+# the primary database url of the DATABASE_REPLICA_URLS
+DATABASE_URL = os.environ.get("DATABASE_URL")
+
+# comma separated read replica urls of DATABASE_URL, other database urls read from their primary unless
+# replicas are configured for them, see configure_replicas
+DATABASE_REPLICA_URLS = [url.strip() for url in os.environ.get("DATABASE_REPLICA_URLS", "").split(",") if url.strip()]
+
+# seconds the reads of a thread stay on the primary after it wrote, such that it reads its own writes
+DB_REPLICA_READ_YOUR_WRITES_SECONDS = float(os.environ.get("DB_REPLICA_READ_YOUR_WRITES_SECONDS", 0))
+
+# number of compiled where clauses cached by the shape of the conditions
+WHERE_CLAUSE_CACHE_SIZE = int(os.environ.get("WHERE_CLAUSE_CACHE_SIZE", 1024))
+
 
 class SQLNull:
     """Marker class for explicit SQL NULL checks."""
@@ -27,6 +48,211 @@ class Condition:
         self.value = value
 
 
+@functools.lru_cache(maxsize=WHERE_CLAUSE_CACHE_SIZE)
+def _compile_where_shape(shape: Tuple[Tuple[str, str], ...]) -> str:
+    clauses = []
+    for field, kind in shape:
+        if kind == 'null':
+            clauses.append(f"{field} IS NULL")
+        elif kind == 'not_null':
+            clauses.append(f"{field} IS NOT NULL")
+        elif kind == 'eq':
+            clauses.append(f"{field} = %s")
+        elif kind == 'between':
+            clauses.append(f"{field} BETWEEN %s AND %s")
+        elif kind == 'any':
+            clauses.append(f"{field} = ANY(%s)")
+        else:
+            # the operator of a Condition
+            clauses.append(f"{field} {kind} %s")
+
+    return " AND ".join(clauses)
+
+
+def compile_where(conditions: Optional[Dict[str, Any]]) -> Tuple[str, List[Any]]:
+    """
+    Compile the conditions into a where expression (without the WHERE keyword) and its parameters.
+    The expression is cached by the shape of the conditions, the field names and the kind of each
+    value, such that a repeated query shape only collects the parameters.
+
+    A condition value can be:
+        - a direct value (=)
+        - SQLNull / SQLNotNull (IS NULL / IS NOT NULL)
+        - a Condition (e.g. >, <=, ILIKE)
+        - a (min, max) tuple (BETWEEN)
+        - a list or set of values (= ANY), an empty list matches nothing
+        - None, the condition is skipped
+
+    :return: the where expression, empty if there are no conditions, and the parameters
+    """
+    shape = []
+    params = []
+
+    for field, value in (conditions or {}).items():
+        if value is None:
+            continue
+        elif value is SQLNull:
+            shape.append((field, 'null'))
+        elif value is SQLNotNull:
+            shape.append((field, 'not_null'))
+        elif isinstance(value, Condition):
+            shape.append((field, value.operator))
+            params.append(value.value)
+        elif isinstance(value, tuple) and len(value) == 2:
+            shape.append((field, 'between'))
+            params.extend(value)
+        elif isinstance(value, (list, set, frozenset)):
+            shape.append((field, 'any'))
+            params.append(list(value))
+        else:
+            shape.append((field, 'eq'))
+            params.append(value)
+
+    return _compile_where_shape(tuple(shape)), params
+
+
+def append_where(sql: str, conditions: Optional[Dict[str, Any]]) -> Tuple[str, List[Any]]:
+    """Append the compiled where clause of the conditions to the statement, see compile_where."""
+    where_sql, params = compile_where(conditions)
+    if where_sql:
+        sql += " WHERE " + where_sql
+
+    return sql, params
+
+
+def insert_query_sql(table: str, insert_values: Dict[str, Any]) -> Tuple[str, List[Any]]:
+    """The insert of a row and its parameters, the None values are left to the column defaults."""
+    columns = []
+    placeholders = []
+    params = []
+
+    for field, value in insert_values.items():
+        if value is not None:
+            columns.append(field)
+            placeholders.append("%s")
+            params.append(value)
+
+    sql = f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join(placeholders)})"
+    return sql, params
+
+
+def update_query_sql(table: str, update_values: dict, conditions: dict) -> Tuple[str, List[Any]]:
+    """The update of the rows matching the conditions and its parameters, see compile_where."""
+    set_clauses = []
+    params = []
+
+    # Prepare SET clauses
+    for field, value in update_values.items():
+        set_clauses.append(f"{field} = %s")
+        params.append(value)
+
+    # Construct the SQL statement, the WHERE parameters follow the SET parameters
+    sql, where_params = append_where(f"UPDATE {table} SET " + ", ".join(set_clauses), conditions)
+    params.extend(where_params)
+    return sql, params
+
+
+def append_order_by(sql: str, order_by: Optional[List[str]]) -> str:
+    """Append the ORDER BY clause of the order by expressions to the statement, if any."""
+    return sql + " ORDER BY " + ",".join(order_by) if order_by else sql
+
+
+def grouped_query_sql(base_sql: str, conditions_and_grouping: List[FieldConfig]) -> Tuple[str, List[Any]]:
+    """
+    The query with dynamic SELECT, WHERE, and GROUP BY clauses and its parameters, all dynamic values
+    are passed as parameters to prevent SQL injection, see BaseDatabaseAccess.execute_query_grouped.
+    """
+    params = []
+    where_clauses = []
+    group_by_fields = []
+    select_fields = []
+
+    # Iterate through the conditions_and_grouping list to build WHERE, SELECT, and GROUP BY clauses
+    for field_config in conditions_and_grouping:
+        # Handle WHERE clause conditions
+        if field_config.use_in_where and field_config.value is not None:
+            where_clauses.append(f"{field_config.field_name} = %s")
+            params.append(field_config.value)
+
+        # Check if this field has an aggregate function
+        aggregate = getattr(field_config, 'aggregate', None)
+
+        if aggregate:
+            # This is an aggregate field (e.g., SUM, MAX, AVG, COUNT)
+            aggregate_upper = aggregate.upper()
+            select_fields.append(f"{aggregate_upper}({field_config.field_name}) AS {field_config.field_name}")
+        elif field_config.use_in_group_by:
+            # This is a dimension field for grouping
+            group_by_fields.append(field_config.field_name)
+            select_fields.append(field_config.field_name)
+
+    # Append WHERE clause to SQL
+    if where_clauses:
+        base_sql += " WHERE " + " AND ".join(where_clauses)
+
+    # Construct the final SQL query
+    final_sql = f"SELECT {', '.join(select_fields)} {base_sql}"
+
+    if group_by_fields:
+        final_sql += " GROUP BY " + ", ".join(group_by_fields)
+
+    return final_sql, params
+
+
+class TransactionConnection:
+    """
+    Connection handed out to storage calls participating in a unit of work, see BaseDatabaseAccess.transaction.
+
+    The participating calls commit and release the connection as they normally would, these become
+    no-ops such that all calls share the same connection and the work is committed once, when the
+    unit of work completes.
+    """
+
+    def __init__(self, connection):
+        object.__setattr__(self, 'connection', connection)
+        object.__setattr__(self, 'depth', 1)
+        object.__setattr__(self, 'rollback_only', False)
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        # a participating call failed, the whole unit of work must be rolled back
+        object.__setattr__(self, 'rollback_only', True)
+
+    def close(self):
+        pass
+
+    def __getattr__(self, name):
+        return getattr(self.connection, name)
+
+    def __setattr__(self, name, value):
+        # the unit of work owns the transaction mode of the connection (e.g. autocommit)
+        if name == 'autocommit':
+            return
+        setattr(self.connection, name, value)
+
+
+# the active unit of work connection of the current thread, by connection pool
+_transactions = threading.local()
+
+# the read routing of the current thread, see BaseDatabaseAccessSinglePool.read_from_primary
+_routing = threading.local()
+
+
+def _mark_write(database_url: str):
+    if not hasattr(_routing, 'last_writes'):
+        _routing.last_writes = {}
+    _routing.last_writes[database_url] = time.monotonic()
+
+
+def _reset_after_fork():
+    # a unit of work of the parent process can not continue in the child, its connection is not ours
+    _transactions.__dict__.clear()
+    _routing.__dict__.clear()
+    BaseDatabaseAccessSinglePool._pools_lock = threading.Lock()
+
+
 class BaseDatabaseAccess:
 
     def __init__(self, database_url, incremental: bool = False):
@@ -39,7 +265,8 @@ class BaseDatabaseAccess:
                             f'otherwise')
 
         # self.last_data_index = 0
-        self.connection_pool = pool.SimpleConnectionPool(MIN_DB_CONNECTIONS, MAX_DB_CONNECTIONS, database_url)
+        self.connection_pool = BlockingConnectionPool(
+            MIN_DB_CONNECTIONS, MAX_DB_CONNECTIONS, database_url, timeout=DB_CONNECTION_TIMEOUT)
 
     class SqlStatement:
 
@@ -47,10 +274,64 @@ class BaseDatabaseAccess:
             self.sql = sql
             self.values = values
 
-    def create_connection(self):
+    def _active_transaction(self) -> Optional[TransactionConnection]:
+        active = getattr(_transactions, 'connections', None)
+        return active.get(id(self.connection_pool)) if active else None
+
+    @contextmanager
+    def transaction(self):
+        """
+        Unit of work, all storage calls made by the current thread within the context, on any storage
+        instance sharing this connection pool, run on one connection and are committed once on exit.
+        If any of the calls fail, all the work is rolled back. Nested units of work join the outer one.
+
+        Example:
+            with storage.transaction():
+                storage.insert_state(state=state)
+                storage.insert_state_columns(state=state)
+        """
+        active = self._active_transaction()
+        if active:
+            active.depth += 1
+            try:
+                yield active
+            finally:
+                active.depth -= 1
+            return
+
+        conn = self.connection_pool.getconn()
+        transaction = TransactionConnection(conn)
+        _mark_write(self.database_url)
+
+        if not hasattr(_transactions, 'connections'):
+            _transactions.connections = {}
+        _transactions.connections[id(self.connection_pool)] = transaction
+
+        try:
+            yield transaction
+            if transaction.rollback_only:
+                raise RuntimeError('unit of work was marked for rollback by a failed storage call')
+        except Exception:
+            conn.rollback()
+            raise
+        else:
+            # a failed commit ends the transaction, there is nothing left to roll back
+            conn.commit()
+        finally:
+            del _transactions.connections[id(self.connection_pool)]
+            self.connection_pool.putconn(conn)
+
+    def create_connection(self, read_only: bool = False):
+        transaction = self._active_transaction()
+        if transaction:
+            return transaction
+
         return self.connection_pool.getconn()
 
     def release_connection(self, conn):
+        if isinstance(conn, TransactionConnection):
+            return
+
         try:
             self.connection_pool.putconn(conn)
         except Exception as e:
@@ -58,17 +339,7 @@ class BaseDatabaseAccess:
 
     def execute_delete_query(self, sql: str, conditions: Dict[str, Any]) -> int:
         conn = self.create_connection()
-        params = []
-        where_clauses = []
-        for field, value in conditions.items():
-            if value is not None:
-                if value is SQLNull:
-                    where_clauses.append(f"{field} IS NULL")
-                else:
-                    where_clauses.append(f"{field} = %s")
-                    params.append(value)
-        if where_clauses:
-            sql += " WHERE " + " AND ".join(where_clauses)
+        sql, params = append_where(sql, conditions)
         try:
             with conn.cursor() as cursor:
                 cursor.execute(sql, params)
@@ -83,17 +354,7 @@ class BaseDatabaseAccess:
 
     def execute_insert_query(self, table: str, insert_values: Dict[str, Any]) -> int:
         conn = self.create_connection()
-        columns = []
-        placeholders = []
-        params = []
-
-        for field, value in insert_values.items():
-            if value is not None:
-                columns.append(field)
-                placeholders.append("%s")
-                params.append(value)
-
-        sql = f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join(placeholders)})"
+        sql, params = insert_query_sql(table, insert_values)
 
         try:
             with conn.cursor() as cursor:
@@ -108,28 +369,7 @@ class BaseDatabaseAccess:
 
     def execute_update(self, table: str, update_values: dict, conditions: dict) -> int | None:
         conn = self.create_connection()
-        set_clauses = []
-        where_clauses = []
-        params = []
-
-        # Prepare SET clauses
-        for field, value in update_values.items():
-            set_clauses.append(f"{field} = %s")
-            params.append(value)
-
-        # Prepare WHERE clauses
-        for field, value in conditions.items():
-            if value is not None:
-                if value is SQLNull:
-                    where_clauses.append(f"{field} IS NULL")
-                else:
-                    where_clauses.append(f"{field} = %s")
-                    params.append(value)
-
-        # Construct the SQL statement
-        sql = f"UPDATE {table} SET " + ", ".join(set_clauses)
-        if where_clauses:
-            sql += " WHERE " + " AND ".join(where_clauses)
+        sql, params = update_query_sql(table, update_values, conditions)
 
         try:
             with conn.cursor() as cursor:
@@ -144,18 +384,8 @@ class BaseDatabaseAccess:
             self.release_connection(conn)
 
     def execute_query_one(self, sql: str, conditions: dict, mapper: Callable) -> Optional[Any]:
-        conn = self.create_connection()
-        params = []
-        where_clauses = []
-        for field, value in conditions.items():
-            if value is not None:
-                if value is SQLNull:
-                    where_clauses.append(f"{field} IS NULL")
-                else:
-                    where_clauses.append(f"{field} = %s")
-                    params.append(value)
-        if where_clauses:
-            sql += " WHERE " + " AND ".join(where_clauses)
+        conn = self.create_connection(read_only=True)
+        sql, params = append_where(sql, conditions)
         try:
             with conn.cursor() as cursor:
                 cursor.execute(sql, params)
@@ -163,7 +393,7 @@ class BaseDatabaseAccess:
                 if rows:
                     if len(rows) > 1:
                         raise ValueError("Multiple rows returned when expecting a single value.")
-                    return mapper(map_row_to_dict(cursor=cursor, row=rows[0]))
+                    return map_rows(cursor, rows, mapper)[0]
                 else:
                     return None
         except Exception as e:
@@ -191,46 +421,14 @@ class BaseDatabaseAccess:
         :param mapper: Function to map the result rows to the desired format.
         :return: Optional list of mapped results.
         """
-        conn = self.create_connection()
-        params = []
-        where_clauses = []
-        group_by_fields = []
-        select_fields = []
-
-        # Iterate through the conditions_and_grouping list to build WHERE, SELECT, and GROUP BY clauses
-        for field_config in conditions_and_grouping:
-            # Handle WHERE clause conditions
-            if field_config.use_in_where and field_config.value is not None:
-                where_clauses.append(f"{field_config.field_name} = %s")
-                params.append(field_config.value)
-
-            # Check if this field has an aggregate function
-            aggregate = getattr(field_config, 'aggregate', None)
-
-            if aggregate:
-                # This is an aggregate field (e.g., SUM, MAX, AVG, COUNT)
-                aggregate_upper = aggregate.upper()
-                select_fields.append(f"{aggregate_upper}({field_config.field_name}) AS {field_config.field_name}")
-            elif field_config.use_in_group_by:
-                # This is a dimension field for grouping
-                group_by_fields.append(field_config.field_name)
-                select_fields.append(field_config.field_name)
-
-        # Append WHERE clause to SQL
-        if where_clauses:
-            base_sql += " WHERE " + " AND ".join(where_clauses)
-
-        # Construct the final SQL query
-        final_sql = f"SELECT {', '.join(select_fields)} {base_sql}"
-
-        if group_by_fields:
-            final_sql += " GROUP BY " + ", ".join(group_by_fields)
+        conn = self.create_connection(read_only=True)
+        final_sql, params = grouped_query_sql(base_sql, conditions_and_grouping)
 
         try:
             with conn.cursor() as cursor:
                 cursor.execute(final_sql, params)  # Safe parameterized query execution
                 rows = cursor.fetchall()
-                results = [mapper(map_row_to_dict(cursor=cursor, row=row)) for row in rows]
+                results = map_rows(cursor, rows, mapper)
                 return results if results else None
         except Exception as e:
             logging.error(f"Database query failed: {e}")
@@ -254,7 +452,8 @@ class BaseDatabaseAccess:
                     - direct value (uses =)
                     - Condition object (for >, <, >=, <=)
                     - tuple of (min, max) for BETWEEN
-                    - SQLNull for IS NULL
+                    - list of values for = ANY
+                    - SQLNull for IS NULL, SQLNotNull for IS NOT NULL
             mapper: Function to map results
 
         Example:
@@ -270,35 +469,15 @@ class BaseDatabaseAccess:
             :param conditions:
             :param order_by:
         """
-        conn = self.create_connection()
-        params = []
-        where_clauses = []
-
-        for field, value in conditions.items():
-            if value is not None:
-                if value is SQLNull:
-                    where_clauses.append(f"{field} IS NULL")
-                elif isinstance(value, Condition):
-                    where_clauses.append(f"{field} {value.operator} %s")
-                    params.append(value.value)
-                elif isinstance(value, tuple) and len(value) == 2:
-                    where_clauses.append(f"{field} BETWEEN %s AND %s")
-                    params.extend(value)
-                else:
-                    where_clauses.append(f"{field} = %s")
-                    params.append(value)
-
-        if where_clauses:
-            sql += " WHERE " + " AND ".join(where_clauses)
-
-        if order_by:
-            sql += f" ORDER BY " + ",".join(order_by)
+        conn = self.create_connection(read_only=True)
+        sql, params = append_where(sql, conditions)
+        sql = append_order_by(sql, order_by)
 
         try:
             with conn.cursor() as cursor:
                 cursor.execute(sql, params)
                 rows = cursor.fetchall()
-                results = [mapper(map_row_to_dict(cursor=cursor, row=row)) for row in rows]
+                results = map_rows(cursor, rows, mapper)
                 if results:
                     return results
                 else:
@@ -310,28 +489,14 @@ class BaseDatabaseAccess:
             self.release_connection(conn)
 
     def execute_query_many(self, sql: str, conditions: dict, mapper: Callable) -> Optional[List[Any]]:
-        conn = self.create_connection()
-        params = []
-        where_clauses = []
-
-        for field, value in conditions.items():
-            if value is not None:
-                if value is SQLNull:
-                    where_clauses.append(f"{field} IS NULL")
-                elif value is SQLNotNull:
-                    where_clauses.append(f"{field} IS NOT NULL")
-                else:
-                    where_clauses.append(f"{field} = %s")
-                    params.append(value)
-
-        if where_clauses:
-            sql += " WHERE " + " AND ".join(where_clauses)
+        conn = self.create_connection(read_only=True)
+        sql, params = append_where(sql, conditions)
 
         try:
             with conn.cursor() as cursor:
                 cursor.execute(sql, params)
                 rows = cursor.fetchall()
-                results = [mapper(map_row_to_dict(cursor=cursor, row=row)) for row in rows]
+                results = map_rows(cursor, rows, mapper)
                 if results:
                     return results
                 else:
@@ -343,7 +508,7 @@ class BaseDatabaseAccess:
             self.release_connection(conn)
 
     def execute_query_fixed(self, sql: str, params: Optional[List[Any]], mapper: Callable) -> Optional[List[Any]]:
-        conn = self.create_connection()
+        conn = self.create_connection(read_only=True)
         try:
             with conn.cursor() as cursor:
                 cursor.execute(sql, params)
@@ -351,7 +516,7 @@ class BaseDatabaseAccess:
                 if not rows:
                     return None
 
-                results = [mapper(map_row_to_dict(cursor, row)) for row in rows]
+                results = map_rows(cursor, rows, mapper)
 
             return results
         except Exception as e:
@@ -364,29 +529,186 @@ class BaseDatabaseAccess:
 class BaseDatabaseAccessSinglePool(BaseDatabaseAccess):
     # Class-level dictionary to store connection pools
     _pools = {}
+    _pools_lock = threading.Lock()
+
+    # Class-level pool settings by database url, applied when the pool is created
+    _pool_settings = {}
+
+    # Class-level read replica settings by primary database url, see configure_replicas
+    _replica_settings = {}
+    _replica_counter = itertools.count()
 
     def __init__(self, database_url, incremental: bool = False):
         self.database_url = database_url
         self.incremental = incremental
 
+        if incremental and database_url not in BaseDatabaseAccessSinglePool._pools:
+            logging.warning(
+                'Using incremental updates is not thread-safe. '
+                'Please ensure to synchronize save_state(State) otherwise.'
+            )
+
+        self.connection_pool = BaseDatabaseAccessSinglePool.shared_pool(database_url)
+
+    @classmethod
+    def shared_pool(cls, database_url: str) -> BlockingConnectionPool:
+        """The connection pool of a database url, created on first use and shared by all storage instances."""
         # Use existing pool if available; otherwise, create and store a new one
-        if database_url in BaseDatabaseAccessSinglePool._pools:
-            self.connection_pool = BaseDatabaseAccessSinglePool._pools[database_url]
-        else:
-            logging.info(f"establishing connection pool for with max connections: {MAX_DB_CONNECTIONS}")
-            if incremental:
-                logging.warning(
-                    'Using incremental updates is not thread-safe. '
-                    'Please ensure to synchronize save_state(State) otherwise.'
+        with BaseDatabaseAccessSinglePool._pools_lock:
+            connection_pool = BaseDatabaseAccessSinglePool._pools.get(database_url)
+            if connection_pool is None:
+                settings = BaseDatabaseAccessSinglePool._pool_settings.get(database_url, {})
+                min_connections = settings.get('min_connections', MIN_DB_CONNECTIONS)
+                max_connections = settings.get('max_connections', MAX_DB_CONNECTIONS)
+                timeout = settings.get('timeout', DB_CONNECTION_TIMEOUT)
+
+                logging.info(f"establishing connection pool for with max connections: {max_connections}")
+                connection_pool = BlockingConnectionPool(
+                    min_connections, max_connections, database_url, timeout=timeout
                 )
-            self.connection_pool = pool.SimpleConnectionPool(
-                MIN_DB_CONNECTIONS, MAX_DB_CONNECTIONS, database_url
-            )
-            BaseDatabaseAccessSinglePool._pools[database_url] = self.connection_pool
+                BaseDatabaseAccessSinglePool._pools[database_url] = connection_pool
+
+            return connection_pool
 
-    def create_connection(self):
+    @classmethod
+    def configure_replicas(cls, database_url: str,
+                           replica_urls: List[str],
+                           read_your_writes_seconds: float = None):
+        """
+        Route the reads of a database url to read replicas, defaults to the DATABASE_REPLICA_URLS and
+        DB_REPLICA_READ_YOUR_WRITES_SECONDS environment settings for DATABASE_URL, other database urls
+        read from the primary unless configured. The read helpers (execute_query_*) and the
+        explicit fetch methods use a replica pool, round robin, while writes and units of work stay on the
+        primary. Each replica url has its own pool, see configure_pool.
+
+        Replicas lag behind the primary, use read_from_primary where a read must see the preceding writes.
+
+        :param database_url: the primary database url
+        :param replica_urls: the read replica urls, none to read from the primary
+        :param read_your_writes_seconds: seconds the reads of a thread stay on the primary after it wrote
+        """
+        with cls._pools_lock:
+            cls._replica_settings[database_url] = {
+                'replica_urls': list(replica_urls or []),
+                'read_your_writes_seconds': DB_REPLICA_READ_YOUR_WRITES_SECONDS
+                if read_your_writes_seconds is None else read_your_writes_seconds,
+            }
+
+    @contextmanager
+    def read_from_primary(self):
+        """
+        Read your writes, all reads of the current thread within the context go to the primary, e.g. for a
+        single call or a whole request (session) that reads back what it wrote.
+
+        Example:
+            storage.update_state_count(state=state)
+            with storage.read_from_primary():
+                state = storage.fetch_state(state_id=state.id)
+        """
+        _routing.primary_depth = getattr(_routing, 'primary_depth', 0) + 1
         try:
-            conn = self.connection_pool.getconn()
+            yield
+        finally:
+            _routing.primary_depth -= 1
+
+    def _replica_pools(self) -> List[BlockingConnectionPool]:
+        settings = self._replica_settings.get(self.database_url)
+        if settings:
+            replica_urls = settings['replica_urls']
+        else:
+            # the replicas of the environment are replicas of DATABASE_URL only
+            replica_urls = DATABASE_REPLICA_URLS if DATABASE_URL and self.database_url == DATABASE_URL else []
+        return [self.shared_pool(replica_url) for replica_url in replica_urls]
+
+    def _read_pool(self) -> BlockingConnectionPool:
+        """The pool to read from, a replica unless the current thread must read from the primary."""
+        replica_pools = self._replica_pools()
+        if not replica_pools or getattr(_routing, 'primary_depth', 0):
+            return self.connection_pool
+
+        settings = self._replica_settings.get(self.database_url)
+        window = settings['read_your_writes_seconds'] if settings else DB_REPLICA_READ_YOUR_WRITES_SECONDS
+        if window:
+            last_write = getattr(_routing, 'last_writes', {}).get(self.database_url)
+            if last_write is not None and time.monotonic() - last_write < window:
+                return self.connection_pool
+
+        return replica_pools[next(self._replica_counter) % len(replica_pools)]
+
+    @classmethod
+    def close_all_pools(cls):
+        """
+        Close the connection pools of all database urls, e.g. on shutdown. Storage instances created
+        before the call hold on to their closed pool, new instances create a new pool.
+        """
+        with cls._pools_lock:
+            pools = list(cls._pools.values())
+            cls._pools.clear()
+
+        for connection_pool in pools:
+            connection_pool.closeall()
+
+    @classmethod
+    def reset_pools(cls):
+        """
+        Close the idle connections of all pools, the pools stay usable and reconnect on demand. Call
+        this in the parent process before forking worker processes, such that no sockets are inherited.
+
+        Forked children never use the inherited connections, each pool discards these on first use in
+        the child process (without closing them, which would terminate the sessions of the parent).
+        """
+        with cls._pools_lock:
+            pools = list(cls._pools.values())
+
+        for connection_pool in pools:
+            connection_pool.reset()
+
+    @classmethod
+    def configure_pool(cls, database_url: str,
+                       min_connections: int = None,
+                       max_connections: int = None,
+                       timeout: float = None):
+        """
+        Configure the connection pool of a database url, defaults to the MIN_DB_CONNECTIONS,
+        MAX_DB_CONNECTIONS and DB_CONNECTION_TIMEOUT environment settings. If the pool already
+        exists, the max connections and timeout are applied to the live pool.
+
+        :param database_url: the database url the pool is shared by
+        :param min_connections: the number of connections opened by the first checkout
+        :param max_connections: the maximum number of connections, checkouts wait beyond this
+        :param timeout: seconds a checkout waits for a connection before failing
+        """
+        with cls._pools_lock:
+            settings = cls._pool_settings.setdefault(database_url, {})
+            if min_connections is not None:
+                settings['min_connections'] = min_connections
+            if max_connections is not None:
+                settings['max_connections'] = max_connections
+            if timeout is not None:
+                settings['timeout'] = timeout
+
+            connection_pool = cls._pools.get(database_url)
+
+        if connection_pool:
+            connection_pool.configure(maxconn=max_connections, timeout=timeout)
+
+    def create_connection(self, read_only: bool = False):
+        """
+        A pooled connection, or the unit of work connection if one is active. Read only connections
+        come from a read replica if configured, see configure_replicas.
+        """
+        transaction = self._active_transaction()
+        if transaction:
+            return transaction
+
+        if read_only:
+            connection_pool = self._read_pool()
+        else:
+            connection_pool = self.connection_pool
+            _mark_write(self.database_url)
+
+        try:
+            conn = connection_pool.getconn()  # waits up to the pool timeout when exhausted
             if conn is None:
                 # Handle the case where no connection is available
                 logging.error('No available connection in the pool.')
@@ -397,10 +719,17 @@ class BaseDatabaseAccessSinglePool(BaseDatabaseAccess):
             raise
 
     def release_connection(self, conn):
+        if isinstance(conn, TransactionConnection):
+            return
+
         try:
             # Check if the connection is valid before returning it to the pool
             if conn:
-                self.connection_pool.putconn(conn)
+                connection_pool = self.connection_pool
+                if not connection_pool.owns(conn):
+                    connection_pool = next((replica_pool for replica_pool in self._replica_pools()
+                                            if replica_pool.owns(conn)), connection_pool)
+                connection_pool.putconn(conn)
             else:
                 logging.warning('Attempted to release a null connection.')
         except Exception as e:
@@ -409,3 +738,6 @@ class BaseDatabaseAccessSinglePool(BaseDatabaseAccess):
             if conn:
                 conn.close()
 
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
@@ -0,0 +1,429 @@
+import collections
+import logging as log
+import os
+import threading
+import time
+
+import psycopg2
+from psycopg2.extras import execute_values
+from typing import Any, Dict, List, Sequence
+
+from ismdb.connection_pool import ConnectionPoolTimeout
+from ismdb.misc_utils import copy_rows
+
+logging = log.getLogger(__name__)
+
+WRITE_METHODS = ('copy', 'insert')
+
+# the errors of an unavailable database, as opposed to the errors of the rows written
+CONNECTION_ERRORS = (psycopg2.OperationalError, psycopg2.InterfaceError, ConnectionPoolTimeout)
+
+
+class BufferedCopyWriter:
+    """
+    Thread-safe buffered writer of rows into a single table. Rows are buffered in memory and written
+    in batches, as one COPY (or one multi-row INSERT) statement per batch, on a pooled connection.
+
+    A batch is flushed when the buffer reaches batch_size rows, or on the next write once the oldest
+    buffered row is older than flush_interval seconds. Remaining rows are flushed on close.
+
+    Example:
+        with BufferedCopyWriter(pool, '"my_table"', ['"a"', '"b"'], batch_size=5000) as writer:
+            for row in rows:
+                writer.write(row)
+    """
+
+    def __init__(self,
+                 connection_pool,
+                 table: str,
+                 columns: List[str],
+                 batch_size: int = 1000,
+                 flush_interval: float = 1.0,
+                 method: str = 'copy'):
+        """
+        :param connection_pool: the pool to check out connections from, see BlockingConnectionPool
+        :param table: the target table name, quoted if required
+        :param columns: the target column names, quoted if required, in the order of the row values
+        :param batch_size: the number of rows written per statement
+        :param flush_interval: the maximum age in seconds of a buffered row before the buffer is flushed
+        :param method: copy (COPY ... FROM STDIN) or insert (multi-row INSERT ... VALUES)
+        """
+        if method not in WRITE_METHODS:
+            raise ValueError(f'unsupported write method {method}, must be one of {WRITE_METHODS}')
+
+        if batch_size < 1:
+            raise ValueError(f'invalid batch size: {batch_size}')
+
+        self.connection_pool = connection_pool
+        self.table = table
+        self.columns = columns
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.method = method
+
+        self._lock = threading.Lock()
+        self._buffer = []
+        self._buffered_at = None
+        self._closed = False
+
+        self.rows_written = 0
+        self.batches_written = 0
+        self.write_seconds = 0.0
+        self.started = time.monotonic()
+
+    def write(self, row: Sequence[Any]):
+        """Buffer a row of values, in the order of the writer columns."""
+        with self._lock:
+            if self._closed:
+                raise ValueError(f'writer for {self.table} is closed')
+
+            if not self._buffer:
+                self._buffered_at = time.monotonic()
+
+            self._buffer.append(row)
+            batch = self._take_batch(force=False)
+
+        if batch:
+            self._write_batch(batch)
+
+    def write_many(self, rows: List[Sequence[Any]]):
+        for row in rows:
+            self.write(row)
+
+    def _take_batch(self, force: bool) -> List[Sequence[Any]]:
+        """Take the buffered rows when a flush threshold is reached, must be called while holding the lock."""
+        if not self._buffer:
+            return []
+
+        expired = time.monotonic() - self._buffered_at >= self.flush_interval
+        if not (force or expired or len(self._buffer) >= self.batch_size):
+            return []
+
+        batch, self._buffer = self._buffer, []
+        self._buffered_at = None
+        return batch
+
+    def _write_batch(self, batch: List[Sequence[Any]]):
+        started = time.monotonic()
+        conn = self.connection_pool.getconn()
+
+        try:
+            with conn.cursor() as cursor:
+                # the buffer may hold more than a batch when a flush raced a write
+                for offset in range(0, len(batch), self.batch_size):
+                    rows = batch[offset:offset + self.batch_size]
+                    if self.method == 'copy':
+                        copy_rows(cursor=cursor, table=self.table, columns=self.columns, rows=rows)
+                    else:
+                        execute_values(
+                            cursor,
+                            f"INSERT INTO {self.table} ({', '.join(self.columns)}) VALUES %s",
+                            rows,
+                            page_size=len(rows))
+            conn.commit()
+        except Exception as e:
+            logging.error(f'failed to write {len(batch)} rows to {self.table}: {e}')
+            conn.rollback()
+            raise e
+        finally:
+            self.connection_pool.putconn(conn)
+
+        elapsed = time.monotonic() - started
+        with self._lock:
+            self.rows_written += len(batch)
+            self.batches_written += 1
+            self.write_seconds += elapsed
+
+        logging.debug(f'wrote {len(batch)} rows to {self.table} in {elapsed:.3f}s')
+
+    def flush(self) -> int:
+        """Write all buffered rows, regardless of the flush thresholds, returns the number of rows written."""
+        with self._lock:
+            batch = self._take_batch(force=True)
+
+        if batch:
+            self._write_batch(batch)
+
+        return len(batch)
+
+    def close(self):
+        with self._lock:
+            if self._closed:
+                return
+
+            self._closed = True
+            batch = self._take_batch(force=True)
+
+        if batch:
+            self._write_batch(batch)
+
+        stats = self.stats()
+        logging.info(f'wrote {stats["rows"]} rows to {self.table} in {stats["batches"]} batches, '
+                     f'{stats["rows_per_second"]:.0f} rows/sec')
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            elapsed = time.monotonic() - self.started
+            return {
+                'rows': self.rows_written,
+                'batches': self.batches_written,
+                'buffered': len(self._buffer),
+                'elapsed': elapsed,
+                'write_seconds': self.write_seconds,
+                'rows_per_second': self.rows_written / elapsed if elapsed else 0.0,
+            }
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class BackgroundCopyWriter(BufferedCopyWriter):
+    """
+    Buffered writer of rows into a single table, flushed by a background thread, such that a write never
+    waits on the database. The buffer holds at most max_buffered rows, a row written to a full buffer is
+    dropped (and counted), or the write blocks until the buffer has room if block_when_full.
+
+    A batch is flushed when the buffer reaches batch_size rows or once the oldest buffered row is older
+    than flush_interval seconds. Remaining rows are flushed on close. A batch that failed to be written is
+    retried once, then written row by row, such that only the offending rows fail, these are counted and
+    the most recent max_dead_letters of them are kept in dead_letters. A batch that failed on a connection
+    error is kept buffered and retried after flush_interval seconds, the database is unavailable, not the rows.
+    The rows still buffered when close gives up waiting are counted as abandoned.
+
+    The writer is fork-safe, a forked child process discards the rows buffered by the parent process, the
+    parent process writes these, and starts its own flush thread on its first write.
+    """
+
+    def __init__(self,
+                 connection_pool,
+                 table: str,
+                 columns: List[str],
+                 batch_size: int = 1000,
+                 flush_interval: float = 1.0,
+                 method: str = 'copy',
+                 max_buffered: int = 100_000,
+                 block_when_full: bool = False,
+                 max_dead_letters: int = 1000):
+        """
+        See BufferedCopyWriter for the other parameters.
+
+        :param max_buffered: the maximum number of buffered rows, at least batch_size
+        :param block_when_full: block writes to a full buffer instead of dropping the rows
+        :param max_dead_letters: the maximum number of failed rows kept in dead_letters
+        """
+        super().__init__(connection_pool=connection_pool, table=table, columns=columns, batch_size=batch_size,
+                         flush_interval=flush_interval, method=method)
+
+        if max_buffered < batch_size:
+            raise ValueError(f'invalid buffer size: {max_buffered}, must be at least the batch size {batch_size}')
+
+        self.max_buffered = max_buffered
+        self.block_when_full = block_when_full
+
+        self._condition = threading.Condition(self._lock)
+        self._thread = None
+        self._pid = os.getpid()
+
+        self.rows_dropped = 0
+        self.rows_failed = 0
+        self.rows_abandoned = 0
+        self._abandoned = False
+        self.dead_letters = collections.deque(maxlen=max_dead_letters)
+        self.last_flush_seconds = 0.0
+        self.max_flush_seconds = 0.0
+
+    def _reset_after_fork(self):
+        """Discard the state inherited from the parent process, the lock may have been held at the fork."""
+        if self._pid == os.getpid():
+            return
+
+        self._lock = threading.Lock()
+        self._condition = threading.Condition(self._lock)
+        self._buffer = []
+        self._buffered_at = None
+        self._thread = None
+        self._pid = os.getpid()
+
+    def write(self, row: Sequence[Any]) -> bool:
+        """Buffer a row of values, in the order of the writer columns, returns False if the row was dropped."""
+        self._reset_after_fork()
+
+        with self._lock:
+            if self._closed:
+                raise ValueError(f'writer for {self.table} is closed')
+
+            while len(self._buffer) >= self.max_buffered:
+                if not self.block_when_full:
+                    self.rows_dropped += 1
+                    return False
+                self._condition.wait()
+
+                if self._closed:
+                    raise ValueError(f'writer for {self.table} is closed')
+
+            if not self._buffer:
+                self._buffered_at = time.monotonic()
+            self._buffer.append(row)
+
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name=f'buffered-writer-{self.table}', daemon=True)
+                self._thread.start()
+            elif len(self._buffer) in (1, self.batch_size):
+                # the flush thread waits without a timeout on an empty buffer
+                self._condition.notify_all()
+
+        return True
+
+    def write_many(self, rows: List[Sequence[Any]]) -> int:
+        """Buffer the rows, returns the number of rows dropped."""
+        return sum(not self.write(row) for row in rows)
+
+    def _run(self):
+        while True:
+            with self._lock:
+                while not self._closed:
+                    if len(self._buffer) >= self.batch_size:
+                        break
+
+                    timeout = None
+                    if self._buffer:
+                        timeout = self._buffered_at + self.flush_interval - time.monotonic()
+                        if timeout <= 0:
+                            break
+                    self._condition.wait(timeout)
+
+                # a batch at a time, such that a backlog is written in short transactions
+                batch = self._buffer[:self.batch_size]
+                del self._buffer[:self.batch_size]
+                if not self._buffer:
+                    self._buffered_at = None
+                closed = self._closed and not self._buffer
+                # wake writers blocked on a full buffer
+                self._condition.notify_all()
+
+            if batch and not self._flush_batch(batch):
+                # the database is unavailable, the batch is retried once the flush interval passed
+                time.sleep(self.flush_interval)
+                continue
+
+            if closed:
+                return
+
+    def _flush_batch(self, batch: List[Sequence[Any]]) -> bool:
+        """
+        Write a batch, failures are logged by _write_batch. Returns False if the database is unavailable,
+        the unwritten rows are then buffered again, ahead of the rows buffered since.
+        """
+        for _ in range(2):
+            try:
+                self._write_batch(batch)
+                return True
+            except CONNECTION_ERRORS:
+                return self._rebuffer(batch)
+            except Exception:
+                pass
+
+        # the batch failed twice, write it row by row such that only the offending rows are lost
+        for index, row in enumerate(batch):
+            try:
+                self._write_batch([row])
+            except CONNECTION_ERRORS:
+                return self._rebuffer(batch[index:])
+            except Exception:
+                with self._lock:
+                    self.rows_failed += 1
+                    self.dead_letters.append(row)
+
+        return True
+
+    def _rebuffer(self, rows: List[Sequence[Any]]) -> bool:
+        """Buffer the rows of a failed batch again, unless close gave up on the buffered rows."""
+        with self._lock:
+            if self._abandoned:
+                self.rows_abandoned += len(rows)
+                return True
+
+            self._buffer[:0] = rows
+            if self._buffered_at is None:
+                self._buffered_at = time.monotonic()
+
+        logging.warning(f'database unavailable, {len(rows)} rows of {self.table} are kept buffered for a retry')
+        return False
+
+    def _write_batch(self, batch: List[Sequence[Any]]):
+        started = time.monotonic()
+        super()._write_batch(batch)
+
+        elapsed = time.monotonic() - started
+        with self._lock:
+            self.last_flush_seconds = elapsed
+            self.max_flush_seconds = max(self.max_flush_seconds, elapsed)
+
+    def flush(self) -> int:
+        """Write all buffered rows from the calling thread, returns the number of rows written."""
+        self._reset_after_fork()
+
+        with self._lock:
+            batch = self._take_batch(force=True)
+            self._condition.notify_all()
+
+        if batch:
+            self._write_batch(batch)
+
+        return len(batch)
+
+    def close(self, timeout: float = None):
+        """Flush the buffered rows and stop the flush thread, waits at most timeout seconds for the flush thread."""
+        self._reset_after_fork()
+
+        with self._lock:
+            if self._closed:
+                return
+
+            self._closed = True
+            thread = self._thread
+            batch = self._take_batch(force=True) if thread is None else []
+            self._condition.notify_all()
+
+        if thread is not None:
+            thread.join(timeout)
+        elif batch:
+            self._flush_batch(batch)
+
+        with self._lock:
+            # the rows not written by the timeout, or while the database is unavailable, are lost
+            abandoned = 0
+            if (thread is not None and thread.is_alive()) or self._buffer:
+                self._abandoned = True
+                abandoned = len(self._buffer)
+                self.rows_abandoned += abandoned
+                self._buffer = []
+                self._buffered_at = None
+
+        if abandoned:
+            logging.error(f'abandoned {abandoned} buffered rows of {self.table} on close, '
+                          f'the rows were not written within {timeout} seconds')
+
+        stats = self.stats()
+        logging.info(f'wrote {stats["rows"]} rows to {self.table} in {stats["batches"]} batches, '
+                     f'{stats["rows_per_second"]:.0f} rows/sec, {stats["dropped"]} dropped, {stats["failed"]} failed, '
+                     f'{stats["abandoned"]} abandoned')
+
+    def stats(self) -> Dict[str, Any]:
+        stats = super().stats()
+        with self._lock:
+            stats.update({
+                'max_buffered': self.max_buffered,
+                'dropped': self.rows_dropped,
+                'failed': self.rows_failed,
+                'abandoned': self.rows_abandoned,
+                'dead_letters': len(self.dead_letters),
+                'last_flush_seconds': self.last_flush_seconds,
+                'max_flush_seconds': self.max_flush_seconds,
+                'mean_flush_seconds': self.write_seconds / self.batches_written if self.batches_written else 0.0,
+            })
+        return stats
@@ -0,0 +1,321 @@
+import collections
+import logging as log
+import os
+import threading
+import weakref
+
+import psycopg2
+from psycopg2 import extensions, pool
+from typing import Optional, Dict, Any
+
+logging = log.getLogger(__name__)
+
+
+class ConnectionPoolTimeout(pool.PoolError):
+    """Raised when no connection became available within the checkout timeout."""
+    pass
+
+
+# the pools of this process, the pools inherited by a forked child process are reset after the fork
+_live_pools = weakref.WeakSet()
+
+# connections inherited from the parent process, these share the sockets of the parent process sessions and
+# must never be closed in the child process (a close terminates the session), these are referenced such that
+# they are never garbage collected either
+_inherited_connections = []
+_inherited_connection_ids = set()
+
+
+def _discard_inherited(connections):
+    for conn in connections:
+        _inherited_connections.append(conn)
+        _inherited_connection_ids.add(id(conn))
+
+
+def is_inherited_connection(conn) -> bool:
+    """Whether the connection was checked out of a pool by the parent process, before a fork."""
+    return id(conn) in _inherited_connection_ids
+
+
+def _reset_pools_after_fork():
+    for connection_pool in list(_live_pools):
+        connection_pool._reset_after_fork()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_pools_after_fork)
+
+
+class _Waiter:
+    """A thread waiting on a connection, either handed a connection or a reserved slot to connect with."""
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.conn = None
+        self.may_connect = False
+
+
+class BlockingConnectionPool:
+    """
+    Thread-safe postgres connection pool, a checkout blocks when all connections are in use
+    until one is released or the timeout expires. Waiting threads are served in FIFO order,
+    a released connection is handed directly to the longest waiting thread.
+
+    The getconn / putconn / closeall interface matches the psycopg2 pools.
+
+    No connection is established before the first checkout, which opens the minimum number of connections.
+
+    The pool is fork-safe, a forked child process discards the connections inherited from the parent
+    process, without closing them, and establishes its own connections on demand.
+    """
+
+    def __init__(self, minconn: int, maxconn: int, dsn: str, timeout: Optional[float] = None, **kwargs):
+        if maxconn < 1 or minconn < 0 or minconn > maxconn:
+            raise ValueError(f'invalid pool size, minconn: {minconn}, maxconn: {maxconn}')
+
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.timeout = timeout
+        self.closed = False
+
+        self._dsn = dsn
+        self._kwargs = kwargs
+        self._lock = threading.Lock()
+        self._idle = collections.deque()
+        self._used = {}
+        self._waiters = collections.deque()
+        self._size = 0  # open connections, including slots reserved for a connection being established
+        self._opened = False
+        self._pid = os.getpid()
+        _live_pools.add(self)
+
+    def _connect(self):
+        return psycopg2.connect(self._dsn, **self._kwargs)
+
+    def open(self):
+        """Establish the minimum number of connections, done by the first checkout if not called before."""
+        with self._lock:
+            if self._opened or self.closed:
+                return
+            self._opened = True
+            reserved = max(0, min(self.minconn, self.maxconn) - self._size)
+            self._size += reserved
+
+        for connected in range(reserved):
+            try:
+                conn = self._connect()
+            except Exception:
+                with self._lock:
+                    self._size -= reserved - connected
+                    while self._waiters and self._size < self.maxconn:
+                        self._hand_over_slot()
+                raise
+
+            # returned like any other connection, such that threads waiting in the meantime are served
+            with self._lock:
+                self._used[id(conn)] = conn
+            self.putconn(conn)
+
+    def _reset_after_fork(self):
+        """Discard the state inherited from the parent process, the lock may have been held at the fork."""
+        if self._pid == os.getpid():
+            return
+
+        _discard_inherited(list(self._idle) + list(self._used.values()))
+        self._lock = threading.Lock()
+        self._idle = collections.deque()
+        self._used = {}
+        self._waiters = collections.deque()
+        self._size = 0
+        self._pid = os.getpid()
+        logging.info(f'discarded the connections inherited from the parent process, pid: {self._pid}')
+
+    def _hand_over_slot(self):
+        """Pass a free connection slot to the first waiter, must be called while holding the lock."""
+        if self._waiters and self._size < self.maxconn:
+            waiter = self._waiters.popleft()
+            self._size += 1
+            waiter.may_connect = True
+            waiter.event.set()
+
+    def _connect_reserved(self):
+        """Establish a connection for a reserved slot, releasing the slot if the connection fails."""
+        try:
+            conn = self._connect()
+        except Exception:
+            with self._lock:
+                self._size -= 1
+                self._hand_over_slot()
+            raise
+
+        with self._lock:
+            self._used[id(conn)] = conn
+        return conn
+
+    def getconn(self, timeout: Optional[float] = None):
+        """
+        Check out a connection, waiting for up to timeout seconds (the pool timeout if not given,
+        wait indefinitely if neither is set) when all connections are in use.
+        """
+        timeout = self.timeout if timeout is None else timeout
+        self._reset_after_fork()
+        if not self._opened:
+            self.open()
+
+        with self._lock:
+            if self.closed:
+                raise pool.PoolError('connection pool is closed')
+
+            # waiters are always served first, even if a connection is idle at this very moment
+            if not self._waiters:
+                if self._idle:
+                    conn = self._idle.pop()
+                    self._used[id(conn)] = conn
+                    return conn
+
+                if self._size < self.maxconn:
+                    self._size += 1
+                    waiter = None
+                else:
+                    waiter = _Waiter()
+                    self._waiters.append(waiter)
+            else:
+                waiter = _Waiter()
+                self._waiters.append(waiter)
+
+        # a slot was reserved for this thread, establish the connection outside of the lock
+        if waiter is None:
+            return self._connect_reserved()
+
+        waiter.event.wait(timeout)
+
+        with self._lock:
+            if not waiter.event.is_set():
+                self._waiters.remove(waiter)
+                raise ConnectionPoolTimeout(
+                    f'no connection available within {timeout} seconds, '
+                    f'pool size: {self.maxconn}, waiting: {len(self._waiters)}')
+
+            if waiter.conn is not None:
+                return waiter.conn
+
+            if self.closed:
+                self._size -= 1
+                raise pool.PoolError('connection pool is closed')
+
+        return self._connect_reserved()
+
+    def putconn(self, conn, key: Any = None, close: bool = False):
+        """Return a connection to the pool, or close it and free its slot."""
+        self._reset_after_fork()
+        if is_inherited_connection(conn):
+            # checked out by the parent process, it is not part of this pool
+            return
+
+        if not close and not conn.closed:
+            # same reset as the psycopg2 pools, discard broken connections, rollback open transactions
+            status = conn.info.transaction_status
+            if status == extensions.TRANSACTION_STATUS_UNKNOWN:
+                close = True
+            elif status != extensions.TRANSACTION_STATUS_IDLE:
+                try:
+                    conn.rollback()
+                except Exception as e:
+                    # e.g. the server dropped the connection mid transaction, its slot is freed below
+                    logging.warning(f'discarding connection, rollback on release failed: {e}')
+                    close = True
+
+        with self._lock:
+            if self._used.pop(id(conn), None) is None:
+                if self.closed:
+                    # checked out before the pool was closed, the connection was already closed
+                    return
+                raise pool.PoolError('trying to put unkeyed connection')
+
+            if self.closed or close or conn.closed:
+                self._size -= 1
+                self._hand_over_slot()
+            elif self._waiters:
+                waiter = self._waiters.popleft()
+                waiter.conn = conn
+                self._used[id(conn)] = conn
+                waiter.event.set()
+                return
+            else:
+                self._idle.append(conn)
+                return
+
+        if not conn.closed:
+            conn.close()
+
+    def owns(self, conn) -> bool:
+        """Whether the connection is checked out of this pool."""
+        return id(conn) in self._used
+
+    def reset(self):
+        """
+        Close the idle connections, checked out connections are returned as usual and new connections are
+        established on demand, e.g. before forking worker processes such that no idle sockets are inherited.
+        """
+        self._reset_after_fork()
+
+        with self._lock:
+            connections = list(self._idle)
+            self._idle.clear()
+            self._size -= len(connections)
+
+        for conn in connections:
+            try:
+                conn.close()
+            except Exception as e:
+                logging.warning(f'failed to close pooled connection: {e}')
+
+    def closeall(self):
+        """Close all idle and checked out connections, waiting threads fail once woken."""
+        self._reset_after_fork()
+
+        with self._lock:
+            self.closed = True
+            connections = list(self._idle) + list(self._used.values())
+            self._idle.clear()
+            self._used.clear()
+            self._size = 0
+
+            while self._waiters:
+                waiter = self._waiters.popleft()
+                waiter.may_connect = True
+                self._size += 1
+                waiter.event.set()
+
+        for conn in connections:
+            try:
+                conn.close()
+            except Exception as e:
+                logging.warning(f'failed to close pooled connection: {e}')
+
+    def configure(self, maxconn: Optional[int] = None, timeout: Optional[float] = None):
+        """Change the maximum number of connections and or the checkout timeout of a live pool."""
+        with self._lock:
+            if maxconn is not None:
+                if maxconn < 1:
+                    raise ValueError(f'invalid pool size, maxconn: {maxconn}')
+
+                self.maxconn = maxconn
+                # growing the pool frees slots for threads that are already waiting
+                while self._waiters and self._size < self.maxconn:
+                    self._hand_over_slot()
+
+            if timeout is not None:
+                self.timeout = timeout
+
+    def stats(self) -> Dict[str, int]:
+        self._reset_after_fork()
+
+        with self._lock:
+            return {
+                'size': self._size,
+                'max': self.maxconn,
+                'idle': len(self._idle),
+                'in_use': len(self._used),
+                'waiting': len(self._waiters),
+            }
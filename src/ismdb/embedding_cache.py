@@ -0,0 +1,222 @@
+import hashlib
+import json
+import logging as log
+import threading
+
+from typing import Any, Callable, Dict, List, Optional
+
+from ismdb.base import BaseDatabaseAccessSinglePool
+from ismdb.memory_cache import MemoryCache
+
+logging = log.getLogger(__name__)
+
+DEFAULT_EMBEDDING_MODEL = 'st_minilm_l6_v2'
+
+
+def create_content_hash(text: str) -> str:
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+def serialize_embedding(embedding: Any) -> Optional[str]:
+    """The embedding as a json array of floats, as stored by the embedding cache, unless it is text already."""
+    if embedding is None or isinstance(embedding, str):
+        return embedding
+
+    # e.g. a numpy array or a tensor of shape (1, D)
+    if hasattr(embedding, 'reshape'):
+        embedding = embedding.reshape(-1)
+    if hasattr(embedding, 'tolist'):
+        embedding = embedding.tolist()
+
+    return json.dumps(embedding)
+
+
+def calculate_embeddings_each(texts: List[str]) -> List[Any]:
+    """Embed the texts one at a time with the ismcore embedding function, the default batch function."""
+    from ismcore.embedding.embedding_utils import calculate_embeddings
+
+    return [calculate_embeddings(text) for text in texts]
+
+
+def create_model_batch_embedding_function(model_name: str = DEFAULT_EMBEDDING_MODEL) \
+        -> Callable[[List[str]], List[str]]:
+    """
+    Create a batch function embedding all texts of a batch in a single forward pass of the ismcore
+    embedding model, each embedding is returned as a json array of floats.
+    """
+    from ismcore.embedding.embedding_utils import embeddings_models
+
+    if model_name not in embeddings_models:
+        raise ValueError(f'embedding model {model_name} not found in list of models available: {embeddings_models}')
+
+    embedding_model = embeddings_models[model_name]
+
+    def embed(texts: List[str]) -> List[str]:
+        embeddings = embedding_model.generate_embedding(texts)
+        return [json.dumps(embedding.reshape(-1).numpy().tolist()) for embedding in embeddings]
+
+    return embed
+
+
+class EmbeddingCacheDatabaseStorage(BaseDatabaseAccessSinglePool):
+    """
+    Persistent embedding cache, see bootstrap/migrations/003_add_embedding_cache.sql. The embeddings
+    are stored as text, such as the json arrays returned by the ismcore embedding functions.
+    """
+
+    def fetch_embeddings(self, model_name: str, content_hashes: List[str]) -> Dict[str, str]:
+        if not content_hashes:
+            return {}
+
+        rows = self.execute_query_fixed(
+            sql="""
+                SELECT content_hash, embedding
+                  FROM embedding_cache
+                 WHERE model_name = %s
+                   AND content_hash = ANY(%s)
+            """,
+            params=[model_name, content_hashes],
+            mapper=lambda row: (row['content_hash'], row['embedding']))
+
+        return dict(rows) if rows else {}
+
+    def insert_embeddings(self, model_name: str, embeddings: Dict[str, str]) -> int:
+        if not embeddings:
+            return 0
+
+        conn = self.create_connection()
+
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("""
+                    INSERT INTO embedding_cache (content_hash, model_name, embedding)
+                    SELECT source.content_hash, %s, source.embedding
+                      FROM UNNEST(%s::varchar[], %s::text[]) AS source(content_hash, embedding)
+                    ON CONFLICT (content_hash, model_name) DO NOTHING
+                """, [model_name, list(embeddings.keys()), list(embeddings.values())])
+                count = cursor.rowcount
+            conn.commit()
+            return count
+        except Exception as e:
+            logging.error(e)
+            raise e
+        finally:
+            self.release_connection(conn)
+
+
+class BatchEmbeddingCalculator:
+    """
+    Batched and cached embedding calculation. The texts of many rows are deduplicated by content hash,
+    looked up in the in-memory LRU cache and then in the optional persistent cache, the remaining
+    texts are embedded batch_size texts at a time and the results are stored in both caches.
+
+    Both caches are keyed by the model name and content hash, such that calculators of different models
+    may share a cache, and hold the embeddings as json text, see serialize_embedding.
+
+    Example:
+        calculator = BatchEmbeddingCalculator(store=EmbeddingCacheDatabaseStorage(database_url))
+        calculator.calculate_many(texts)  # prefetch the embeddings of a chunk of rows
+        calculator.calculate(texts[0])    # served from the cache
+    """
+
+    def __init__(self,
+                 embed_batch: Callable[[List[str]], List[Any]] = calculate_embeddings_each,
+                 model_name: str = DEFAULT_EMBEDDING_MODEL,
+                 batch_size: int = 64,
+                 cache: MemoryCache = None,
+                 store: Optional[EmbeddingCacheDatabaseStorage] = None):
+        """
+        :param embed_batch: function embedding a list of texts, returning one embedding per text, as json text
+            or an array of floats
+        :param model_name: the embedding model name, part of the persistent cache key
+        :param batch_size: the number of texts per embed_batch call
+        :param cache: the in-memory cache, an LRU cache of 10000 embeddings without expiry if not given
+        :param store: the persistent embedding cache, if any
+        """
+        self.embed_batch = embed_batch
+        self.model_name = model_name
+        self.batch_size = batch_size
+        self.cache = cache if cache is not None else MemoryCache(maxsize=10000, ttl=None)
+        self.store = store
+
+        self._lock = threading.Lock()
+        self.texts_embedded = 0
+        self.batches_embedded = 0
+        self.store_hits = 0
+
+    def calculate(self, text: str) -> Optional[str]:
+        return self.calculate_many([text])[0]
+
+    def calculate_many(self, texts: List[str]) -> List[Optional[str]]:
+        """Embed the texts, identical texts are embedded once, returns the embeddings in order of the texts."""
+        hashes = [create_content_hash(text) for text in texts]
+
+        # unique texts not held by the in-memory cache
+        embeddings = {}
+        missing = {}
+        for content_hash, text in zip(hashes, texts):
+            if content_hash in embeddings or content_hash in missing:
+                continue
+
+            embedding = self.cache.get((self.model_name, content_hash))
+            if embedding is not None:
+                embeddings[content_hash] = embedding
+            else:
+                missing[content_hash] = text
+
+        if missing and self.store:
+            stored = self.store.fetch_embeddings(model_name=self.model_name, content_hashes=list(missing.keys()))
+            for content_hash, embedding in stored.items():
+                self.cache.set((self.model_name, content_hash), embedding)
+                embeddings[content_hash] = embedding
+                del missing[content_hash]
+
+            with self._lock:
+                self.store_hits += len(stored)
+
+        if missing:
+            embeddings.update(self._embed(missing))
+
+        return [embeddings.get(content_hash) for content_hash in hashes]
+
+    def _embed(self, texts_by_hash: Dict[str, str]) -> Dict[str, Optional[str]]:
+        content_hashes = list(texts_by_hash.keys())
+        embeddings = {}
+
+        for offset in range(0, len(content_hashes), self.batch_size):
+            batch_hashes = content_hashes[offset:offset + self.batch_size]
+            batch_embeddings = self.embed_batch([texts_by_hash[content_hash] for content_hash in batch_hashes])
+
+            if len(batch_embeddings) != len(batch_hashes):
+                raise ValueError(f'embedding function returned {len(batch_embeddings)} embeddings '
+                                 f'for {len(batch_hashes)} texts')
+
+            embeddings.update(zip(batch_hashes, map(serialize_embedding, batch_embeddings)))
+
+            with self._lock:
+                self.texts_embedded += len(batch_hashes)
+                self.batches_embedded += 1
+
+        # texts without an embedding (None) are not cached, these are retried on the next call
+        computed = {
+            content_hash: embedding
+            for content_hash, embedding in embeddings.items()
+            if embedding is not None
+        }
+
+        for content_hash, embedding in computed.items():
+            self.cache.set((self.model_name, content_hash), embedding)
+
+        if computed and self.store:
+            self.store.insert_embeddings(model_name=self.model_name, embeddings=computed)
+
+        return embeddings
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'texts_embedded': self.texts_embedded,
+                'batches_embedded': self.batches_embedded,
+                'store_hits': self.store_hits,
+                'cache': self.cache.stats(),
+            }
@@ -2,7 +2,7 @@ import logging as log
 import datetime as dt
 import uuid
 import json
-from typing import Optional, List, Dict, Any
+from typing import Optional, List, Dict, Any, Tuple
 
 from ismcore.storage.processor_state_storage import FilterStorage
 from ismcore.model.filter import Filter, FilterItem, FilterOperator
@@ -10,6 +10,136 @@ from ismdb.base import BaseDatabaseAccessSinglePool
 
 logging = log.getLogger(__name__)
 
+# data values Filter treats as numbers: integers, or decimals (optionally with an exponent)
+NUMERIC_PATTERN = r'^\s*[-+]?([0-9]+|([0-9]+\.[0-9]*|\.[0-9]+)([eE][-+]?[0-9]+)?)\s*$'
+
+NUMERIC_OPERATORS = {
+    FilterOperator.GT: '>',
+    FilterOperator.GTE: '>=',
+    FilterOperator.LT: '<',
+    FilterOperator.LTE: '<=',
+}
+
+
+def _numeric_value(value: Any) -> Any:
+    """The value as Filter compares it with the numeric operators, None if it is not a number."""
+    if isinstance(value, bool):
+        return None
+
+    if isinstance(value, (int, float)):
+        return value
+
+    if isinstance(value, str):
+        try:
+            return int(value) if '.' not in value else float(value)
+        except ValueError:
+            return None
+
+    return None
+
+
+def compile_filter_item(filter_item: FilterItem, value_sql: str, data_type: str) -> Optional[Tuple[str, List[Any]]]:
+    """
+    Compile a filter item into a predicate on the row value expression (e.g. c0.data_value), with the
+    same outcome as Filter.apply_filter_on_data for the values of a state column.
+
+    Numeric comparisons apply to data values that Filter converts to numbers, as numeric. Where Filter
+    fails on a type mismatch (e.g. a text data value greater than a number) the row does not match.
+
+    :return: the predicate and its parameters, or None if the item can not be pushed down
+    """
+    operator = filter_item.operator or FilterOperator.EQ
+    value = filter_item.value
+    secondary_value = filter_item.secondary_value
+
+    if operator in (FilterOperator.EXISTS, FilterOperator.IS_NOT_NULL):
+        if data_type == 'json':
+            return f"coalesce(jsonb_typeof({value_sql}), 'null') <> 'null'", []
+        return f"{value_sql} IS NOT NULL", []
+
+    if operator in (FilterOperator.NOT_EXISTS, FilterOperator.IS_NULL):
+        if data_type == 'json':
+            return f"coalesce(jsonb_typeof({value_sql}), 'null') = 'null'", []
+        return f"{value_sql} IS NULL", []
+
+    # json values are compared as python values, e.g. lists and nested objects
+    if data_type == 'json':
+        return None
+
+    numeric_sql = f"(CASE WHEN {value_sql} ~ '{NUMERIC_PATTERN}' THEN {value_sql}::numeric END)"
+    numeric_value = _numeric_value(value)
+
+    if operator in (FilterOperator.EQ, FilterOperator.NE):
+        if numeric_value is not None:
+            comparison_sql = numeric_sql
+        elif isinstance(value, str):
+            comparison_sql = value_sql
+        else:
+            return None
+
+        if operator == FilterOperator.EQ:
+            return f"{comparison_sql} = %s", [numeric_value if numeric_value is not None else value]
+        return f"{comparison_sql} IS DISTINCT FROM %s", [numeric_value if numeric_value is not None else value]
+
+    if operator in NUMERIC_OPERATORS:
+        if numeric_value is not None:
+            return f"{numeric_sql} {NUMERIC_OPERATORS[operator]} %s", [numeric_value]
+        if isinstance(value, str):
+            # text order by code point, as python compares strings
+            return f"{numeric_sql} IS NULL AND {value_sql} {NUMERIC_OPERATORS[operator]} %s COLLATE \"C\"", [value]
+        return None
+
+    if operator in (FilterOperator.BETWEEN, FilterOperator.NOT_BETWEEN):
+        if secondary_value is None:
+            return ("FALSE", []) if operator == FilterOperator.BETWEEN else (f"{value_sql} IS NOT NULL", [])
+
+        numeric_secondary_value = _numeric_value(secondary_value)
+        if numeric_value is None or numeric_secondary_value is None:
+            return None
+
+        if operator == FilterOperator.BETWEEN:
+            return f"{numeric_sql} BETWEEN %s AND %s", [numeric_value, numeric_secondary_value]
+        return f"NOT ({numeric_sql} BETWEEN %s AND %s)", [numeric_value, numeric_secondary_value]
+
+    if operator in (FilterOperator.IN, FilterOperator.NOT_IN):
+        if not isinstance(value, list):
+            return ("FALSE", []) if operator == FilterOperator.IN else ("TRUE", [])
+
+        # text data values only ever equal the text values of the list
+        text_values = [item for item in value if isinstance(item, str)]
+        match_null = None in value
+
+        # a missing or null data value never matches IN, as Filter._evaluate_filter rejects None data
+        if operator == FilterOperator.IN:
+            return f"{value_sql} = ANY(%s::text[])", [text_values]
+
+        if match_null:
+            return f"({value_sql} IS NOT NULL AND {value_sql} <> ALL(%s::text[]))", [text_values]
+        return f"({value_sql} IS NULL OR {value_sql} <> ALL(%s::text[]))", [text_values]
+
+    if operator == FilterOperator.CONTAINS:
+        if not isinstance(value, str):
+            return "FALSE", []
+        return f"strpos({value_sql}, %s) > 0", [value]
+
+    if operator == FilterOperator.NOT_CONTAINS:
+        if not isinstance(value, str):
+            return "TRUE", []
+        return f"({value_sql} IS NULL OR strpos({value_sql}, %s) = 0)", [value]
+
+    if operator == FilterOperator.STARTS_WITH:
+        if not isinstance(value, str):
+            return "FALSE", []
+        return f"left({value_sql}, %s) = %s", [len(value), value]
+
+    if operator == FilterOperator.ENDS_WITH:
+        if not isinstance(value, str):
+            return "FALSE", []
+        return f"right({value_sql}, %s) = %s", [len(value), value]
+
+    # python regular expressions are not postgres regular expressions
+    return None
+
 
 class FilterDatabaseStorage(FilterStorage, BaseDatabaseAccessSinglePool):
 
@@ -98,6 +228,168 @@ class FilterDatabaseStorage(FilterStorage, BaseDatabaseAccessSinglePool):
         
         return filter.apply_filter_on_data(data)
 
+    def fetch_filtered_state_data_indexes(self, state_id: str, filter_id: str = None, filter: Filter = None) \
+            -> List[int]:
+        """
+        The data indexes of the rows of a state that match the filter, evaluated by the database.
+
+        Filter items are compiled into predicates on the state column data (see compile_filter_item),
+        one join per filtered column. Items that can not be pushed down (regular expressions, json values,
+        nested keys) are evaluated by Filter on the candidate rows the database returns.
+
+        :param state_id: the state to filter the rows of
+        :param filter_id: the stored filter to apply, unless the filter is given
+        :param filter: the filter to apply, saves fetching it when applied repeatedly
+        :return: the matching data indexes, in ascending order
+        """
+        if filter is None:
+            filter = self.fetch_filter(filter_id)
+            if not filter:
+                raise ValueError(f'filter not found: {filter_id}')
+
+        columns = {
+            column['name']: column
+            for column in self.execute_query_fixed(
+                sql="select id, name, data_type from state_column where state_id = %s",
+                params=[state_id],
+                mapper=lambda row: row) or []
+        }
+
+        joins = []
+        join_params = []
+        column_aliases = {}
+
+        def join_column(name: str) -> Optional[str]:
+            """The value expression of the column, joined once per column, None if the state has no such column."""
+            column = columns.get(name)
+            if not column:
+                return None
+
+            if name not in column_aliases:
+                alias = f"c{len(column_aliases)}"
+                joins.append(f"LEFT JOIN state_column_data {alias} "
+                             f"ON {alias}.column_id = %s AND {alias}.data_index = r.data_index")
+                join_params.append(column['id'])
+                column_aliases[name] = alias
+
+            value_column = 'data_json_value' if column['data_type'] == 'json' else 'data_value'
+            return f"{column_aliases[name]}.{value_column}"
+
+        predicates = []
+        predicate_params = []
+        fallback_items = {}
+
+        for key, filter_item in (filter.filter_items or {}).items():
+            if '.' not in key and key not in columns:
+                # the value of a missing column is None for all rows, the item either matches all or none
+                if not Filter(filter_items={key: filter_item}).apply_filter_on_data({}):
+                    return []
+                continue
+
+            compiled = None
+            if '.' not in key:
+                compiled = compile_filter_item(
+                    filter_item=filter_item,
+                    value_sql=join_column(key),
+                    data_type=columns[key]['data_type'])
+
+            if compiled is None:
+                fallback_items[key] = filter_item
+                continue
+
+            predicate_sql, params = compiled
+            predicates.append(f"({predicate_sql})")
+            predicate_params.extend(params)
+
+        # the values of the columns the fallback items are evaluated on
+        fallback_columns = {}
+        for key in fallback_items.keys():
+            root = key.split('.')[0]
+            value_sql = join_column(root)
+            if value_sql:
+                fallback_columns[root] = value_sql
+
+        select_sql = ", ".join(["r.data_index"] + [
+            f"{value_sql} AS fallback_{index}" for index, value_sql in enumerate(fallback_columns.values())])
+
+        sql = f"""
+            SELECT {select_sql}
+              FROM generate_series(0, (SELECT count - 1 FROM state WHERE id = %s)) AS r(data_index)
+              {' '.join(joins)}
+             {'WHERE ' + ' AND '.join(predicates) if predicates else ''}
+             ORDER BY r.data_index
+        """
+
+        conn = self.create_connection(read_only=True)
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute(sql, [state_id] + join_params + predicate_params)
+                rows = cursor.fetchall()
+        except Exception as e:
+            logging.error(f'failed to filter state {state_id}: {e}')
+            raise e
+        finally:
+            self.release_connection(conn)
+
+        if not fallback_items:
+            return [row[0] for row in rows]
+
+        fallback_filter = Filter(filter_items=fallback_items)
+        fallback_names = list(fallback_columns.keys())
+        return [
+            row[0] for row in rows
+            if fallback_filter.apply_filter_on_data(dict(zip(fallback_names, row[1:])))
+        ]
+
+    def fetch_filtered_state_rows(self, state_id: str, filter_id: str = None, filter: Filter = None,
+                                  columns: List[str] = None) -> List[Dict[str, Any]]:
+        """
+        The rows of a state that match the filter, see fetch_filtered_state_data_indexes, only the
+        matching rows are read.
+
+        :param columns: the names of the columns to include, all columns if not specified
+        :return: the matching rows as query state dictionaries keyed by column name, in data index order
+        """
+        data_indexes = self.fetch_filtered_state_data_indexes(state_id=state_id, filter_id=filter_id, filter=filter)
+        if not data_indexes:
+            return []
+
+        sql = """
+            SELECT sc.name, sd.data_index,
+                   CASE WHEN sc.data_type = 'json' THEN sd.data_json_value END AS data_json_value,
+                   sd.data_value
+              FROM state_column sc
+              JOIN state_column_data sd ON sd.column_id = sc.id AND sd.data_index = ANY(%s)
+             WHERE sc.state_id = %s
+        """
+        params = [data_indexes, state_id]
+        if columns:
+            sql += " AND sc.name = ANY(%s)"
+            params.append(columns)
+
+        column_names = columns or [
+            column['name'] for column in self.execute_query_fixed(
+                sql="select name from state_column where state_id = %s order by id",
+                params=[state_id],
+                mapper=lambda row: row) or []
+        ]
+
+        rows = {data_index: dict.fromkeys(column_names) for data_index in data_indexes}
+
+        conn = self.create_connection(read_only=True)
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute(sql, params)
+                for name, data_index, data_json_value, data_value in cursor:
+                    rows[data_index][name] = data_json_value if data_json_value is not None else data_value
+        except Exception as e:
+            logging.error(f'failed to fetch filtered rows of state {state_id}: {e}')
+            raise e
+        finally:
+            self.release_connection(conn)
+
+        return list(rows.values())
+
     def _map_row_to_filter(self, row) -> Filter:
         filter_items = row['filter_items'] if row.get('filter_items') else {}
 
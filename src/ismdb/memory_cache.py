@@ -0,0 +1,120 @@
+import collections
+import threading
+import time
+
+from typing import Any, Callable, Dict, Optional
+
+# the ttl argument of MemoryCache.set, when not given
+_DEFAULT_TTL = object()
+
+
+class MemoryCache:
+    """
+    Thread-safe in-process LRU cache with a time to live per entry. When the cache is full the least
+    recently used entry is evicted, expired entries are dropped when they are looked up.
+
+    The get / set / delete interface matches RedisCache.
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl: Optional[float] = 60):
+        if maxsize < 1:
+            raise ValueError(f'invalid cache size, maxsize: {maxsize}')
+
+        self.maxsize = maxsize
+        self.ttl = ttl
+
+        self._lock = threading.Lock()
+        self._entries = collections.OrderedDict()  # key -> (expires_at, value)
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def _lookup(self, key: str) -> Any:
+        """Return the live value of the key or None, must be called while holding the lock."""
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+
+        expires_at, value = entry
+        if expires_at is not None and expires_at <= time.monotonic():
+            del self._entries[key]
+            self.expirations += 1
+            return None
+
+        return value
+
+    def get(self, key: str) -> Any:
+        with self._lock:
+            value = self._lookup(key)
+            if value is None:
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def peek(self, key: str) -> Any:
+        """Return the value without counting a hit or miss and without refreshing its recency."""
+        with self._lock:
+            return self._lookup(key)
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = _DEFAULT_TTL):
+        """Cache the value, with the ttl of the cache unless a ttl is given, a ttl of None never expires."""
+        ttl = self.ttl if ttl is _DEFAULT_TTL else ttl
+        expires_at = time.monotonic() + ttl if ttl is not None else None
+
+        with self._lock:
+            self._entries[key] = (expires_at, value)
+            self._entries.move_to_end(key)
+
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def replace(self, key: str, update: Callable[[Any], Any]) -> bool:
+        """
+        Replace the live value of the key by update(value) while holding the lock, keeping its expiry and recency.
+        The update returns a new value rather than modifying the cached one, which other threads may be reading.
+
+        :return: whether the key had a live value to replace
+        """
+        with self._lock:
+            value = self._lookup(key)
+            if value is None:
+                return False
+
+            expires_at, _ = self._entries[key]
+            self._entries[key] = (expires_at, update(value))
+            return True
+
+    def delete(self, key: str):
+        with self._lock:
+            if self._entries.pop(key, None) is not None:
+                self.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self.invalidations += len(self._entries)
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'maxsize': self.maxsize,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': self.hits / lookups if lookups else 0.0,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'invalidations': self.invalidations,
+            }
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
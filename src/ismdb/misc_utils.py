@@ -1,8 +1,10 @@
+import json
 import logging as log
-from typing import Type
+from typing import Type, Iterable, Sequence, Any, List, Callable, Tuple
 
 from ismcore.model.processor_state import StateConfig, StateConfigLM, State
 from ismcore.utils import general_utils
+from pydantic import BaseModel
 
 logging = log.getLogger(__name__)
 
@@ -26,21 +28,121 @@ def create_state_id_by_state(state: State):
         return state.id
 
 
+def cursor_columns(cursor) -> Tuple[str, ...]:
+    """ The column names of the result set of the cursor. """
+    return tuple(col[0] for col in cursor.description)
+
+
 def map_row_to_dict(cursor, row):
     """ Maps a single row to a dictionary using column names from the cursor. """
-    columns = [col[0] for col in cursor.description]
-    return dict(zip(columns, row))
+    return dict(zip(cursor_columns(cursor), row))
 
 
 def map_rows_to_dicts(cursor, rows):
-    """ Maps a list of rows to a list of dictionaries using column names from the cursor. """
-    return [map_row_to_dict(cursor, row) for row in rows]
+    """ Maps a list of rows to a list of dictionaries, the column names are read once per result set. """
+    columns = cursor_columns(cursor)
+    return [dict(zip(columns, row)) for row in rows]
+
+
+def map_rows(cursor, rows, mapper: Callable[[dict], Any]) -> List[Any]:
+    """ Maps a list of rows with the mapper, the column names are read once per result set. """
+    columns = cursor_columns(cursor)
+    return [mapper(dict(zip(columns, row))) for row in rows]
 
 
 def map_rows_to_types(cursor, rows, type_: Type):
-    """ Maps a list of rows to a list of dictionaries using column names from the cursor. """
-    return [type_(**map_row_to_dict(cursor, row)) for row in rows]
+    """ Maps a list of rows to a list of instances of the type, using column names from the cursor. """
+    return map_rows(cursor, rows, lambda row: type_(**row))
+
+
+def model_mapper(model: Type[BaseModel], trusted: bool = False) -> Callable[[dict], Any]:
+    """
+    A row mapper to the pydantic model. A trusted mapper builds the model with model_construct,
+    without validation, the row values are used as returned by the database: columns that are not
+    fields of the model are dropped and values are not coerced (e.g. no str to Enum or Decimal to
+    float conversion), only use it for models whose field types match the column types.
+    """
+    if trusted:
+        construct = model.model_construct
+        return lambda row: construct(**row)
+
+    return lambda row: model(**row)
 
 
 def map_dict_to_type(data: dict, type_: Type):
     return type_(**data)
+
+
+def format_copy_value(value: Any) -> str:
+    """ Formats a single value in the postgres COPY text format (tab delimited, \\N for null). """
+    if value is None:
+        return '\\N'
+
+    if isinstance(value, bool):
+        value = 'true' if value else 'false'
+    elif isinstance(value, (dict, list)):
+        value = json.dumps(value)
+    elif not isinstance(value, str):
+        value = str(value)
+
+    return (value
+            .replace('\\', '\\\\')
+            .replace('\t', '\\t')
+            .replace('\n', '\\n')
+            .replace('\r', '\\r'))
+
+
+def format_copy_row(row: Sequence[Any]) -> str:
+    """ Formats a row of values as a single line in the postgres COPY text format. """
+    return '\t'.join(format_copy_value(value) for value in row) + '\n'
+
+
+class CopyRowStream:
+    """
+    File-like reader over an iterable of rows, used as the source of a COPY ... FROM STDIN.
+
+    Rows are formatted lazily as psycopg2 reads from the stream, such that only a single
+    read buffer is held in memory regardless of the number of rows being copied.
+    """
+
+    def __init__(self, rows: Iterable[Sequence[Any]]):
+        self._lines = (format_copy_row(row) for row in rows)
+        self._buffer = ''
+        self.row_count = 0
+
+    def read(self, size: int = -1) -> str:
+        pieces = [self._buffer]
+        length = len(self._buffer)
+
+        while size < 0 or length < size:
+            line = next(self._lines, None)
+            if line is None:
+                break
+
+            pieces.append(line)
+            length += len(line)
+            self.row_count += 1
+
+        data = ''.join(pieces)
+        if size < 0 or len(data) <= size:
+            self._buffer = ''
+            return data
+
+        self._buffer = data[size:]
+        return data[:size]
+
+
+def copy_rows(cursor, table: str, columns: List[str], rows: Iterable[Sequence[Any]]) -> int:
+    """
+    Streams rows into the given table using COPY ... FROM STDIN.
+
+    :param cursor: an open psycopg2 cursor, the caller is responsible for the transaction
+    :param table: the target table (or temporary staging table) name
+    :param columns: the list of column names, in the same order as the values of each row
+    :param rows: an iterable of row value sequences
+    :return: the number of rows copied
+    """
+    stream = CopyRowStream(rows)
+    sql = f"COPY {table} ({', '.join(columns)}) FROM STDIN"
+    cursor.copy_expert(sql, stream)
+    return stream.row_count
@@ -6,6 +6,7 @@ from ismcore.model.base_model import MonitorLogEvent
 from ismcore.storage.processor_state_storage import MonitorLogEventStorage
 
 from .base import BaseDatabaseAccessSinglePool
+from .misc_utils import model_mapper
 
 logging = log.getLogger(__name__)
 
@@ -50,7 +51,7 @@ class MonitorLogEventDatabaseStorage(MonitorLogEventStorage, BaseDatabaseAccessS
                 'project_id': project_id,
                 'log_time': (start_date, end_date)
             },
-            mapper=lambda row: MonitorLogEvent(**row),
+            mapper=model_mapper(MonitorLogEvent, trusted=True),
             order_by=order_by
         )
 
@@ -1,46 +1,180 @@
+import importlib
 import logging as log
+import threading
+from functools import lru_cache, wraps
+from typing import Dict
 
-from ismcore.storage.processor_state_storage import StateMachineStorage
-
-from ismdb.configmap_storage import ConfigMapDatabaseStorage
-from ismdb.monitor_storage import MonitorLogEventDatabaseStorage
-from ismdb.processor_provider_storage import ProcessorProviderDatabaseStorage
-from ismdb.processor_state_storage import ProcessorStateDatabaseStorage
-from ismdb.processor_storage import ProcessorDatabaseStorage
-from ismdb.session_storage import SessionDatabaseStorage
-from ismdb.state_action_storage import StateActionDatabaseStorage
-from ismdb.state_storage import StateDatabaseStorage
-from ismdb.template_storage import TemplateDatabaseStorage
-from ismdb.usage_storage import UsageDatabaseStorage
-from ismdb.user_project_storage import UserProjectDatabaseStorage
-from ismdb.user_storage import UserProfileDatabaseStorage
-from ismdb.vault_storage import VaultDatabaseStorage
-from ismdb.workflow_storage import WorkflowDatabaseStorage
-from ismdb.filter import FilterDatabaseStorage
+from ismcore.storage.processor_state_storage import (
+    StateMachineStorage,
+    StateStorage,
+    ProcessorStorage,
+    ProcessorStateRouteStorage,
+    ProcessorProviderStorage,
+    WorkflowStorage,
+    TemplateStorage,
+    UserProfileStorage,
+    UserProjectStorage,
+    MonitorLogEventStorage,
+    UsageStorage,
+    SessionStorage,
+    StateActionStorage,
+    VaultStorage,
+    ConfigMapStorage,
+    FilterStorage,
+)
+
+from ismdb.memory_cache import MemoryCache
 
 logging = log.getLogger(__name__)
 
+# the storages in delegate order (later storages take precedence for shared method names, as with the
+# forwarding metaclass), by name: interface, implementing module and class, imported on first use
+STORAGES = {
+    'state_storage': (StateStorage, 'ismdb.state_storage', 'StateDatabaseStorage'),
+    'processor_storage': (ProcessorStorage, 'ismdb.processor_storage', 'ProcessorDatabaseStorage'),
+    'processor_state_storage': (
+        ProcessorStateRouteStorage, 'ismdb.processor_state_storage', 'ProcessorStateDatabaseStorage'),
+    'processor_provider_storage': (
+        ProcessorProviderStorage, 'ismdb.processor_provider_storage', 'ProcessorProviderDatabaseStorage'),
+    'workflow_storage': (WorkflowStorage, 'ismdb.workflow_storage', 'WorkflowDatabaseStorage'),
+    'template_storage': (TemplateStorage, 'ismdb.template_storage', 'TemplateDatabaseStorage'),
+    'user_profile_storage': (UserProfileStorage, 'ismdb.user_storage', 'UserProfileDatabaseStorage'),
+    'user_project_storage': (UserProjectStorage, 'ismdb.user_project_storage', 'UserProjectDatabaseStorage'),
+    'monitor_log_event_storage': (
+        MonitorLogEventStorage, 'ismdb.monitor_storage', 'MonitorLogEventDatabaseStorage'),
+    'usage_storage': (UsageStorage, 'ismdb.usage_storage', 'UsageDatabaseStorage'),
+    'session_storage': (SessionStorage, 'ismdb.session_storage', 'SessionDatabaseStorage'),
+    'state_action_storage': (StateActionStorage, 'ismdb.state_action_storage', 'StateActionDatabaseStorage'),
+    'vault_storage': (VaultStorage, 'ismdb.vault_storage', 'VaultDatabaseStorage'),
+    'config_map_storage': (ConfigMapStorage, 'ismdb.configmap_storage', 'ConfigMapDatabaseStorage'),
+    'filter_storage': (FilterStorage, 'ismdb.filter', 'FilterDatabaseStorage'),
+}
+
+# the storage serving each interface method, the last storage declaring a method wins
+INTERFACE_METHODS = {
+    method_name: storage_name
+    for storage_name, (interface, _, _) in STORAGES.items()
+    for method_name, method in vars(interface).items()
+    if not method_name.startswith('_') and callable(method)
+}
+
+
+@lru_cache(maxsize=None)
+def storage_methods() -> Dict[str, str]:
+    """
+    The storage serving each public method of the storage classes, including the methods outside of the
+    interfaces, the last storage declaring a method wins. Imports all the storage modules on first call.
+    """
+    methods = {}
+    for storage_name, (_, module_name, class_name) in STORAGES.items():
+        storage_class = getattr(importlib.import_module(module_name), class_name)
+        for method_name in dir(storage_class):
+            if not method_name.startswith('_') and callable(getattr(storage_class, method_name, None)):
+                methods[method_name] = storage_name
+
+    return methods
+
+
+def _lazy_delegate(storage_name: str):
+    def get_storage(self):
+        return self._storage(storage_name)
+
+    def set_storage(self, storage):
+        # the StateMachineStorage constructor assigns the delegates, none are passed, see __init__
+        if storage is not None:
+            self._storages[storage_name] = storage
+
+    return property(get_storage, set_storage)
+
 
 class PostgresDatabaseStorage(StateMachineStorage):
+    """
+    All the postgres storages behind the StateMachineStorage interface. The storages are created on first
+    use of one of their methods, their modules are imported at that point, such that short-lived processes
+    only pay for the storages they use. The connection pool is shared by all storages of a database url and
+    connects on first checkout.
+    """
+
+    _delegate_state_storage = _lazy_delegate('state_storage')
+    _delegate_processor_storage = _lazy_delegate('processor_storage')
+    _delegate_processor_state_storage = _lazy_delegate('processor_state_storage')
+    _delegate_processor_provider_storage = _lazy_delegate('processor_provider_storage')
+    _delegate_workflow_storage = _lazy_delegate('workflow_storage')
+    _delegate_template_storage = _lazy_delegate('template_storage')
+    _delegate_user_profile_storage = _lazy_delegate('user_profile_storage')
+    _delegate_user_project_storage = _lazy_delegate('user_project_storage')
+    _delegate_monitor_log_event_storage = _lazy_delegate('monitor_log_event_storage')
+    _delegate_usage_storage = _lazy_delegate('usage_storage')
+    _delegate_session_storage = _lazy_delegate('session_storage')
+    _delegate_state_action_storage = _lazy_delegate('state_action_storage')
+    _delegate_vault_storage = _lazy_delegate('vault_storage')
+    _delegate_config_map_storage = _lazy_delegate('config_map_storage')
+    _delegate_filter_storage = _lazy_delegate('filter_storage')
+
+    def __init__(self, database_url: str, incremental: bool = True, state_metadata_cache: MemoryCache = None,
+                 *args, **kwargs):
+        self.database_url = database_url
+        self.incremental = incremental
+        self.state_metadata_cache = state_metadata_cache
+        self._storages = {}
+        self._storages_lock = threading.Lock()
+
+        # no delegates are passed, the forwarding metaclass would create all storages to bind their methods
+        super().__init__()
+
+        for method_name, storage_name in INTERFACE_METHODS.items():
+            setattr(self, method_name, self._forwarder(storage_name, method_name))
+
+    def _forwarder(self, storage_name: str, method_name: str):
+        interface = STORAGES[storage_name][0]
+
+        @wraps(getattr(interface, method_name))
+        def forward(*args, **kwargs):
+            return getattr(self._storage(storage_name), method_name)(*args, **kwargs)
+
+        return forward
+
+    def _create_storage(self, storage_name: str):
+        _, module_name, class_name = STORAGES[storage_name]
+        storage_class = getattr(importlib.import_module(module_name), class_name)
+
+        if storage_name == 'state_storage':
+            return storage_class(database_url=self.database_url, incremental=self.incremental,
+                                 metadata_cache=self.state_metadata_cache)
+
+        return storage_class(database_url=self.database_url, incremental=self.incremental)
+
+    def _storage(self, storage_name: str):
+        storage = self._storages.get(storage_name)
+        if storage is not None:
+            return storage
+
+        with self._storages_lock:
+            storage = self._storages.get(storage_name)
+            if storage is None:
+                storage = self._create_storage(storage_name)
+                self._storages[storage_name] = storage
+
+                # replace the forwarders of the storage by its bound methods, later calls go direct
+                for method_name, owner in INTERFACE_METHODS.items():
+                    if owner == storage_name:
+                        setattr(self, method_name, getattr(storage, method_name))
+
+        return storage
+
+    def __getattr__(self, name):
+        # only called for attributes not found otherwise, i.e. storage methods outside of the interfaces
+        if name.startswith('_') or '_storages' not in self.__dict__:
+            raise AttributeError(f"'{type(self).__name__}' object has no attribute '{name}'")
+
+        storage_name = storage_methods().get(name)
+        if storage_name is None:
+            raise AttributeError(f"'{type(self).__name__}' object has no attribute '{name}'")
 
-    def __init__(self, database_url: str, incremental: bool = True, *args, **kwargs):
-        super().__init__(
-            state_storage=StateDatabaseStorage(database_url=database_url, incremental=incremental),
-            processor_storage=ProcessorDatabaseStorage(database_url=database_url, incremental=incremental),
-            processor_state_storage=ProcessorStateDatabaseStorage(database_url=database_url, incremental=incremental),
-            processor_provider_storage=ProcessorProviderDatabaseStorage(database_url=database_url, incremental=incremental),
-            workflow_storage=WorkflowDatabaseStorage(database_url=database_url, incremental=incremental),
-            template_storage=TemplateDatabaseStorage(database_url=database_url, incremental=incremental),
-            user_profile_storage=UserProfileDatabaseStorage(database_url=database_url, incremental=incremental),
-            user_project_storage=UserProjectDatabaseStorage(database_url=database_url, incremental=incremental),
-            monitor_log_event_storage=MonitorLogEventDatabaseStorage(database_url=database_url, incremental=incremental),
-            usage_storage=UsageDatabaseStorage(database_url=database_url, incremental=incremental),
-            session_storage=SessionDatabaseStorage(database_url=database_url, incremental=incremental),
-            state_action_storage=StateActionDatabaseStorage(database_url=database_url, incremental=incremental),
-            vault_storage=VaultDatabaseStorage(database_url=database_url, incremental=incremental),
-            config_map_storage=ConfigMapDatabaseStorage(database_url=database_url, incremental=incremental),
-            filter_storage=FilterDatabaseStorage(database_url=database_url, incremental=incremental),
-        )
+        # bound to the instance, later lookups no longer get here
+        method = getattr(self._storage(storage_name), name)
+        setattr(self, name, method)
+        return method
 
 #
 # class PostgresDatabaseWithRedisCacheStorage(PostgresDatabaseStorage):
@@ -7,6 +7,7 @@ from ismcore.model.base_model import Session, SessionMessage
 from ismcore.storage.processor_state_storage import SessionStorage
 
 from ismdb.base import BaseDatabaseAccessSinglePool
+from ismdb.misc_utils import model_mapper
 
 logging = log.getLogger(__name__)
 
@@ -55,7 +56,7 @@ class SessionDatabaseStorage(SessionStorage, BaseDatabaseAccessSinglePool):
         session = self.execute_query_fixed(
             sql=sql,
             params=[session_id, user_id, session_id, user_id],
-            mapper=lambda row: Session(**row)
+            mapper=model_mapper(Session, trusted=True)
         )
 
         if not session:
@@ -78,7 +79,7 @@ class SessionDatabaseStorage(SessionStorage, BaseDatabaseAccessSinglePool):
         sessions = self.execute_query_fixed(
             sql=sql,
             params=[user_id, user_id],
-            mapper=lambda row: Session(**row)
+            mapper=model_mapper(Session, trusted=True)
         )
 
         return sessions
@@ -136,7 +137,7 @@ class SessionDatabaseStorage(SessionStorage, BaseDatabaseAccessSinglePool):
             sql="SELECT * FROM session_message",
             conditions={
                 "session_id": session_id
-            }, mapper=lambda row: SessionMessage(**row))
+            }, mapper=model_mapper(SessionMessage, trusted=True))
 
     def delete_session(self, session_id: str) -> int:
         raise NotImplementedError()
@@ -0,0 +1,103 @@
+import logging as log
+import time
+from typing import Any, BinaryIO, Dict, List, Union
+
+from ismdb.state_storage import StateDatabaseStorage
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    raise ImportError("Please install the 'pyarrow' package to use the state export functions")
+
+logging = log.getLogger(__name__)
+
+EXPORT_FORMATS = ('parquet', 'arrow')
+
+
+def pivot_state_data_chunk(rows: List[tuple], column_names: List[str], offset: int, size: int) \
+        -> Dict[str, List[Any]]:
+    """
+    Pivot a chunk of long format (column_name, data_index, data_value) rows, as returned by
+    fetch_state_data_chunk_for_export, into one dense value list per column.
+    """
+    columns = {column: [None] * size for column in column_names}
+
+    for column_name, data_index, data_value in rows:
+        values = columns.get(column_name)
+        index = data_index - offset
+        if values is not None and 0 <= index < size:
+            values[index] = data_value
+
+    return columns
+
+
+def export_state_data(storage: StateDatabaseStorage,
+                      state_id: str,
+                      sink: Union[str, BinaryIO],
+                      file_format: str = 'parquet',
+                      chunk_size: int = 10000,
+                      include_index: bool = True,
+                      compression: str = 'snappy') -> int:
+    """
+    Export the data of a state to a Parquet or Arrow IPC file, without loading the state. The data is
+    fetched chunk_size rows at a time, each chunk is pivoted into a columnar record batch and written
+    out before the next chunk is fetched, such that memory is bounded by the chunk size.
+
+    All data columns are exported as strings, json columns as their json text.
+
+    :param storage: the state storage to read the state data from
+    :param state_id: the state to export
+    :param sink: a file path or a writable binary file-like object
+    :param file_format: parquet or arrow (Arrow IPC file format)
+    :param chunk_size: the number of rows fetched and written per record batch
+    :param include_index: whether to add the data_index of each row as the first column
+    :param compression: the parquet compression codec, ignored for arrow
+    :return: the number of rows exported
+    """
+    if file_format not in EXPORT_FORMATS:
+        raise ValueError(f'unsupported export format {file_format}, must be one of {EXPORT_FORMATS}')
+
+    state = storage.fetch_state(state_id=state_id)
+    if not state:
+        raise ValueError(f'state not found: {state_id}')
+
+    columns = storage.fetch_state_columns(state_id=state_id) or {}
+    column_names = [
+        column for column, definition in sorted(
+            columns.items(), key=lambda item: (item[1].display_order or 0, item[1].id or 0))
+    ]
+
+    fields = [pa.field(column, pa.string()) for column in column_names]
+    if include_index:
+        fields.insert(0, pa.field('data_index', pa.int64()))
+    schema = pa.schema(fields)
+
+    if file_format == 'parquet':
+        writer = pq.ParquetWriter(sink, schema, compression=compression)
+    else:
+        writer = pa.ipc.new_file(sink, schema)
+
+    started = time.monotonic()
+    exported = 0
+
+    try:
+        for offset in range(0, state.count, chunk_size):
+            size = min(chunk_size, state.count - offset)
+            rows = storage.fetch_state_data_chunk_for_export(state_id=state_id, offset=offset, limit=size)
+            chunk = pivot_state_data_chunk(rows=rows, column_names=column_names, offset=offset, size=size)
+
+            arrays = [pa.array(chunk[column], type=pa.string()) for column in column_names]
+            if include_index:
+                arrays.insert(0, pa.array(range(offset, offset + size), type=pa.int64()))
+
+            writer.write_batch(pa.RecordBatch.from_arrays(arrays, schema=schema))
+            exported += size
+    finally:
+        writer.close()
+
+    elapsed = time.monotonic() - started
+    logging.info(f'exported {exported} rows of state {state_id} to {file_format} in {elapsed:.2f}s '
+                 f'({exported / elapsed if elapsed else 0:.0f} rows/sec)')
+
+    return exported
@@ -1,8 +1,9 @@
 import json
 import logging as log
+import os
 import uuid
 
-from typing import Any, Optional, Dict, List, Callable
+from typing import Any, Optional, Dict, List, Callable, Tuple, Iterator, Iterable
 from psycopg2.extras import Json
 
 from ismcore.model.processor_state import (
@@ -20,15 +21,294 @@ from ismcore.model.processor_state import (
     StateConfigCode)
 from ismcore.storage.processor_state_storage import StateStorage
 from ismdb.base import BaseDatabaseAccessSinglePool
-from ismdb.misc_utils import map_rows_to_dicts, create_state_id_by_state
+from ismdb.memory_cache import MemoryCache
+from ismdb.misc_utils import map_rows_to_dicts, create_state_id_by_state, copy_rows
 
 logging = log.getLogger(__name__)
 
+# in-process cache of the state metadata (state, config and columns) by state id, disabled when 0
+STATE_METADATA_CACHE_SIZE = int(os.environ.get("STATE_METADATA_CACHE_SIZE", 0))
+STATE_METADATA_CACHE_TTL = float(os.environ.get("STATE_METADATA_CACHE_TTL", 60))
+
+
+# the upsert of a state, see state_upsert_params
+STATE_UPSERT_SQL = """
+    INSERT INTO state (id, project_id, state_type, properties)
+    VALUES (%s, %s, %s, %s)
+    ON CONFLICT (id)
+    DO UPDATE SET
+        state_type = EXCLUDED.state_type,
+        properties = EXCLUDED.properties
+"""
+
+# the upsert of a state column definition returning its id, see state_column_upsert_params
+STATE_COLUMN_UPSERT_SQL = """
+    INSERT INTO state_column (
+        id,
+        state_id,
+        name,
+        data_type,
+        required,
+        callable,
+        min_length,
+        max_length,
+        dimensions,
+        value,
+        source_column_name,
+        display_order)
+    VALUES (
+        COALESCE(validate_column_id(%s, %s), nextval('state_column_id_seq'::regclass)),
+        %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+    ON CONFLICT (id, state_id)
+        DO UPDATE SET
+            name = EXCLUDED.name,
+            data_type = EXCLUDED.data_type,
+            required = EXCLUDED.required,
+            callable = EXCLUDED.callable,
+            min_length = EXCLUDED.min_length,
+            max_length = EXCLUDED.max_length,
+            value = EXCLUDED.value,
+            display_order = EXCLUDED.display_order
+    RETURNING id
+"""
+
+# the (state_key, data_index) mapping pairs of a state, sent as two parallel arrays, existing pairs are skipped
+STATE_COLUMN_DATA_MAPPING_INSERT_SQL = """
+    INSERT INTO state_column_data_mapping (state_id, state_key, data_index)
+    SELECT %s, source.state_key, source.data_index
+      FROM UNNEST(%s::varchar[], %s::bigint[]) AS source(state_key, data_index)
+    ON CONFLICT (state_id, state_key, data_index) DO NOTHING
+"""
+
+# the reservation of the data indexes of appended rows, and the release of the reservation if still the last one
+STATE_DATA_INDEXES_RESERVE_SQL = "UPDATE state SET count = count + %s WHERE id = %s RETURNING count"
+STATE_DATA_INDEXES_RELEASE_SQL = "UPDATE state SET count = count - %s WHERE id = %s AND count = %s"
+
+
+def state_upsert_params(state: State) -> List[Any]:
+    return [
+        state.id,
+        state.project_id,
+        state.state_type,
+        json.dumps(state.properties) if state.properties else None
+    ]
+
+
+def state_column_upsert_params(state_id: str, column_definition: StateDataColumnDefinition) -> List[Any]:
+    return [
+        # the existing column id, validated against the state id
+        column_definition.id,
+        state_id,
+
+        # actual values for the insert or update
+        state_id,
+        column_definition.name,
+        column_definition.data_type,
+        column_definition.required,
+        column_definition.callable,
+        column_definition.min_length,
+        column_definition.max_length,
+        column_definition.dimensions,
+        column_definition.value,
+        column_definition.source_column_name,
+        column_definition.display_order
+    ]
+
+
+def state_column_data_mappings_sql(state_id: str, offset: int | None, limit: int) -> Tuple[str, List[Any]]:
+    """The query and parameters of the (state_key, data_index) mappings of a state, or of a page of its rows."""
+    if offset is None:
+        return "select state_key, data_index from state_column_data_mapping where state_id = %s", [state_id]
+
+    sql = ("select state_key, data_index from state_column_data_mapping "
+           "where state_id = %s and data_index >= %s and data_index < %s")
+    return sql, [state_id, offset, offset + limit]
+
+
+def group_state_column_data_mappings(rows: Iterable[Tuple[str, int]]) -> Dict[str, StateDataColumnIndex]:
+    """The data indexes of the (state_key, data_index) rows of state_column_data_mappings_sql by state key."""
+    mappings: Dict[str, StateDataColumnIndex] = {}
+    for state_key, state_index in rows:
+        if state_key in mappings:
+            mappings[state_key].add_index_value(state_index)
+        else:
+            mappings[state_key] = StateDataColumnIndex(
+                key=state_key,
+                values=[state_index]
+            )
+
+    return mappings
+
+
+def state_with_count(state: State, count: int, appended: bool = False) -> State:
+    """A copy of a cached state with the count, the count of an append never lowers the count of a later one."""
+    if appended and state.count is not None:
+        count = max(state.count, count)
+
+    return state.model_copy(update={'count': count, 'persisted_position': count - 1})
+
+
+def state_hydrated_sql(include_columns: bool) -> str:
+    """
+    The query of a state row together with its key definitions, config attributes and (optionally) its
+    column definitions, the related rows are aggregated as json by the database, see hydrate_state_row.
+    """
+    columns_sql = """
+        (select coalesce(json_agg(to_jsonb(sc) order by sc.id), '[]'::json)
+           from state_column sc
+          where sc.state_id = s.id) as hydrated_columns
+    """ if include_columns else "null::json as hydrated_columns"
+
+    return f"""
+        select s.*,
+               (select coalesce(json_agg(json_build_object(
+                           'id', kd.id,
+                           'state_id', kd.state_id,
+                           'name', kd.name,
+                           'alias', kd.alias,
+                           'required', kd.required,
+                           'callable', kd.callable,
+                           'definition_type', kd.definition_type) order by kd.id), '[]'::json)
+                  from state_column_key_definition kd
+                 where kd.state_id = s.id) as hydrated_key_definitions,
+               (select coalesce(json_object_agg(sf.attribute, sf.data), '{{}}'::json)
+                  from state_config sf
+                 where sf.state_id = s.id) as hydrated_config,
+               {columns_sql}
+          from state s
+         where s.id = %s
+    """
+
+
+def hydrate_state_row(row: Dict[str, Any], include_columns: bool) -> State:
+    """Build the state, its typed config and (optionally) its columns from a row of state_hydrated_sql."""
+    key_definitions = row.pop('hydrated_key_definitions')
+    config_attributes = row.pop('hydrated_config')
+    columns = row.pop('hydrated_columns')
+
+    state = State(**row)
+
+    # group the key definitions by definition type, types without definitions are None
+    definitions_by_type = {}
+    for definition in key_definitions:
+        definitions_by_type.setdefault(definition['definition_type'], []).append(
+            StateDataKeyDefinition.model_validate(definition))
+
+    state.config = StateDatabaseStorage.build_state_config(
+        state_type=state.state_type,
+        key_definitions=definitions_by_type,
+        config_attributes=config_attributes)
+
+    if include_columns:
+        state.columns = {
+            column['name']: StateDataColumnDefinition.model_validate(column)
+            for column in columns if column['name']
+        }
+
+    return state
+
+
+def state_data_by_columns_sql(column_ids: List[int], offset: int | None, limit: int) -> Tuple[str, List[Any]]:
+    """The query and parameters of the data of the given columns, see scatter_state_column_data."""
+    if offset is None:
+        sql = """SELECT column_id, data_index, data_value, data_json_value
+                   FROM state_column_data WHERE column_id = ANY(%s)
+                  ORDER BY column_id, data_index"""
+        return sql, [column_ids]
+
+    sql = """SELECT column_id, data_index, data_value, data_json_value
+               FROM state_column_data WHERE column_id = ANY(%s)
+                AND data_index >= %s AND data_index < %s
+              ORDER BY column_id, data_index"""
+    return sql, [column_ids, offset, offset + limit]
+
+
+def scatter_state_column_data(columns: Dict[str, StateDataColumnDefinition],
+                              rows: Iterable[Tuple[int, int, Any, Any]],
+                              state_count: int,
+                              offset: int | None = None,
+                              limit: int = 1000) -> Dict[str, StateDataRowColumnData]:
+    """
+    Scatter the (column_id, data_index, data_value, data_json_value) rows of state_data_by_columns_sql
+    into a dense array per column, in one pass over the rows.
+    """
+    # when paginating, create arrays sized for the page, not the full state_count
+    array_size = limit if offset is not None else state_count
+    base_index = offset if offset is not None else 0
+
+    # dense value arrays per column, empty columns still need the full size
+    column_values = {column: [None] * array_size for column in columns.keys()}
+
+    # the value arrays and value types indexed by the column id, to scatter the rows into
+    values_by_column_id = {}
+    json_column_ids = set()
+    for column, column_definition in columns.items():
+        if column_definition.id is None:
+            continue
+
+        values_by_column_id[column_definition.id] = column_values[column]
+        if column_definition.data_type == 'json':
+            json_column_ids.add(column_definition.id)
+
+    # sparse-to-dense conversion: use data_index to place values correctly
+    for column_id, data_index, data_value, data_json_value in rows:
+        index = data_index - base_index
+        if 0 <= index < array_size:
+            values_by_column_id[column_id][index] = \
+                data_json_value if column_id in json_column_ids else data_value
+
+    # truncate from bottom if we exceed state_count boundaries (in-place deletion)
+    if offset is not None:
+        max_rows_available = max(state_count - offset, 0)
+        for values in column_values.values():
+            if len(values) > max_rows_available:
+                del values[max_rows_available:]
+
+    return {
+        column: StateDataRowColumnData(
+            values=values,
+            count=state_count
+        )
+        for column, values in column_values.items()
+    }
+
 
 class StateDatabaseStorage(StateStorage, BaseDatabaseAccessSinglePool):
 
+    def __init__(self, database_url, incremental: bool = False, metadata_cache: MemoryCache = None):
+        super().__init__(database_url=database_url, incremental=incremental)
+
+        if metadata_cache is None and STATE_METADATA_CACHE_SIZE > 0:
+            metadata_cache = MemoryCache(maxsize=STATE_METADATA_CACHE_SIZE, ttl=STATE_METADATA_CACHE_TTL)
+
+        self.metadata_cache = metadata_cache
+
+    def fetch_state_metadata_cache_stats(self) -> Optional[Dict[str, Any]]:
+        return self.metadata_cache.stats() if self.metadata_cache is not None else None
+
+    def invalidate_state_metadata(self, state_id: str, count: int = None, appended: bool = False):
+        """
+        Write-through maintenance of the cached state metadata, a count change is applied to the cached
+        entry, any other change drops the entry. Within a unit of work the entry is always dropped, the
+        work may still be rolled back.
+
+        The count of an append only ever raises the cached count, concurrent appends may write their
+        counts through in any order.
+
+        Entries cached by other processes are not invalidated, these expire after the cache ttl.
+        """
+        if self.metadata_cache is None or not state_id:
+            return
+
+        # a new entry replaces the cached one, readers may be copying it
+        if count is not None and not self._active_transaction() and self.metadata_cache.replace(
+                state_id, lambda cached: state_with_count(cached, count=count, appended=appended)):
+            return
+
+        self.metadata_cache.delete(state_id)
+
     def fetch_state_data_by_column_id(self, column_id: int, state_count: int, data_type: str = 'str', offset: int | None = None, limit: int = 1000) -> Optional[StateDataRowColumnData]:
-        conn = self.create_connection()
+        conn = self.create_connection(read_only=True)
         is_json_column = data_type == 'json'
 
         try:
@@ -80,9 +360,48 @@ class StateDatabaseStorage(StateStorage, BaseDatabaseAccessSinglePool):
         finally:
             self.release_connection(conn)
 
+    def fetch_state_data_by_columns(self, columns: Dict[str, StateDataColumnDefinition], state_count: int,
+                                    offset: int | None = None, limit: int = 1000) \
+            -> Dict[str, StateDataRowColumnData]:
+        """
+        Fetch the data of all the given columns in a single query, rows are ordered by column and
+        data index and scattered into a dense array per column in one pass over the result set.
+
+        :param columns: the column definitions, keyed by column name, to fetch the data for
+        :param state_count: the number of rows in the state
+        :param offset: the first data index to fetch, when paginating
+        :param limit: the page size, only applies when an offset is given
+        :return: the column data, keyed by column name, with the same layout as fetch_state_data_by_column_id
+        """
+        # the column ids of the columns with a definition, empty columns are returned without a query
+        column_ids = [definition.id for definition in columns.values() if definition.id is not None]
+
+        if not column_ids:
+            return scatter_state_column_data(
+                columns=columns, rows=[], state_count=state_count, offset=offset, limit=limit)
+
+        conn = self.create_connection(read_only=True)
+        try:
+            with conn.cursor() as cursor:
+                sql, params = state_data_by_columns_sql(column_ids=column_ids, offset=offset, limit=limit)
+                cursor.execute(sql, params)
+
+                # scattered straight from the cursor, without a list of all the result rows
+                return scatter_state_column_data(
+                    columns=columns, rows=cursor, state_count=state_count, offset=offset, limit=limit)
+        except Exception as e:
+            logging.error(e)
+            raise e
+        finally:
+            self.release_connection(conn)
+
     def fetch_state_columns(self, state_id: str) \
             -> Optional[Dict[str, StateDataColumnDefinition]]:
-        conn = self.create_connection()
+        if self.metadata_cache is not None:
+            state = self.fetch_state_hydrated(state_id=state_id, include_columns=True)
+            return state.columns if state else {}
+
+        conn = self.create_connection(read_only=True)
 
         try:
             with conn.cursor() as cursor:
@@ -132,25 +451,7 @@ class StateDatabaseStorage(StateStorage, BaseDatabaseAccessSinglePool):
 
         try:
             with conn.cursor() as cursor:
-
-                sql = """
-                    INSERT INTO state (id, project_id, state_type, properties)
-                    VALUES (%s, %s, %s, %s)
-                    ON CONFLICT (id)
-                    DO UPDATE SET
-                        state_type = EXCLUDED.state_type,
-                        properties = EXCLUDED.properties
-                """
-
-                # setup data values for state
-                values = [
-                    state.id,
-                    state.project_id,
-                    state.state_type,
-                    json.dumps(state.properties) if state.properties else None
-                ]
-
-                cursor.execute(sql, values)
+                cursor.execute(STATE_UPSERT_SQL, state_upsert_params(state))
 
             conn.commit()
         except Exception as e:
@@ -159,11 +460,12 @@ class StateDatabaseStorage(StateStorage, BaseDatabaseAccessSinglePool):
         finally:
             self.release_connection(conn)
 
+        self.invalidate_state_metadata(state_id=state.id)
         return state
 
     def fetch_state_config(self, state_id: str) -> dict | None:
 
-        conn = self.create_connection()
+        conn = self.create_connection(read_only=True)
 
         try:
             with conn.cursor() as cursor:
@@ -247,6 +549,8 @@ class StateDatabaseStorage(StateStorage, BaseDatabaseAccessSinglePool):
         finally:
             self.release_connection(conn)
 
+        self.invalidate_state_metadata(state_id=state_id)
+
     def insert_state_columns(self, state: State, force_update: bool = False):
         state_id = create_state_id_by_state(state)
         # existing_columns = self.fetch_state_columns(state_id=state_id)
@@ -267,57 +571,8 @@ class StateDatabaseStorage(StateStorage, BaseDatabaseAccessSinglePool):
             with conn.cursor() as cursor:
                 hash_key = create_state_id_by_state(state=state)
 
-                sql = f"""
-                INSERT INTO state_column (
-                    id,
-                    state_id, 
-                    name, 
-                    data_type, 
-                    required, 
-                    callable, 
-                    min_length, 
-                    max_length, 
-                    dimensions, 
-                    value, 
-                    source_column_name,
-                    display_order)
-                VALUES (
-                    COALESCE(validate_column_id(%s, %s), nextval('state_column_id_seq'::regclass)),
-                    %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-                ON CONFLICT (id, state_id)
-                    DO UPDATE SET 
-                        name = EXCLUDED.name, 
-                        data_type = EXCLUDED.data_type,
-                        required = EXCLUDED.required, 
-                        callable = EXCLUDED.callable,
-                        min_length = EXCLUDED.min_length,
-                        max_length = EXCLUDED.max_length,
-                        value = EXCLUDED.value,
-                        display_order = EXCLUDED.display_order
-                RETURNING id 
-                """
-
                 for column, column_definition in create_or_update_columns_definitions.items():
-                    values = [
-                        # actual values for the WITH statement in the sql above
-                        column_definition.id,  # first id within the WITH statement
-                        state_id,  # first state_id within the WITH statement
-
-                        # actual values for the insert or update
-                        state_id,
-                        column_definition.name,
-                        column_definition.data_type,
-                        column_definition.required,
-                        column_definition.callable,
-                        column_definition.min_length,
-                        column_definition.max_length,
-                        column_definition.dimensions,
-                        column_definition.value,
-                        column_definition.source_column_name,
-                        column_definition.display_order
-                    ]
-
-                    cursor.execute(sql, values)
+                    cursor.execute(STATE_COLUMN_UPSERT_SQL, state_column_upsert_params(state_id, column_definition))
 
                     # fetch the id from the returning sql statement
                     if not column_definition.id:
@@ -330,9 +585,99 @@ class StateDatabaseStorage(StateStorage, BaseDatabaseAccessSinglePool):
         finally:
             self.release_connection(conn)
 
+        self.invalidate_state_metadata(state_id=state_id)
         return hash_key
 
-    def insert_state_columns_data(self, state: State, incremental: bool = False):
+    def _copy_state_columns_data(self, cursor, state: State, columns: Dict[str, StateDataColumnDefinition]) -> int:
+        """
+        Bulk ingest of all column data of a state, the data is streamed using COPY into a temporary
+        staging table and then merged into state_column_data using a single set based statement.
+
+        :return: the last persisted data index, or the state.persisted_position if no data was copied
+        """
+        persisted_position = state.persisted_position
+
+        def to_json_text(value):
+            if value is None:
+                return None
+
+            # already a json string, pass it through as is, otherwise store it as a json string value
+            if isinstance(value, str):
+                try:
+                    json.loads(value)
+                    return value
+                except json.JSONDecodeError:
+                    return json.dumps(value)
+
+            return json.dumps(value)
+
+        def staging_rows():
+            nonlocal persisted_position
+
+            for column, header in columns.items():
+                if column not in state.data:
+                    logging.warning(f'no data found for column {column}, '
+                                    f'ignorable if column is a constant or function')
+                    continue
+
+                column_id = header.id
+                is_json_column = header.data_type == 'json'
+                logging.info(f'column={column}, data_type={header.data_type}, is_json_column={is_json_column}')
+
+                values = state.data[column].values
+                for data_index, column_row_data in enumerate(values):
+                    if is_json_column:
+                        yield column_id, data_index, True, None, to_json_text(column_row_data)
+                    else:
+                        yield column_id, data_index, False, column_row_data, None
+
+                if values:
+                    persisted_position = len(values) - 1
+
+        cursor.execute("""
+            CREATE TEMP TABLE state_column_data_stage (
+                column_id BIGINT NOT NULL,
+                data_index BIGINT NOT NULL,
+                is_json BOOLEAN NOT NULL,
+                data_value TEXT,
+                data_json_value JSONB
+            ) ON COMMIT DROP
+        """)
+
+        copied = copy_rows(
+            cursor=cursor,
+            table="state_column_data_stage",
+            columns=["column_id", "data_index", "is_json", "data_value", "data_json_value"],
+            rows=staging_rows())
+
+        cursor.execute("""
+            MERGE INTO state_column_data AS target
+            USING state_column_data_stage AS source
+               ON target.column_id = source.column_id
+              AND target.data_index = source.data_index
+            WHEN MATCHED AND source.is_json THEN
+                UPDATE SET data_json_value = source.data_json_value
+            WHEN MATCHED THEN
+                UPDATE SET data_value = source.data_value
+            WHEN NOT MATCHED THEN
+                INSERT (column_id, data_index, data_value, data_json_value)
+                VALUES (source.column_id, source.data_index, source.data_value, source.data_json_value)
+        """)
+
+        cursor.execute("DROP TABLE state_column_data_stage")
+        logging.debug(f'bulk copied {copied} column data values for state id: {state.id}')
+        return persisted_position
+
+    def insert_state_columns_data(self, state: State, incremental: bool = False, bulk: bool = True):
+        """
+        Persist the column data of a state.
+
+        :param state: the state holding the data to persist
+        :param incremental: only insert rows beyond state.persisted_position
+        :param bulk: when not incremental, stream the data using COPY into a staging table and merge
+            it in one statement, otherwise merge every value individually
+        :return: the set of state keys added when incremental, otherwise None
+        """
         state_id = create_state_id_by_state(state)
         columns = self.fetch_state_columns(state_id)
 
@@ -363,7 +708,7 @@ class StateDatabaseStorage(StateStorage, BaseDatabaseAccessSinglePool):
 
         merge_sql_json = """
             MERGE INTO state_column_data AS target
-            USING (SELECT %s AS column_id, %s AS data_index, %s AS data_json_value) AS source
+            USING (SELECT %s AS column_id, %s AS data_index, %s::jsonb AS data_json_value) AS source
                ON target.column_id = source.column_id
               AND target.data_index = source.data_index
             WHEN MATCHED THEN
@@ -390,6 +735,12 @@ class StateDatabaseStorage(StateStorage, BaseDatabaseAccessSinglePool):
                 return [column_id, data_index, column_row_data]
 
             with (conn.cursor() as cursor):
+                if not incremental and bulk:
+                    state.persisted_position = self._copy_state_columns_data(
+                        cursor=cursor, state=state, columns=columns)
+                    conn.commit()
+                    return None
+
                 for column, header in columns.items():
                     if column not in state.data:
                         logging.warning(f'no data found for column {column}, '
@@ -423,7 +774,6 @@ class StateDatabaseStorage(StateStorage, BaseDatabaseAccessSinglePool):
 
                     else:
                         merge_sql = merge_sql_json if is_json_column else merge_sql_text
-                        track_mapping = None
 
                         for data_index, column_row_data in enumerate(state.data[column].values):
                             row_data = create_batch_row(column, column_id, data_index, column_row_data, is_json_column)
@@ -432,7 +782,7 @@ class StateDatabaseStorage(StateStorage, BaseDatabaseAccessSinglePool):
 
             state.persisted_position = persisted_position
             conn.commit()
-            return track_mapping
+            return track_mapping if incremental else None
         except Exception as e:
             logging.error(e)
             raise e
@@ -441,7 +791,7 @@ class StateDatabaseStorage(StateStorage, BaseDatabaseAccessSinglePool):
 
     def fetch_state_key_definition(self, state_id: str, definition_type: str) \
             -> Optional[List[StateDataKeyDefinition]]:
-        conn = self.create_connection()
+        conn = self.create_connection(read_only=True)
 
         try:
             with conn.cursor() as cursor:
@@ -608,6 +958,7 @@ class StateDatabaseStorage(StateStorage, BaseDatabaseAccessSinglePool):
 
                 conn.commit()
 
+            self.invalidate_state_metadata(state_id=state.id)
             return definitions
         except Exception as e:
             logging.error(e)
@@ -617,35 +968,18 @@ class StateDatabaseStorage(StateStorage, BaseDatabaseAccessSinglePool):
 
     def fetch_state_column_data_mappings(self, state_id, offset: int | None = None, limit: int = 1000) \
             -> Optional[Dict[str, StateDataColumnIndex]]:
-        conn = self.create_connection()
+        conn = self.create_connection(read_only=True)
 
         try:
             with conn.cursor() as cursor:
-                if offset is None:
-                    sql = f"select state_key, data_index from state_column_data_mapping where state_id = %s"
-                    cursor.execute(sql, [state_id])
-                else:
-                    sql = f"select state_key, data_index from state_column_data_mapping where state_id = %s and data_index >= %s and data_index < %s"
-                    cursor.execute(sql, [state_id, offset, limit])
+                sql, params = state_column_data_mappings_sql(state_id=state_id, offset=offset, limit=limit)
+                cursor.execute(sql, params)
 
-                rows = cursor.fetchall()
-                if not rows:
+                mappings = group_state_column_data_mappings(cursor)
+                if not mappings:
                     logging.debug(f'no mapping found for state_id: {state_id}')
                     return None
 
-                mappings: Dict[str, StateDataColumnIndex] = {}
-                for row in rows:
-                    state_key = row[0]
-                    state_index = row[1]
-
-                    if state_key in mappings:
-                        mappings[state_key].add_index_value(state_index)
-                    else:
-                        mappings[state_key] = StateDataColumnIndex(
-                            key=state_key,
-                            values=[state_index]
-                        )
-
             return mappings
         except Exception as e:
             logging.error(e)
@@ -654,6 +988,22 @@ class StateDatabaseStorage(StateStorage, BaseDatabaseAccessSinglePool):
             self.release_connection(conn)
             return None
 
+    def _insert_state_column_data_mapping_pairs(self, cursor, state_id: str, pairs: List[Tuple[str, int]]) -> int:
+        """
+        Write all (state_key, data_index) mapping pairs of a state in a single statement, pairs are
+        sent as two parallel arrays and unnested server side, existing pairs are skipped such that
+        retries remain idempotent.
+
+        :return: the number of new mapping rows inserted
+        """
+        if not pairs:
+            return 0
+
+        state_keys = [state_key for state_key, _ in pairs]
+        data_indexes = [data_index for _, data_index in pairs]
+        cursor.execute(STATE_COLUMN_DATA_MAPPING_INSERT_SQL, [state_id, state_keys, data_indexes])
+        return cursor.rowcount
+
     def insert_state_column_data_mapping(self, state: State, state_key_mapping_set: set = None):
 
         if not state.mapping:
@@ -661,55 +1011,29 @@ class StateDatabaseStorage(StateStorage, BaseDatabaseAccessSinglePool):
                             f'state key from a state within the data state set')
             return
 
+        # derive the state id
+        state_id = create_state_id_by_state(state)
+
+        # restrict the mapping to the given state keys, if any
+        if state_key_mapping_set:
+            state_keys = state_key_mapping_set
+        else:
+            state_keys = state.mapping.keys()
+
+        pairs = []
+        for state_key in state_keys:
+            state_mapping = state.mapping.get(state_key)
+            if not state_mapping or not state_mapping.values:
+                logging.warning(
+                    f'no values specified for state.mapping state key {state_key} in state_id: {state_id}')
+                continue
+
+            pairs.extend((state_key, data_index) for data_index in state_mapping.values)
+
         try:
             conn = self.create_connection()
             with conn.cursor() as cursor:
-
-                sql = """
-                           MERGE INTO state_column_data_mapping AS target
-                           USING (SELECT %s AS state_id, %s AS state_key, %s AS data_index) AS source
-                              ON target.state_id = source.state_id 
-                             AND target.state_key = source.state_key
-                             AND target.data_index = source.data_index
-                           WHEN NOT MATCHED THEN 
-                               INSERT (state_id, state_key, data_index)
-                               VALUES (source.state_id, source.state_key, source.data_index)
-                       """
-
-                # derive the state id
-                state_id = create_state_id_by_state(state)
-
-                if state_key_mapping_set:
-                    for state_key in state_key_mapping_set:
-                        if state_key not in state.mapping:
-                            logging.warning(
-                                f'no values specified for state.mapping state key {state_key} in state_id: {state_id}')
-                            continue
-
-                        # state mapping
-                        state_mapping = state.mapping[state_key]
-                        for data_index in state_mapping.values:
-                            values = [
-                                state_id,
-                                state_key,
-                                data_index
-                            ]
-                            cursor.execute(sql, values)
-
-                else:
-                    for state_key, state_mapping in state.mapping.items():
-                        if not state_mapping.values:
-                            logging.warning(
-                                f'no values specified for state.mapping state key {state_key} in state_id: {state_id}')
-                            continue
-
-                        for data_index in state_mapping.values:
-                            values = [
-                                state_id,
-                                state_key,
-                                data_index
-                            ]
-                            cursor.execute(sql, values)
+                self._insert_state_column_data_mapping_pairs(cursor=cursor, state_id=state_id, pairs=pairs)
 
             conn.commit()
         except Exception as e:
@@ -718,42 +1042,67 @@ class StateDatabaseStorage(StateStorage, BaseDatabaseAccessSinglePool):
         finally:
             self.release_connection(conn)
 
-    def load_state_basic(self, state_id: str) -> Optional[State]:
-        state = self.fetch_state(state_id=state_id)
-        if not state:
-            return None
+    def fetch_state_hydrated(self, state_id: str, include_columns: bool = True) -> Optional[State]:
+        """
+        Fetch the state row together with its key definitions, config attributes and (optionally) its
+        column definitions in a single query, the related rows are aggregated as json by the database.
+
+        When the metadata cache is enabled the state is served from the cache, a copy of the cached
+        entry is returned such that the caller is free to modify it.
+
+        :param state_id: the state to fetch
+        :param include_columns: whether to fetch the column definitions into state.columns
+        :return: the state with its typed config and columns, without data, or None if not found
+        """
+        if self.metadata_cache is not None:
+            cached = self.metadata_cache.get(state_id)
+            if cached is None:
+                cached = self._fetch_state_hydrated(state_id=state_id, include_columns=True)
+
+                # uncommitted metadata of a unit of work in progress must not be cached
+                if cached is not None and not self._active_transaction():
+                    self.metadata_cache.set(state_id, cached)
+
+            if cached is None:
+                return None
 
-        state_type = state.state_type
+            state = cached.model_copy(deep=True)
+            if not include_columns:
+                state.columns = {}
 
-        # rebuild the key definitions
-        primary_key = self.fetch_state_key_definition(
-            state_id=state_id,
-            definition_type="primary_key")
+            return state
 
-        query_state_inheritance = self.fetch_state_key_definition(
-            state_id=state_id,
-            definition_type="query_state_inheritance")
+        return self._fetch_state_hydrated(state_id=state_id, include_columns=include_columns)
 
-        state_join_keys = self.fetch_state_key_definition(
-            state_id=state_id,
-            definition_type="state_join_key")
+    def _fetch_state_hydrated(self, state_id: str, include_columns: bool) -> Optional[State]:
+        conn = self.create_connection()
 
-        remap_query_state_columns = self.fetch_state_key_definition(
-            state_id=state_id,
-            definition_type="remap_query_state_columns")
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute(state_hydrated_sql(include_columns=include_columns), [state_id])
+                rows = cursor.fetchall()
+                if not rows:
+                    return None
 
-        template_columns = self.fetch_state_key_definition(
-            state_id=state_id,
-            definition_type="template_columns")
+                row = map_rows_to_dicts(cursor, rows)[0]
+        except Exception as e:
+            logging.error(e)
+            raise e
+        finally:
+            self.release_connection(conn)
 
-        # fetch list of attributes associated to this state, if any
-        config_attributes = self.fetch_state_config(state_id=state_id)
+        return hydrate_state_row(row=row, include_columns=include_columns)
+
+    @staticmethod
+    def build_state_config(state_type: str,
+                           key_definitions: Dict[str, List[StateDataKeyDefinition]],
+                           config_attributes: dict) -> BaseStateConfig:
         general_attributes = {
-            "primary_key": primary_key,
-            "state_join_key": state_join_keys,
-            "query_state_inheritance": query_state_inheritance,
-            "remap_query_state_columns": remap_query_state_columns,
-            "template_columns": template_columns,
+            "primary_key": key_definitions.get("primary_key"),
+            "state_join_key": key_definitions.get("state_join_key"),
+            "query_state_inheritance": key_definitions.get("query_state_inheritance"),
+            "remap_query_state_columns": key_definitions.get("remap_query_state_columns"),
+            "template_columns": key_definitions.get("template_columns"),
         }
 
         if 'StateConfig' == state_type:
@@ -779,8 +1128,11 @@ class StateDatabaseStorage(StateStorage, BaseDatabaseAccessSinglePool):
         else:
             raise NotImplementedError(f'unsupported type {state_type}')
 
-        state.config = config
-        return state
+        return config
+
+    def load_state_basic(self, state_id: str) -> Optional[State]:
+        # the state, key definitions and config attributes in a single round trip
+        return self.fetch_state_hydrated(state_id=state_id, include_columns=False)
 
     # load the state columns by state id
     def load_state_columns(self, state_id: str) \
@@ -793,12 +1145,8 @@ class StateDatabaseStorage(StateStorage, BaseDatabaseAccessSinglePool):
     def load_state_data(self, columns: Dict[str, StateDataColumnDefinition], state_count: int, offset: int | None = None, limit: int = 1000) \
             -> Optional[Dict[str, StateDataRowColumnData]]:
 
-        # rebuild the data values by column and values
-        return {
-            column: self.fetch_state_data_by_column_id(column_definition.id, state_count, data_type=column_definition.data_type, offset=offset, limit=limit)
-            for column, column_definition in columns.items()
-            # if not column_definition.value  # TODO REMOVE since we now store all constant and expression values in .data[col].values[]  ...old: only return row data that is not a function or a constant
-        }
+        # rebuild the data values by column and values, all columns are fetched in a single query
+        return self.fetch_state_data_by_columns(columns=columns, state_count=state_count, offset=offset, limit=limit)
 
     # rebuild the data state mapping
     def load_state_data_mappings(self, state_id: str, offset: int | None = None, limit: int = 1000)  \
@@ -815,14 +1163,13 @@ class StateDatabaseStorage(StateStorage, BaseDatabaseAccessSinglePool):
                 "Full data loading will be removed in a future version."
             )
 
-        # basic state instance
-        state = self.load_state_basic(state_id=state_id)
+        # basic state instance, including the column definitions
+        state = self.fetch_state_hydrated(state_id=state_id, include_columns=True)
 
         if not state:
             return None
 
         # load additional details about the state
-        state.columns = self.load_state_columns(state_id=state_id)
         state.data = self.load_state_data(columns=state.columns, state_count=state.count, offset=offset, limit=limit) if load_data else {}
         state.mapping = self.load_state_data_mappings(state_id=state_id) if load_data else {}
         state.persisted_position = state.count - 1
@@ -842,20 +1189,105 @@ class StateDatabaseStorage(StateStorage, BaseDatabaseAccessSinglePool):
         - Empty data arrays
         - persisted_position set correctly
         """
-        # basic state instance
-        state = self.load_state_basic(state_id=state_id)
+        # basic state instance and column definitions in a single round trip, but NOT the actual data
+        state = self.fetch_state_hydrated(state_id=state_id, include_columns=True)
 
         if not state:
             return None
 
-        # load column definitions but NOT the actual data
-        state.columns = self.load_state_columns(state_id=state_id)
         state.data = {}  # Empty - no data loaded
         state.mapping = {}  # Empty - no mappings loaded
         state.persisted_position = state.count - 1
 
         return state
 
+    def iter_state_rows(self, state_id: str, columns: List[str] = None, batch_size: int = 1000) \
+            -> Iterator[Dict[str, Any]]:
+        """
+        Stream the rows of a state, one query state dictionary per row in data index order, without
+        loading the state. Rows are read through a named (server side) cursor, batch_size rows at a
+        time, such that memory remains constant regardless of the number of rows in the state.
+
+        Exactly count rows of the state are yielded, the nth row is the row of data index n, rows without
+        any values (e.g. left by a failed append) are yielded with None values.
+
+        :param state_id: the state to read the rows of
+        :param columns: the names of the columns to include, all columns if not specified
+        :param batch_size: the number of rows fetched from the server per round trip
+        :return: a generator of query state dictionaries, keyed by column name
+        """
+        column_definitions = self.fetch_state_columns(state_id=state_id)
+        if not column_definitions:
+            logging.warning(f'no columns found for state_id: {state_id}')
+            return
+
+        if columns:
+            missing = [column for column in columns if column not in column_definitions]
+            if missing:
+                logging.warning(f'columns {missing} not found in state_id: {state_id}')
+
+            column_definitions = {
+                column: column_definitions[column]
+                for column in columns
+                if column in column_definitions
+            }
+
+        column_names = list(column_definitions.keys())
+        names_by_column_id = {definition.id: column for column, definition in column_definitions.items()}
+        json_column_ids = {definition.id for definition in column_definitions.values() if definition.data_type == 'json'}
+
+        if not names_by_column_id:
+            return
+
+        sql = """SELECT column_id, data_index, data_value, data_json_value
+                   FROM state_column_data WHERE column_id = ANY(%s) AND data_index < %s
+                  ORDER BY data_index, column_id"""
+
+        conn = self.create_connection()
+        cursor = None
+
+        try:
+            # the rows of the state, values at or beyond the count (e.g. of an append in progress) are not
+            with conn.cursor() as count_cursor:
+                count_cursor.execute("SELECT count FROM state WHERE id = %s", [state_id])
+                row = count_cursor.fetchone()
+                count = (row[0] or 0) if row else 0
+
+            cursor = conn.cursor(name=f'iter_state_rows_{uuid.uuid4().hex}')
+            cursor.itersize = batch_size * len(names_by_column_id)  # one round trip per batch of rows
+            cursor.execute(sql, [list(names_by_column_id.keys()), count])
+
+            # the long format rows are grouped into one query state per data index
+            next_index = 0
+            query_state = None
+            for column_id, data_index, data_value, data_json_value in cursor:
+                if data_index >= next_index:
+                    if query_state is not None:
+                        yield query_state
+
+                    # the data indexes without any values are yielded as empty rows, keeping the rows aligned
+                    for _ in range(next_index, data_index):
+                        yield dict.fromkeys(column_names)
+
+                    next_index = data_index + 1
+                    query_state = dict.fromkeys(column_names)
+
+                query_state[names_by_column_id[column_id]] = \
+                    data_json_value if column_id in json_column_ids else data_value
+
+            if query_state is not None:
+                yield query_state
+
+            for _ in range(next_index, count):
+                yield dict.fromkeys(column_names)
+        finally:
+            if cursor is not None:
+                try:
+                    cursor.close()
+                except Exception as e:
+                    logging.warning(f'failed to close state rows cursor for state_id: {state_id}, {e}')
+            self.release_connection(conn)
+
     def fetch_state_data_chunk_for_export(self, state_id: str, offset: int, limit: int):
         """
         Fetch a chunk of state data directly from the database for export purposes.
@@ -869,7 +1301,7 @@ class StateDatabaseStorage(StateStorage, BaseDatabaseAccessSinglePool):
         :param limit: Maximum number of rows to fetch
         :return: List of tuples (column_name, data_index, data_value)
         """
-        conn = self.create_connection()
+        conn = self.create_connection(read_only=True)
 
         try:
             with conn.cursor() as cursor:
@@ -956,19 +1388,17 @@ class StateDatabaseStorage(StateStorage, BaseDatabaseAccessSinglePool):
         if columns:
             self.insert_state_columns(state=state, force_update=False)
 
+        # the index range is reserved up front, such that concurrent appenders do not wait on each other
+        new_count = self._reserve_state_data_indexes(state_id=state_id, count=len(query_states))
+        new_persisted_position = new_count - 1
+        start_position = new_count - len(query_states)
+
         conn = self.create_connection()
         try:
-            # Begin explicit transaction
-            conn.autocommit = False
-
+            # all writes below run in the one transaction of this connection, committed at the end
             track_mapping_set = set()
 
-            # Calculate starting position for new data
-            start_position = state.persisted_position + 1
-
             with conn.cursor() as cursor:
-                # Start transaction explicitly
-                cursor.execute("BEGIN")
                 # SQL statements for text vs json columns
                 insert_sql_text = """
                     INSERT INTO state_column_data (column_id, data_index, data_value)
@@ -1011,43 +1441,21 @@ class StateDatabaseStorage(StateStorage, BaseDatabaseAccessSinglePool):
 
                 # Batch insert state mappings
                 if track_mapping_set:
-                    mapping_batch = []
-                    for row_offset, query_state in enumerate(query_states):
-                        if 'state_key' in query_state and query_state['state_key']:
-                            state_key = query_state['state_key']
-                            data_index = start_position + row_offset
-                            mapping_batch.append([state_id, state_key, data_index])
-
-                    if mapping_batch:
-                        for mapping in mapping_batch:
-                            cursor.execute(
-                                """
-                                MERGE INTO state_column_data_mapping AS target
-                                USING (SELECT %s AS state_id, %s AS state_key, %s AS data_index) AS source
-                                   ON target.state_id = source.state_id
-                                  AND target.state_key = source.state_key
-                                  AND target.data_index = source.data_index
-                                WHEN NOT MATCHED THEN
-                                    INSERT (state_id, state_key, data_index)
-                                    VALUES (source.state_id, source.state_key, source.data_index)
-                                """,
-                                mapping
-                            )
-
-                # Update state count and persisted_position
-                new_count = state.count + len(query_states)
-                new_persisted_position = new_count - 1
-
-                cursor.execute(
-                    "UPDATE state SET count = %s WHERE id = %s",
-                    [new_count, state_id]
-                )
+                    mapping_pairs = [
+                        (query_state['state_key'], start_position + row_offset)
+                        for row_offset, query_state in enumerate(query_states)
+                        if query_state.get('state_key')
+                    ]
+
+                    self._insert_state_column_data_mapping_pairs(
+                        cursor=cursor, state_id=state_id, pairs=mapping_pairs)
 
             conn.commit()
 
             # Update state object
             state.count = new_count
             state.persisted_position = new_persisted_position
+            self.invalidate_state_metadata(state_id=state_id, count=new_count, appended=True)
 
             logging.info(f'appended {len(query_states)} rows to state {state_id}, new count: {new_count}')
 
@@ -1056,10 +1464,60 @@ class StateDatabaseStorage(StateStorage, BaseDatabaseAccessSinglePool):
         except Exception as e:
             logging.error(f'error appending data to state {state_id}: {e}')
             conn.rollback()
+            self._release_state_data_indexes(state_id=state_id, count=len(query_states), reserved_count=new_count)
             raise e
         finally:
             self.release_connection(conn)
 
+    def _reserve_state_data_indexes(self, state_id: str, count: int) -> int:
+        """
+        Reserve the data indexes of count rows to append, the state count is incremented atomically such that
+        concurrent appenders write disjoint ranges. The reservation is committed on its own, the state row is
+        only locked for the increment, unless within a unit of work, where it is part of the unit of work.
+
+        :return: the state count including the reserved rows
+        """
+        conn = self.create_connection()
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute(STATE_DATA_INDEXES_RESERVE_SQL, [count, state_id])
+                new_count = cursor.fetchone()[0]
+            conn.commit()
+            return new_count
+        except Exception as e:
+            logging.error(f'error reserving {count} data indexes of state {state_id}: {e}')
+            conn.rollback()
+            raise e
+        finally:
+            self.release_connection(conn)
+
+    def _release_state_data_indexes(self, state_id: str, count: int, reserved_count: int):
+        """
+        Give back the indexes of a failed append, if no later append reserved indexes since. Otherwise the
+        range stays a gap of missing values, the indexes of the later rows cannot move.
+        """
+        if self._active_transaction():
+            # the reservation is rolled back with the unit of work
+            return
+
+        conn = self.create_connection()
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute(STATE_DATA_INDEXES_RELEASE_SQL, [count, state_id, reserved_count])
+                released = cursor.rowcount == 1
+            conn.commit()
+        except Exception as e:
+            logging.error(f'error releasing {count} data indexes of state {state_id}: {e}')
+            conn.rollback()
+            return
+        finally:
+            self.release_connection(conn)
+
+        if not released:
+            logging.warning(f'failed append left a gap of {count} rows before index {reserved_count} '
+                            f'of state {state_id}, later rows were appended since')
+        self.invalidate_state_metadata(state_id=state_id)
+
     # delete cascade the state and all its details
     def delete_state_cascade(self, state_id):
         self.delete_state_data(state_id=state_id)
@@ -1082,6 +1540,8 @@ class StateDatabaseStorage(StateStorage, BaseDatabaseAccessSinglePool):
         finally:
             self.release_connection(conn)
 
+        self.invalidate_state_metadata(state_id=state_id)
+
     def delete_state_config(self, state_id):
 
         try:
@@ -1096,8 +1556,10 @@ class StateDatabaseStorage(StateStorage, BaseDatabaseAccessSinglePool):
         finally:
             self.release_connection(conn)
 
+        self.invalidate_state_metadata(state_id=state_id)
+
     def reset_state_column_data_zero(self, state_id, zero: int = 0) -> int:
-        return self.execute_update(
+        count = self.execute_update(
             table="state",
             update_values={
                 'count': zero
@@ -1107,6 +1569,9 @@ class StateDatabaseStorage(StateStorage, BaseDatabaseAccessSinglePool):
             },
         )
 
+        self.invalidate_state_metadata(state_id=state_id, count=zero)
+        return count
+
     def delete_state_column_data_mapping(self, state_id, column_id: int = None) -> int:
         try:
             conn = self.create_connection()
@@ -1124,13 +1589,16 @@ class StateDatabaseStorage(StateStorage, BaseDatabaseAccessSinglePool):
         if not state_id:
             raise ValueError(f'state id must be specified')
 
-        return self.execute_delete_query(
+        count = self.execute_delete_query(
             sql="DELETE FROM state_column",
             conditions={
                 "id": column_id,
                 "state_id": state_id
             })
 
+        self.invalidate_state_metadata(state_id=state_id)
+        return count
+
     def delete_state_column_data(self, state_id, column_id: int = None) -> int:
 
         try:
@@ -1155,7 +1623,7 @@ class StateDatabaseStorage(StateStorage, BaseDatabaseAccessSinglePool):
             raise PermissionError(
                 f'state_id, definition_type and definition_id must be specified when deleting a state config key definition')
 
-        return self.execute_delete_query(
+        count = self.execute_delete_query(
             sql="DELETE FROM state_column_key_definition",
             conditions={
                 "state_id": state_id,
@@ -1164,6 +1632,9 @@ class StateDatabaseStorage(StateStorage, BaseDatabaseAccessSinglePool):
             }
         )
 
+        self.invalidate_state_metadata(state_id=state_id)
+        return count
+
     def delete_state_config_key_definitions(self, state_id):
 
         try:
@@ -1178,6 +1649,8 @@ class StateDatabaseStorage(StateStorage, BaseDatabaseAccessSinglePool):
         finally:
             self.release_connection(conn)
 
+        self.invalidate_state_metadata(state_id=state_id)
+
     def update_state_count(self, state: State) -> State:
         self.execute_update(
             table="state",
@@ -1185,6 +1658,7 @@ class StateDatabaseStorage(StateStorage, BaseDatabaseAccessSinglePool):
             conditions={"id": state.id}
         )
         state.persisted_position = state.count - 1
+        self.invalidate_state_metadata(state_id=state.id, count=state.count)
         return state
 
     def save_state(self, state: State, options: dict = None) -> State:
@@ -1197,33 +1671,39 @@ class StateDatabaseStorage(StateStorage, BaseDatabaseAccessSinglePool):
 
         force_update_column = fetch_option('force_update_column', False)
         force_update_count = fetch_option('force_update_count', True)
+        bulk_ingest = fetch_option('bulk_ingest', True)
         first_time = state.persisted_position < 0
-        if not self.incremental or first_time:
-            state = self.insert_state(state=state)
-            self.insert_state_config(state=state)
-            self.insert_state_columns(state=state, force_update=force_update_column)
-            self.insert_state_columns_data(state=state, incremental=False)
-            self.insert_state_column_data_mapping(state=state)
-            self.insert_state_primary_key_definition(state=state)
-            self.insert_state_join_key_definition(state=state)
-            self.insert_query_state_inheritance_key_definition(state=state)
-            self.insert_remap_query_state_columns_key_definition(state=state)
-            self.insert_template_columns_key_definition(state=state)
-            if force_update_count:
-                self.update_state_count(state=state)
-        else:
-            # the incremental function returns the list of state keys that need to be applied
-            primary_key_mapping_update_set = self.insert_state_columns_data(state=state, incremental=True)
 
-            # insert any new primary key references, provided that it was merged by the previous call
-            self.insert_state_column_data_mapping(state=state, state_key_mapping_set=primary_key_mapping_update_set)
+        # the whole save runs as a single unit of work, on one connection with one commit
+        with self.transaction():
+            if not self.incremental or first_time:
+                state = self.insert_state(state=state)
+                self.insert_state_config(state=state)
+                self.insert_state_columns(state=state, force_update=force_update_column)
+                self.insert_state_columns_data(state=state, incremental=False, bulk=bulk_ingest)
+                self.insert_state_column_data_mapping(state=state)
+                self.insert_state_primary_key_definition(state=state)
+                self.insert_state_join_key_definition(state=state)
+                self.insert_query_state_inheritance_key_definition(state=state)
+                self.insert_remap_query_state_columns_key_definition(state=state)
+                self.insert_template_columns_key_definition(state=state)
+                if force_update_count:
+                    self.update_state_count(state=state)
+            else:
+                # the incremental function returns the list of state keys that need to be applied
+                primary_key_mapping_update_set = self.insert_state_columns_data(state=state, incremental=True)
+
+                # insert any new primary key references, provided that it was merged by the previous call
+                self.insert_state_column_data_mapping(state=state, state_key_mapping_set=primary_key_mapping_update_set)
 
-            # only save the state if there were changes made, track by primary key updates from previous calls
-            if primary_key_mapping_update_set:
-                self.insert_state(state=state)
+                # only save the state if there were changes made, track by primary key updates from previous calls
+                if primary_key_mapping_update_set:
+                    self.insert_state(state=state)
 
-            # update state count
-            if force_update_count:
-                self.update_state_count(state=state)
+                # update state count
+                if force_update_count:
+                    self.update_state_count(state=state)
 
+        # entries read by other threads while the unit of work was in progress are stale once committed
+        self.invalidate_state_metadata(state_id=state.id)
         return state
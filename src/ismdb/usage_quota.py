@@ -0,0 +1,258 @@
+import collections
+import logging as log
+import os
+import threading
+import time
+
+from typing import Any, Dict, Optional, Tuple
+
+from ismcore.model.base_model_usage_and_limits import Decision, UserProjectCurrentUsageReport
+
+logging = log.getLogger(__name__)
+
+# the default bound in seconds on the age of the database usage a quota check is answered from
+USAGE_QUOTA_MAX_STALENESS_SECONDS = float(os.environ.get("USAGE_QUOTA_MAX_STALENESS_SECONDS", 5))
+
+# the quota periods, in the order the limits are checked (as UserProjectCurrentUsageReport.is_allowed)
+QUOTA_PERIODS = ("minute", "hour", "day", "month", "year")
+
+
+def quota_periods(now: float) -> Tuple[int, int, int, int, int]:
+    """The current utc minute, hour, day, month and year of an epoch time, as integers in QUOTA_PERIODS order."""
+    minute = int(now // 60)
+    utc = time.gmtime(now)
+    return minute, minute // 60, minute // 1440, utc.tm_year * 12 + utc.tm_mon, utc.tm_year
+
+
+class _Quota:
+    """The limits and current usage of a user (and project), guarded by the lock of the accumulator."""
+
+    __slots__ = ("token_limits", "cost_limits", "periods", "tokens", "costs", "recorded", "reconciled_at",
+                 "reconcile_lock")
+
+    def __init__(self, periods: Tuple[int, ...]):
+        self.token_limits = [None] * len(QUOTA_PERIODS)
+        self.cost_limits = [None] * len(QUOTA_PERIODS)
+        self.periods = periods
+        self.tokens = [0.0] * len(QUOTA_PERIODS)
+        self.costs = [0.0] * len(QUOTA_PERIODS)
+
+        # the locally recorded usage since the last reconciliation: (monotonic time, periods, tokens, cost)
+        self.recorded = collections.deque()
+        self.reconciled_at = None
+        self.reconcile_lock = threading.Lock()
+
+    def roll_over(self, periods: Tuple[int, ...]):
+        """Start the periods that ended from zero."""
+        if periods == self.periods:
+            return
+
+        for index, period in enumerate(periods):
+            if period != self.periods[index]:
+                self.tokens[index] = 0.0
+                self.costs[index] = 0.0
+        self.periods = periods
+
+
+class UsageQuotaAccumulator:
+    """
+    In-process quota check of the users (and projects) against the token and cost limits of their tier.
+
+    The limits and the usage of the current minute, hour, day, month and year are seeded from
+    fetch_user_project_current_usage_report, the usage recorded locally is added as it is observed, such
+    that a check is answered from memory. The usage is reconciled with the database once it is older than
+    the staleness bound of the check, the locally recorded usage is then replaced by the database usage.
+
+    Usage recorded locally is assumed to be in the database write_delay seconds after it was recorded,
+    e.g. the flush interval of a buffered usage writer, it is counted until a reconciliation starting later.
+
+    Example:
+        quotas = UsageQuotaAccumulator(usage_storage, max_staleness=5)
+        if quotas.is_over_limit(user_id, project_id):
+            raise ...
+        ...
+        quotas.record(user_id, project_id, tokens=usage.total_tokens, cost=usage.total_cost)
+    """
+
+    def __init__(self,
+                 storage,
+                 max_staleness: float = USAGE_QUOTA_MAX_STALENESS_SECONDS,
+                 write_delay: float = 0.0,
+                 clock=time.time):
+        """
+        :param storage: the usage storage, see UsageDatabaseStorage.fetch_user_project_current_usage_report
+        :param max_staleness: the default maximum age in seconds of the database usage a check is answered from,
+            the current usage reports may be up to USAGE_REPORT_CACHE_TTL seconds older if the report cache is enabled
+        :param write_delay: the seconds after which locally recorded usage is reflected by the database
+        :param clock: the epoch time of the current periods, in seconds
+        """
+        self.storage = storage
+        self.max_staleness = max_staleness
+        self.write_delay = write_delay
+        self.clock = clock
+
+        self._lock = threading.Lock()
+        self._quotas: Dict[Tuple[str, Optional[str]], _Quota] = {}
+
+        self.checks = 0
+        self.reconciliations = 0
+        self.reconcile_seconds = 0.0
+
+    def _quota(self, key: Tuple[str, Optional[str]], periods: Tuple[int, ...]) -> _Quota:
+        """The quota of the key, rolled over to the current periods, must be called while holding the lock."""
+        quota = self._quotas.get(key)
+        if quota is None:
+            quota = self._quotas[key] = _Quota(periods)
+        else:
+            quota.roll_over(periods)
+        return quota
+
+    def record(self, user_id: str, project_id: Optional[str], tokens: float = 0, cost: float = 0.0):
+        """Add locally observed usage of a project to its quota and to the quota of its user."""
+        periods = quota_periods(self.clock())
+        recorded_at = time.monotonic()
+        recorded = (recorded_at, periods, tokens, cost)
+
+        with self._lock:
+            for key in {(user_id, project_id), (user_id, None)}:
+                quota = self._quota(key, periods)
+
+                # usage written by now is in the report of any later reconciliation, unless one is running
+                if not quota.reconcile_lock.locked():
+                    while quota.recorded and quota.recorded[0][0] < recorded_at - self.write_delay:
+                        quota.recorded.popleft()
+
+                quota.recorded.append(recorded)
+                for index in range(len(QUOTA_PERIODS)):
+                    quota.tokens[index] += tokens
+                    quota.costs[index] += cost
+
+    def reconcile(self, user_id: str, project_id: str = None, max_staleness: float = None):
+        """
+        Replace the usage and limits of a user (and project) by the current usage report of the database.
+
+        :param max_staleness: skip the reconciliation if the usage was reconciled within these seconds,
+            e.g. by a concurrent check that held the reconciliation lock first, none always reconciles
+        """
+        key = (user_id, project_id)
+        with self._lock:
+            quota = self._quota(key, quota_periods(self.clock()))
+
+        with quota.reconcile_lock:
+            if max_staleness is not None and quota.reconciled_at is not None \
+                    and time.monotonic() - quota.reconciled_at < max_staleness:
+                return
+
+            started = time.monotonic()
+            periods = quota_periods(self.clock())
+            report = self.storage.fetch_user_project_current_usage_report(user_id=user_id, project_id=project_id)
+            self._reconciled(quota, report, periods, started)
+
+            self.reconciliations += 1
+            self.reconcile_seconds += time.monotonic() - started
+
+    def _reconciled(self, quota: _Quota, report: Optional[UserProjectCurrentUsageReport], periods: Tuple[int, ...],
+                    started: float):
+        report = report or UserProjectCurrentUsageReport(user_id="")
+        token_limits = [getattr(report, f"limit_token_per_{period}") for period in QUOTA_PERIODS]
+        cost_limits = [getattr(report, f"limit_cost_per_{period}") for period in QUOTA_PERIODS]
+
+        # the report has the tokens used as a percentage of the limit only, rounded to 1/100 %
+        tokens = [(pct or 0.0) * limit / 100 if limit else 0.0
+                  for pct, limit in zip((getattr(report, f"pct_{period}_tokens_used") for period in QUOTA_PERIODS),
+                                        token_limits)]
+        costs = [getattr(report, f"cur_{period}_total_cost") or 0.0 for period in QUOTA_PERIODS]
+
+        with self._lock:
+            # the usage recorded since, or not yet written before, the report was started is added to it
+            written_before = started - self.write_delay
+            while quota.recorded and quota.recorded[0][0] < written_before:
+                quota.recorded.popleft()
+
+            current = quota_periods(self.clock())
+            for recorded_at, recorded_periods, recorded_tokens, recorded_cost in quota.recorded:
+                for index in range(len(QUOTA_PERIODS)):
+                    if recorded_periods[index] == current[index]:
+                        tokens[index] += recorded_tokens
+                        costs[index] += recorded_cost
+
+            # a period that ended while the report was fetched starts from the recorded usage only
+            for index in range(len(QUOTA_PERIODS)):
+                if periods[index] != current[index]:
+                    tokens[index] = sum(recorded[2] for recorded in quota.recorded
+                                        if recorded[1][index] == current[index])
+                    costs[index] = sum(recorded[3] for recorded in quota.recorded
+                                       if recorded[1][index] == current[index])
+
+            quota.token_limits = token_limits
+            quota.cost_limits = cost_limits
+            quota.tokens = tokens
+            quota.costs = costs
+            quota.periods = current
+            quota.reconciled_at = started
+
+    def check(self, user_id: str, project_id: str = None, max_staleness: float = None,
+              warn_pct: float = 90.0, block_pct: float = 100.0) -> Tuple[Decision, str]:
+        """
+        Check the usage of a user (and project) against its limits, like UserProjectCurrentUsageReport.is_allowed.
+
+        :param max_staleness: the maximum age in seconds of the database usage, defaults to the accumulator
+            max_staleness, the usage is reconciled first if it is older, 0 always reconciles
+        :return: the decision (ok, warn or block) and the reason
+        """
+        key = (user_id, project_id)
+        max_staleness = self.max_staleness if max_staleness is None else max_staleness
+        reconciled = False
+
+        while True:
+            with self._lock:
+                quota = self._quotas.get(key)
+                # a quota invalidated while it was reconciled is reconciled again, not taken as unlimited
+                if quota is not None and quota.reconciled_at is not None \
+                        and (reconciled or time.monotonic() - quota.reconciled_at < max_staleness):
+                    self.checks += 1
+                    quota.roll_over(quota_periods(self.clock()))
+                    return self._decision(quota, warn_pct=warn_pct, block_pct=block_pct)
+
+            self.reconcile(user_id, project_id, max_staleness=max_staleness)
+            reconciled = True
+
+    @staticmethod
+    def _decision(quota: _Quota, warn_pct: float, block_pct: float) -> Tuple[Decision, str]:
+        """The decision on the usage of a quota, must be called while holding the lock."""
+        first_warn = None
+        for kind, limits, used in (("token", quota.token_limits, quota.tokens),
+                                   ("cost", quota.cost_limits, quota.costs)):
+            for index, limit in enumerate(limits):
+                if not limit:
+                    continue
+
+                pct = 100 * used[index] / limit
+                if pct >= block_pct:
+                    return "block", f"{QUOTA_PERIODS[index]} {kind} cap exceeded ({pct:.2f}%)"
+                if first_warn is None and pct >= warn_pct:
+                    first_warn = f"{QUOTA_PERIODS[index]} {kind} nearing cap ({pct:.2f}%)"
+
+        if first_warn is not None:
+            return "warn", first_warn
+
+        return "ok", "within allowed limits"
+
+    def is_over_limit(self, user_id: str, project_id: str = None, max_staleness: float = None) -> bool:
+        """Whether the user (and project) exceeded any of its minute, hour, day, month or year limits."""
+        return self.check(user_id, project_id, max_staleness=max_staleness)[0] == "block"
+
+    def invalidate(self, user_id: str = None):
+        """Drop the quotas of a user, or all quotas, e.g. after a tier change, these are reconciled on next check."""
+        with self._lock:
+            for key in [key for key in self._quotas if user_id is None or key[0] == user_id]:
+                del self._quotas[key]
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'quotas': len(self._quotas),
+                'checks': self.checks,
+                'reconciliations': self.reconciliations,
+                'reconcile_seconds': self.reconcile_seconds,
+            }
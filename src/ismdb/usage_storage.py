@@ -1,19 +1,660 @@
+import atexit
+import datetime as dt
+import json
+import logging as log
+import os
 import re
-from typing import List, Type, cast, T
+import threading
+from typing import Any, Callable, Dict, List, Optional, Tuple, Type, cast, T
 
-from ismcore.model.base_model_usage_and_limits import (UsageReport, UserProjectCurrentUsageReport)
+from ismcore.model.base_model_usage_and_limits import (Usage, UsageReport, UserProjectCurrentUsageReport)
 from ismcore.storage.processor_state_storage import UsageStorage, FieldConfig
 from pydantic import BaseModel
 
 from ismdb.base import BaseDatabaseAccessSinglePool
+from ismdb.buffered_writer import BackgroundCopyWriter
+from ismdb.memory_cache import MemoryCache
+
+logging = log.getLogger(__name__)
 
 _IDENTIFIER_RE = re.compile(r"^[A-Za-z_][A-Za-z0-9_$.]*$")
 
+# read the usage reports from the rollup tables, see bootstrap/migrations/004_add_usage_report_rollups.sql
+USAGE_REPORT_ROLLUPS = os.environ.get("USAGE_REPORT_ROLLUPS", "true").lower() in ("true", "1", "yes")
+
+# seconds after its end a bucket is closed and final, usage recorded later is only reflected by a rebuild
+USAGE_ROLLUP_CLOSE_DELAY_SECONDS = float(os.environ.get("USAGE_ROLLUP_CLOSE_DELAY_SECONDS", 120))
+
+# seconds between the rollup refreshes of the background refresher started on first read of the rollups, 0 to
+# only refresh by calling refresh_usage_rollups, e.g. from a scheduled job
+USAGE_ROLLUP_REFRESH_SECONDS = float(os.environ.get("USAGE_ROLLUP_REFRESH_SECONDS", 60))
+
+# in-process cache of the grouped usage reports, disabled when 0, the reports of closed periods are only evicted
+# by the cache size, the reports of the current period expire after the ttl
+USAGE_REPORT_CACHE_SIZE = int(os.environ.get("USAGE_REPORT_CACHE_SIZE", 0))
+USAGE_REPORT_CACHE_TTL = float(os.environ.get("USAGE_REPORT_CACHE_TTL", 5))
+
+# the buffered usage writer, see UsageDatabaseStorage.record_usage, rows recorded to a full buffer are dropped
+USAGE_WRITER_BATCH_SIZE = int(os.environ.get("USAGE_WRITER_BATCH_SIZE", 1000))
+USAGE_WRITER_FLUSH_SECONDS = float(os.environ.get("USAGE_WRITER_FLUSH_SECONDS", 1.0))
+USAGE_WRITER_MAX_BUFFERED = int(os.environ.get("USAGE_WRITER_MAX_BUFFERED", 100_000))
+USAGE_WRITER_METHOD = os.environ.get("USAGE_WRITER_METHOD", "copy")
+# the maximum seconds to wait for the buffered usage events to be written on interpreter shutdown
+USAGE_WRITER_CLOSE_SECONDS = float(os.environ.get("USAGE_WRITER_CLOSE_SECONDS", 10))
+
+USAGE_COLUMNS = ["transaction_time", "project_id", "resource_id", "resource_type",
+                 "unit_type", "unit_subtype", "unit_count", "metadata"]
+
+# the rollup table of each granularity, its source and date columns, each rolls up the finer one before it
+USAGE_ROLLUPS = {
+    "minute": ("usage_report_minutely", "usage_minute_rollup_with_price", ["year", "month", "day", "hour", "minute"]),
+    "hour": ("usage_report_hourly", "usage_report_minutely", ["year", "month", "day", "hour"]),
+    "day": ("usage_report_daily", "usage_report_hourly", ["year", "month", "day"]),
+    "month": ("usage_report_monthly", "usage_report_daily", ["year", "month"]),
+}
+
+# the granularity of each rollup table
+USAGE_ROLLUP_TABLES = {table: granularity for granularity, (table, _, _) in USAGE_ROLLUPS.items()}
+
+# the report views served by the rollup tables
+USAGE_ROLLUP_VIEWS = {
+    "usage_minutely_v": "minute",
+    "usage_hourly_v": "hour",
+    "usage_daily_v": "day",
+    "usage_monthly_v": "month",
+}
+
+USAGE_REPORT_MEASURES = [
+    "input_cost", "input_price", "input_tokens", "input_count",
+    "output_cost", "output_price", "output_tokens", "output_count",
+    "total_cost", "total_tokens",
+]
+
+
+def rollup_measures_sql(named: bool = False) -> str:
+    """The measures rolled up from a finer rollup table, prices are the maximum like in the report views."""
+    return ", ".join(
+        f"{'MAX' if measure.endswith('_price') else 'SUM'}({measure})" + (f" AS {measure}" if named else "")
+        for measure in USAGE_REPORT_MEASURES)
+
+
+# the measures of the minute rollup, as computed by the USAGE_MINUTELY_V view, in USAGE_REPORT_MEASURES order
+USAGE_MINUTE_MEASURES = [
+    "SUM(input_cost)", "MAX(input_price_per_1k_tokens)", "SUM(input_tokens)", "SUM(input_count)",
+    "SUM(output_cost)", "MAX(output_price_per_1k_tokens)", "SUM(output_tokens)", "SUM(output_count)",
+    "SUM(input_cost + output_cost)", "SUM(input_tokens + output_tokens)",
+]
+
+# the date columns of the usage reports, from the coarsest to the finest period
+USAGE_REPORT_PERIODS = ["year", "month", "day", "hour", "minute"]
+
+# the views and tables of usage by date and the rollup granularity these are served by, reports of these pinned
+# to a period before the rollup watermark of the granularity never change
+USAGE_REPORT_DATED_SOURCES = {
+    **USAGE_ROLLUP_VIEWS, "usage_yearly_v": "month",
+    **USAGE_ROLLUP_TABLES,
+}
+
+# the dimensions a usage series can be grouped by
+USAGE_SERIES_DIMENSIONS = ("project_id", "resource_id", "resource_type")
+
+
+def truncate_to_bucket(timestamp: dt.datetime, granularity: str) -> dt.datetime:
+    """The start of the utc bucket of the granularity (minute, hour, day, month) holding the timestamp."""
+    if timestamp.tzinfo is None:
+        timestamp = timestamp.replace(tzinfo=dt.timezone.utc)
+
+    timestamp = timestamp.astimezone(dt.timezone.utc).replace(second=0, microsecond=0)
+    if granularity == "minute":
+        return timestamp
+    if granularity == "hour":
+        return timestamp.replace(minute=0)
+    if granularity == "day":
+        return timestamp.replace(hour=0, minute=0)
+    if granularity == "month":
+        return timestamp.replace(day=1, hour=0, minute=0)
+
+    raise ValueError(f"unsupported usage rollup granularity: {granularity}")
+
+
+def next_bucket(bucket: dt.datetime, granularity: str) -> dt.datetime:
+    """The start of the bucket following a bucket start of the granularity (minute, hour, day, month, year)."""
+    if granularity == "year":
+        return bucket.replace(year=bucket.year + 1)
+    if granularity == "month":
+        return bucket.replace(year=bucket.year + bucket.month // 12, month=bucket.month % 12 + 1)
+
+    return bucket + dt.timedelta(**{f"{granularity}s": 1})
+
+
+def usage_report_cache_key(base_sql: str, conditions_and_grouping: List[FieldConfig]) -> str:
+    """The cache key of a grouped usage report, the field configs are normalised, their order does not matter."""
+    fields = sorted(
+        (field_config.field_name.lower(),
+         repr(field_config.value) if field_config.use_in_where and field_config.value is not None else None,
+         bool(field_config.use_in_group_by),
+         (getattr(field_config, "aggregate", None) or "").upper())
+        for field_config in conditions_and_grouping)
+    return repr((base_sql, fields))
+
+
+def usage_report_period_end(conditions_and_grouping: List[FieldConfig]) -> Optional[dt.datetime]:
+    """
+    The utc end of the period a grouped usage report is limited to by its where conditions on the date
+    columns, e.g. the end of a month given the year and month, None if it is not limited to a period.
+    """
+    values = {field_config.field_name.lower(): field_config.value for field_config in conditions_and_grouping
+              if field_config.use_in_where and field_config.value is not None}
+
+    pinned = []
+    for period in USAGE_REPORT_PERIODS:
+        if period not in values:
+            break
+        pinned.append(values[period])
+
+    if not pinned:
+        return None
+
+    try:
+        year, month, day, hour, minute = [int(value) for value in pinned] + [1, 1, 0, 0][len(pinned) - 1:]
+        start = dt.datetime(year, month, day, hour, minute, tzinfo=dt.timezone.utc)
+    except (TypeError, ValueError):
+        return None
+
+    return next_bucket(start, USAGE_REPORT_PERIODS[len(pinned) - 1])
+
+
+def usage_rollup_select_sql(granularity: str, source: str, since: str) -> str:
+    """
+    The select of the rollup rows of a granularity, in the columns of its rollup table, from its source from the
+    bucket start expression since on. The source is the minute usage for the minute granularity, otherwise the
+    rows of the finer rollup table.
+    """
+    _, _, date_columns = USAGE_ROLLUPS[granularity]
+    dates = ", ".join(f"{column}::INT AS {column}" for column in date_columns)
+
+    if granularity == "minute":
+        bucket = "bucket_utc"
+        measures = ", ".join(f"{measure} AS {name}" for measure, name in zip(USAGE_MINUTE_MEASURES,
+                                                                              USAGE_REPORT_MEASURES))
+    else:
+        bucket = f"DATE_TRUNC('{granularity}', bucket_utc AT TIME ZONE 'UTC') AT TIME ZONE 'UTC'"
+        measures = rollup_measures_sql(named=True)
+
+    return f"""
+        SELECT {bucket} AS bucket_utc, user_id, project_id, {dates}, resource_type, resource_id, {measures}
+          FROM {source}
+         WHERE bucket_utc >= {since}
+         GROUP BY {bucket}, user_id, project_id, {", ".join(date_columns)}, resource_type, resource_id"""
+
+
+def usage_rollup_sql(granularity: str) -> str:
+    """The insert of the rollup rows of a granularity from its source, from a bucket start parameter on."""
+    table, source, date_columns = USAGE_ROLLUPS[granularity]
+    columns = ["bucket_utc", "user_id", "project_id", *date_columns, "resource_type", "resource_id",
+               *USAGE_REPORT_MEASURES]
+
+    return f"INSERT INTO {table} ({', '.join(columns)}) {usage_rollup_select_sql(granularity, source, '%s')}"
+
+
+def usage_rollup_source_sql(granularity: str) -> str:
+    """
+    The rows of the rollup table of a granularity as of now, as a from clause aliased by the table name. The
+    closed buckets before the watermark are read from the table, the buckets from the watermark on are rolled
+    up as read from the finer granularity (the minute usage for the minute granularity), such that the reads
+    are current without refreshing the rollups first.
+    """
+    table, source, date_columns = USAGE_ROLLUPS[granularity]
+    columns = ["bucket_utc", "user_id", "project_id", *date_columns, "resource_type", "resource_id",
+               *USAGE_REPORT_MEASURES]
+    if granularity != "minute":
+        source = usage_rollup_source_sql(USAGE_REPORT_PERIODS[USAGE_REPORT_PERIODS.index(granularity) + 1])
+
+    # all buckets are rolled up as read until the first refresh
+    watermark = (f"COALESCE((SELECT closed_before_utc FROM usage_report_rollup_watermark "
+                 f"WHERE granularity = '{granularity}'), '-infinity'::TIMESTAMPTZ)")
+
+    return f"""(
+        SELECT {", ".join(columns)} FROM {table} WHERE bucket_utc < {watermark}
+        UNION ALL {usage_rollup_select_sql(granularity, source, watermark)}) {table}"""
+
+
+def usage_report_sql(granularity: str) -> str:
+    """The select of the usage report of a granularity (minute, hour, day, month, year) from the rollup tables."""
+    if granularity == "year":
+        # twelve monthly rows per year at most, not worth a table of its own
+        return (f"SELECT * FROM (SELECT user_id, project_id, year, resource_type, resource_id, "
+                f"{rollup_measures_sql(named=True)} FROM {usage_rollup_source_sql('month')} "
+                f"GROUP BY user_id, project_id, year, resource_type, resource_id) usage_report_yearly")
+
+    _, _, date_columns = USAGE_ROLLUPS[granularity]
+    return (f"SELECT user_id, project_id, {', '.join(date_columns)}, resource_type, resource_id, "
+            f"{', '.join(USAGE_REPORT_MEASURES)} FROM {usage_rollup_source_sql(granularity)}")
+
+
+def usage_report_query(granularity: str, view: str, rollups: bool) -> Tuple[str, Optional[List[str]]]:
+    """The select of the usage report of a granularity and its order by, from the rollup tables or the view."""
+    if not rollups:
+        return f"SELECT * FROM {view}", None
+
+    # ordered like the report views, latest first
+    date_columns = USAGE_ROLLUPS[granularity][2] if granularity != "year" else ["year"]
+    order_by = [f"{column} DESC" for column in date_columns] + ["resource_type", "resource_id"]
+    return usage_report_sql(granularity), order_by
+
+
+def usage_report_source(table_or_view: str, rollups: bool) -> str:
+    """The table or view a usage report is selected from, the report views are served by the rollup tables."""
+    granularity = USAGE_ROLLUP_VIEWS.get(table_or_view.lower())
+    if granularity and rollups:
+        return USAGE_ROLLUPS[granularity][0]
+
+    return table_or_view
+
+
+def usage_report_from_sql(table_or_view: str) -> str:
+    """The from clause of a usage report of a table or view, the rollup tables are read as of now."""
+    granularity = USAGE_ROLLUP_TABLES.get(table_or_view.lower())
+    return f"FROM {usage_rollup_source_sql(granularity) if granularity else table_or_view}"
+
+
+def usage_series_sql(granularity: str, group_by: List[str], zero_fill: bool, rollups: bool,
+                     project_id: bool = False) -> str:
+    """
+    The select of the usage of a user by bucket of the granularity in a time range, grouped by the dimensions.
+
+    The parameters are the user id, (the project id,) the first bucket start and the end of the last bucket,
+    and if zero filled, the first and last bucket starts again.
+    """
+    if rollups:
+        source = usage_rollup_source_sql(granularity)
+        measures = [f"{'MAX' if measure.endswith('_price') else 'SUM'}({measure})"
+                    for measure in USAGE_REPORT_MEASURES]
+    else:
+        source = "usage_minute_rollup_with_price"
+        measures = USAGE_MINUTE_MEASURES
+
+    if rollups or granularity == "minute":
+        bucket = "bucket_utc"
+    else:
+        bucket = f"DATE_TRUNC('{granularity}', bucket_utc AT TIME ZONE 'UTC') AT TIME ZONE 'UTC'"
+
+    dimensions = "".join(f", {dimension}" for dimension in group_by)
+    where = "user_id = %s" + (" AND project_id = %s" if project_id else "")
+
+    # a range on bucket_utc, such that the (user_id, bucket_utc) indexes apply
+    series_sql = f"""
+        SELECT {bucket} AS bucket_utc{dimensions},
+               {", ".join(f"{measure} AS {name}" for measure, name in zip(measures, USAGE_REPORT_MEASURES))}
+          FROM {source}
+         WHERE {where} AND bucket_utc >= %s AND bucket_utc < %s
+         GROUP BY {bucket}{dimensions}"""
+
+    dates = ", ".join(f"EXTRACT({column} FROM s.bucket_utc AT TIME ZONE 'UTC')::INT AS {column}"
+                      for column in USAGE_ROLLUPS[granularity][2])
+    order_by = "".join(f", {dimension}" for dimension in group_by)
+
+    if not zero_fill:
+        return f"""
+            SELECT s.*, {dates}
+              FROM ({series_sql}) s
+             ORDER BY s.bucket_utc{order_by}"""
+
+    # every bucket of the range, for every combination of the dimensions with usage in the range
+    measures = ", ".join(f"COALESCE(u.{measure}, 0) AS {measure}" for measure in USAGE_REPORT_MEASURES)
+    combinations = f"CROSS JOIN (SELECT DISTINCT {', '.join(group_by)} FROM series) d" if group_by else ""
+    join = "".join(f" AND u.{dimension} = d.{dimension}" for dimension in group_by)
+
+    return f"""
+        WITH series AS ({series_sql})
+        SELECT s.bucket_utc{"".join(f", d.{dimension}" for dimension in group_by)}, {measures}, {dates}
+          FROM (SELECT generate_series(%s::TIMESTAMP, %s::TIMESTAMP, INTERVAL '1 {granularity}')
+                       AT TIME ZONE 'UTC' AS bucket_utc) s
+          {combinations}
+          LEFT JOIN series u ON u.bucket_utc = s.bucket_utc{join}
+         ORDER BY s.bucket_utc{order_by}"""
+
+
+def usage_row(usage: Usage) -> tuple:
+    """The USAGE_COLUMNS values of a usage event, the transaction time in utc (the usage triggers assume utc)."""
+    transaction_time = usage.transaction_time
+    if transaction_time is None:
+        transaction_time = dt.datetime.now(dt.timezone.utc)
+    if transaction_time.tzinfo is not None:
+        transaction_time = transaction_time.astimezone(dt.timezone.utc).replace(tzinfo=None)
+
+    return (transaction_time, usage.project_id, usage.resource_id, usage.resource_type,
+            usage.unit_type.value, usage.unit_subtype.value, usage.unit_count,
+            json.dumps(usage.metadata) if usage.metadata is not None else None)
+
+
+def user_project_current_usage_report_fields(user_id: str, project_id: str = None) -> dict:
+    """The fetch_usage_report_generic arguments of the current usage and limits of a user (and project)."""
+    kwargs = {
+        "table_or_view": "user_project_current_usage_report",
+        "model": UserProjectCurrentUsageReport,
+        "user_id": FieldConfig("user_id", value=user_id, use_in_group_by=True, use_in_where=True),
+        "tier_id": FieldConfig("tier_id", value=None, use_in_group_by=True, use_in_where=False),
+
+        ### tier / quota token limits for a period
+        "limit_per_minute": FieldConfig("limit_token_per_minute", value=None, use_in_where=False, aggregate="MAX"),
+        "limit_per_hour": FieldConfig("limit_token_per_hour", value=None, use_in_where=False, aggregate="MAX"),
+        "limit_per_day": FieldConfig("limit_token_per_day", value=None, use_in_where=False, aggregate="MAX"),
+        "limit_per_month": FieldConfig("limit_token_per_month", value=None, use_in_where=False, aggregate="MAX"),
+        "limit_per_year": FieldConfig("limit_token_per_year", value=None, use_in_where=False, aggregate="MAX"),
+
+        ### tier / quotas cost limits for a period
+        "limit_cost_per_minute": FieldConfig("limit_cost_per_minute", value=None, use_in_where=True,
+                                             aggregate="MAX"),
+        "limit_cost_per_hour": FieldConfig("limit_cost_per_hour", value=None, use_in_where=True, aggregate="MAX"),
+        "limit_cost_per_day": FieldConfig("limit_cost_per_day", value=None, use_in_where=True, aggregate="MAX"),
+        "limit_cost_per_month": FieldConfig("limit_cost_per_month", value=None, use_in_where=True, aggregate="MAX"),
+        "limit_cost_per_year": FieldConfig("limit_cost_per_year", value=None, use_in_where=True, aggregate="MAX"),
+
+        # current running costs
+        "cur_minute_total_cost": FieldConfig("cur_minute_total_cost", value=None, use_in_where=True,
+                                             aggregate="SUM"),
+        "cur_hour_total_cost": FieldConfig("cur_hour_total_cost", value=None, use_in_where=True, aggregate="SUM"),
+        "cur_day_total_cost": FieldConfig("cur_day_total_cost", value=None, use_in_where=True, aggregate="SUM"),
+        "cur_month_total_cost": FieldConfig("cur_month_total_cost", value=None, use_in_where=True, aggregate="SUM"),
+        "cur_year_total_cost": FieldConfig("cur_year_total_cost", value=None, use_in_where=True, aggregate="SUM"),
+
+        ##
+        "pct_minute_tokens_used": FieldConfig("pct_minute_tokens_used", value=None, aggregate="SUM"),
+        "pct_hour_tokens_used": FieldConfig("pct_hour_tokens_used", value=None, aggregate="SUM"),
+        "pct_day_tokens_used": FieldConfig("pct_day_tokens_used", value=None, aggregate="SUM"),
+        "pct_month_tokens_used": FieldConfig("pct_month_tokens_used", value=None, aggregate="SUM"),
+        "pct_year_tokens_used": FieldConfig("pct_year_tokens_used", value=None, aggregate="SUM"),
+        "pct_minute_cost_used": FieldConfig("pct_minute_cost_used", value=None, aggregate="SUM"),
+        "pct_hour_cost_used": FieldConfig("pct_hour_cost_used", value=None, aggregate="SUM"),
+        "pct_day_cost_used": FieldConfig("pct_day_cost_used", value=None, aggregate="SUM"),
+        "pct_month_cost_used": FieldConfig("pct_month_cost_used", value=None, aggregate="SUM"),
+        "pct_year_cost_used": FieldConfig("pct_year_cost_used", value=None, aggregate="SUM"),
+    }
+
+    if project_id is not None:
+        kwargs["project_id"] = FieldConfig("project_id", value=project_id, use_in_group_by=True, use_in_where=True)
+
+    return kwargs
+
+
 class UsageDatabaseStorage(UsageStorage, BaseDatabaseAccessSinglePool):
 
-    def fetch_usage_report_minutely(self, user_id, project_id, resource_id, resource_type, year, month, day, hour, minute) -> List[UsageReport]:
-        base_sql = "SELECT * FROM USAGE_MINUTELY_V"
+    def __init__(self, database_url, incremental: bool = False, report_cache: MemoryCache = None):
+        super().__init__(database_url=database_url, incremental=incremental)
+
+        if report_cache is None and USAGE_REPORT_CACHE_SIZE > 0:
+            report_cache = MemoryCache(maxsize=USAGE_REPORT_CACHE_SIZE, ttl=USAGE_REPORT_CACHE_TTL)
+
+        self.report_cache = report_cache
+
+    def fetch_usage_report_cache_stats(self) -> Optional[Dict[str, Any]]:
+        return self.report_cache.stats() if self.report_cache is not None else None
+
+    def _execute_usage_report_query(self, table_or_view: str, conditions_and_grouping: List[FieldConfig],
+                                    mapper: Callable[[Dict], Any]) -> Optional[List[Any]]:
+        """
+        The grouped usage report of the table or view, from the report cache if enabled. A report limited to
+        a period of a dated source that ended before the rollup watermark stays cached until evicted, any other
+        report for the cache ttl.
+        """
+        base_sql = usage_report_from_sql(table_or_view)
+        if self.report_cache is None:
+            return self.execute_query_grouped(base_sql, conditions_and_grouping, mapper)
+
+        key = usage_report_cache_key(base_sql, conditions_and_grouping)
+        rows = self.report_cache.get(key)
+
+        if rows is None:
+            # closed once the rollup buckets of the period are, these are never recomputed (unless rebuilt), the
+            # watermark is read first, such that a refresh in between does not close a report of open buckets
+            granularity = USAGE_REPORT_DATED_SOURCES.get(table_or_view.lower())
+            period_end = usage_report_period_end(conditions_and_grouping) if granularity else None
+            closed = False
+            if period_end is not None:
+                watermark = self.fetch_usage_rollup_watermarks().get(granularity)
+                closed = watermark is not None and period_end <= watermark
+
+            rows = self.execute_query_grouped(base_sql, conditions_and_grouping, lambda row: row) or []
+
+            self.report_cache.set(key, rows, ttl=None if closed else USAGE_REPORT_CACHE_TTL)
+
+        # the cached rows are mapped per call, the callers do not share the models
+        return [mapper(row) for row in rows] or None
+
+    # the stop event and thread of the background rollup refresher by database url, shared by the storages of
+    # this process
+    _rollup_refreshers = {}
+    _rollup_refreshers_lock = threading.Lock()
+
+    # the buffered usage writer by database url, shared by the storages of this process
+    _usage_writers = {}
+    _usage_writers_lock = threading.Lock()
+
+    def usage_writer(self) -> BackgroundCopyWriter:
+        """The buffered writer of the usage events recorded by record_usage, created on first use."""
+        writer = UsageDatabaseStorage._usage_writers.get(self.database_url)
+        if writer is not None:
+            return writer
+
+        with UsageDatabaseStorage._usage_writers_lock:
+            writer = UsageDatabaseStorage._usage_writers.get(self.database_url)
+            if writer is None:
+                writer = BackgroundCopyWriter(
+                    connection_pool=self.connection_pool,
+                    table="usage",
+                    columns=USAGE_COLUMNS,
+                    batch_size=USAGE_WRITER_BATCH_SIZE,
+                    flush_interval=USAGE_WRITER_FLUSH_SECONDS,
+                    method=USAGE_WRITER_METHOD,
+                    max_buffered=USAGE_WRITER_MAX_BUFFERED)
+                UsageDatabaseStorage._usage_writers[self.database_url] = writer
+
+        return writer
+
+    def record_usage(self, usage: Usage) -> bool:
+        """
+        Record a usage event, the event is buffered and written in a batch by a background thread within
+        USAGE_WRITER_FLUSH_SECONDS, see usage_writer().stats() for the buffer depth, flush latency and drops.
+
+        :return: False if the buffer was full and the event was dropped
+        """
+        return self.usage_writer().write(usage_row(usage))
+
+    def record_usages(self, usages: List[Usage]) -> int:
+        """Record the usage events, returns the number of events dropped."""
+        return self.usage_writer().write_many([usage_row(usage) for usage in usages])
+
+    def flush_usage(self) -> int:
+        """Write the buffered usage events now, returns the number of events written."""
+        writer = UsageDatabaseStorage._usage_writers.get(self.database_url)
+        return writer.flush() if writer is not None else 0
+
+    @classmethod
+    def close_usage_writers(cls, timeout: Optional[float] = USAGE_WRITER_CLOSE_SECONDS):
+        """
+        Flush the buffered usage events and stop the writers, called on interpreter shutdown, waits at most
+        timeout seconds per writer, or until the events are written if None.
+        """
+        with cls._usage_writers_lock:
+            writers = list(cls._usage_writers.values())
+            cls._usage_writers.clear()
+
+        for writer in writers:
+            writer.close(timeout)
+
+    def refresh_usage_rollups(self, now: dt.datetime = None, since: dt.datetime = None) -> bool:
+        """
+        Bring the usage rollup tables up to date, incrementally from the watermark of each granularity, the
+        first bucket that is not closed yet. Only the buckets from the watermark on are recomputed, buckets
+        close USAGE_ROLLUP_CLOSE_DELAY_SECONDS after their end and are never recomputed after that, unless
+        a rebuild is requested by since. The first refresh builds the rollups from all the recorded usage.
 
+        Concurrent refreshes (by any process) are skipped, the rollups are being refreshed already.
+
+        :param now: the current time, defaults to the current utc time
+        :param since: recompute the closed buckets from this time on, e.g. after usage was recorded late
+        :return: whether the rollups were refreshed
+        """
+        now = now or dt.datetime.now(dt.timezone.utc)
+        closing = now - dt.timedelta(seconds=USAGE_ROLLUP_CLOSE_DELAY_SECONDS)
+
+        with self.transaction() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT pg_try_advisory_xact_lock(hashtext('ismdb.usage_report_rollup'))")
+                if not cursor.fetchone()[0]:
+                    return False
+
+                for granularity, (table, source, _) in USAGE_ROLLUPS.items():
+                    cursor.execute(
+                        "SELECT closed_before_utc FROM usage_report_rollup_watermark WHERE granularity = %s",
+                        [granularity])
+                    row = cursor.fetchone()
+                    watermark = row[0] if row else None
+
+                    if since is not None:
+                        since_bucket = truncate_to_bucket(since, granularity)
+                        watermark = since_bucket if watermark is None else min(watermark, since_bucket)
+
+                    if watermark is None:
+                        # first refresh, build from the first recorded bucket on
+                        cursor.execute(f"SELECT MIN(bucket_utc) FROM {source}")
+                        first_bucket = cursor.fetchone()[0]
+                        if first_bucket is None:
+                            continue
+                        watermark = truncate_to_bucket(first_bucket, granularity)
+
+                    cursor.execute(f"DELETE FROM {table} WHERE bucket_utc >= %s", [watermark])
+                    cursor.execute(usage_rollup_sql(granularity), [watermark])
+
+                    # the watermark never moves back, unless a rebuild was requested
+                    closed_before = truncate_to_bucket(closing, granularity)
+                    if since is None:
+                        closed_before = max(closed_before, watermark)
+
+                    cursor.execute("""
+                        INSERT INTO usage_report_rollup_watermark (granularity, closed_before_utc, refreshed_utc)
+                        VALUES (%s, %s, %s)
+                        ON CONFLICT (granularity)
+                        DO UPDATE SET closed_before_utc = EXCLUDED.closed_before_utc,
+                                      refreshed_utc = EXCLUDED.refreshed_utc""",
+                                   [granularity, closed_before, now])
+
+        # the rebuilt periods may be cached as closed
+        if since is not None and self.report_cache is not None:
+            self.report_cache.clear()
+
+        return True
+
+    def fetch_usage_rollup_watermarks(self) -> Dict[str, dt.datetime]:
+        """The watermark of each rollup granularity, the buckets before it are closed."""
+        watermarks = self.execute_query_fixed(
+            "SELECT granularity, closed_before_utc FROM usage_report_rollup_watermark", None,
+            lambda row: (row["granularity"], row["closed_before_utc"]))
+        return {granularity: watermark for granularity, watermark in watermarks or [] if watermark is not None}
+
+    def start_usage_rollup_refresher(self, interval: float = None) -> bool:
+        """
+        Refresh the usage rollups of the database url every interval seconds (USAGE_ROLLUP_REFRESH_SECONDS) from
+        a background thread, one per database url and process. The reads never wait on a refresh, these read
+        the buckets after the watermark as of now, see usage_rollup_source_sql.
+
+        :return: whether the refresher was started, False if it runs already
+        """
+        interval = USAGE_ROLLUP_REFRESH_SECONDS if interval is None else interval
+        if self.database_url in UsageDatabaseStorage._rollup_refreshers:
+            return False
+
+        stopped = threading.Event()
+
+        def refresh():
+            while not stopped.is_set():
+                try:
+                    self.refresh_usage_rollups()
+                except Exception as e:
+                    logging.error(f'error refreshing the usage rollups: {e}')
+                stopped.wait(interval)
+
+        with UsageDatabaseStorage._rollup_refreshers_lock:
+            if self.database_url in UsageDatabaseStorage._rollup_refreshers:
+                return False
+
+            thread = threading.Thread(target=refresh, name="usage-rollup-refresher", daemon=True)
+            UsageDatabaseStorage._rollup_refreshers[self.database_url] = (stopped, thread)
+
+        thread.start()
+        return True
+
+    @classmethod
+    def stop_usage_rollup_refreshers(cls, timeout: Optional[float] = None):
+        """Stop the background rollup refreshers, waits at most timeout seconds for a refresh in progress."""
+        with cls._rollup_refreshers_lock:
+            refreshers = list(cls._rollup_refreshers.values())
+            cls._rollup_refreshers.clear()
+
+        for stopped, thread in refreshers:
+            stopped.set()
+        for stopped, thread in refreshers:
+            thread.join(timeout)
+
+    def _use_usage_rollups(self) -> bool:
+        """Whether the usage reports are read from the rollup tables, the background refresher is started first."""
+        if not USAGE_REPORT_ROLLUPS:
+            return False
+
+        if USAGE_ROLLUP_REFRESH_SECONDS > 0:
+            self.start_usage_rollup_refresher()
+
+        return True
+
+    def _fetch_usage_report(self, granularity: str, view: str, conditions: dict) -> List[UsageReport]:
+        sql, order_by = usage_report_query(granularity, view, self._use_usage_rollups())
+        return self.execute_query_many2(sql, conditions, lambda row: UsageReport(**row), order_by=order_by)
+
+    def fetch_usage_series(self, user_id: str, start: dt.datetime, end: dt.datetime, granularity: str = "hour",
+                           project_id: str = None, group_by: List[str] = None,
+                           zero_fill: bool = False) -> List[UsageReport]:
+        """
+        Fetch the usage of a user (and project) by bucket in a time range in one query, e.g. the 24 hourly
+        buckets of a usage chart, in bucket order. A bucket is identified by the date columns of its
+        granularity (year, month, day, hour, minute), the dimensions not grouped by are None.
+
+        :param start: the start of the range, the bucket holding it is the first bucket (naive is utc)
+        :param end: the exclusive end of the range, the bucket holding the instant before it is the last bucket
+        :param granularity: the bucket size, minute, hour, day or month
+        :param group_by: the dimensions to group the buckets by, project_id, resource_id and resource_type
+        :param zero_fill: return the buckets without usage too, with zero measures, for every combination
+            of the group by dimensions with usage in the range
+        """
+        group_by = list(group_by or [])
+        if granularity not in USAGE_ROLLUPS:
+            raise ValueError(f"unsupported usage series granularity: {granularity}, must be one of "
+                             f"{list(USAGE_ROLLUPS)}")
+
+        unsupported = [dimension for dimension in group_by if dimension not in USAGE_SERIES_DIMENSIONS]
+        if unsupported:
+            raise ValueError(f"unsupported usage series dimensions: {unsupported}, must be any of "
+                             f"{list(USAGE_SERIES_DIMENSIONS)}")
+
+        first_bucket = truncate_to_bucket(start, granularity)
+        last_bucket = truncate_to_bucket(
+            (end if end.tzinfo else end.replace(tzinfo=dt.timezone.utc)) - dt.timedelta(microseconds=1),
+            granularity)
+        if last_bucket < first_bucket:
+            return []
+
+        sql = usage_series_sql(granularity, group_by, zero_fill, rollups=self._use_usage_rollups(),
+                               project_id=project_id is not None)
+
+        params = [user_id] + ([project_id] if project_id is not None else [])
+        params += [first_bucket, next_bucket(last_bucket, granularity)]
+        if zero_fill:
+            params += [first_bucket.replace(tzinfo=None), last_bucket.replace(tzinfo=None)]
+
+        return self.execute_query_fixed(
+            sql, params, lambda row: UsageReport(**{"user_id": user_id, "project_id": project_id, **row})) or []
+
+    def fetch_usage_report_minutely(self, user_id, project_id, resource_id, resource_type, year, month, day, hour, minute) -> List[UsageReport]:
         conditions = {
             "user_id": user_id,
             "project_id": project_id,
@@ -26,11 +667,9 @@ class UsageDatabaseStorage(UsageStorage, BaseDatabaseAccessSinglePool):
             "minute": minute,
         }
 
-        return self.execute_query_many(base_sql, conditions, lambda row: UsageReport(**row))
+        return self._fetch_usage_report("minute", "USAGE_MINUTELY_V", conditions)
 
     def fetch_usage_report_hourly(self, user_id, project_id, resource_id, resource_type, year, month, day, hour) -> List[UsageReport]:
-        base_sql = "SELECT * FROM USAGE_HOURLY_V"
-
         conditions = {
             "user_id": user_id,
             "project_id": project_id,
@@ -42,11 +681,9 @@ class UsageDatabaseStorage(UsageStorage, BaseDatabaseAccessSinglePool):
             "hour": hour,
         }
 
-        return self.execute_query_many(base_sql, conditions, lambda row: UsageReport(**row))
+        return self._fetch_usage_report("hour", "USAGE_HOURLY_V", conditions)
 
     def fetch_usage_report_daily(self, user_id, project_id, resource_id, resource_type, year, month, day) -> List[UsageReport]:
-        base_sql = "SELECT * FROM USAGE_DAILY_V"
-
         conditions = {
             "user_id": user_id,
             "project_id": project_id,
@@ -57,11 +694,9 @@ class UsageDatabaseStorage(UsageStorage, BaseDatabaseAccessSinglePool):
             "day": day
         }
 
-        return self.execute_query_many(base_sql, conditions, lambda row: UsageReport(**row))
+        return self._fetch_usage_report("day", "USAGE_DAILY_V", conditions)
 
     def fetch_usage_report_monthly(self, user_id, project_id, resource_id, resource_type, year, month) -> List[UsageReport]:
-        base_sql = "SELECT * FROM USAGE_MONTHLY_V"
-
         conditions = {
             "user_id": user_id,
             "project_id": project_id,
@@ -71,12 +706,10 @@ class UsageDatabaseStorage(UsageStorage, BaseDatabaseAccessSinglePool):
             "month": month,
         }
 
-        return self.execute_query_many(base_sql, conditions, lambda row: UsageReport(**row))
+        return self._fetch_usage_report("month", "USAGE_MONTHLY_V", conditions)
 
 
     def fetch_usage_report_yearly(self, user_id, project_id, resource_id, resource_type, year) -> List[UsageReport]:
-        base_sql = "SELECT * FROM USAGE_YEARLY_V"
-
         conditions = {
             "user_id": user_id,
             "project_id": project_id,
@@ -85,7 +718,7 @@ class UsageDatabaseStorage(UsageStorage, BaseDatabaseAccessSinglePool):
             "year": year,
         }
 
-        return self.execute_query_many(base_sql, conditions, lambda row: UsageReport(**row))
+        return self._fetch_usage_report("year", "USAGE_YEARLY_V", conditions)
 
 
     def fetch_usage_report(self, **kwargs) -> List[UsageReport]:
@@ -104,7 +737,7 @@ class UsageDatabaseStorage(UsageStorage, BaseDatabaseAccessSinglePool):
         :param kwargs: Any number of FieldConfig objects keyed by their parameter names
         :return: List of UsageReport objects
         """
-        base_sql = "FROM usage_minutely_v"
+        table_or_view = usage_report_source("usage_minutely_v", self._use_usage_rollups())
 
         # Extract FieldConfig objects from kwargs and filter out None values
         conditions_and_grouping = [field_config for field_config in kwargs.values()
@@ -114,7 +747,8 @@ class UsageDatabaseStorage(UsageStorage, BaseDatabaseAccessSinglePool):
             raise ValueError("At least one FieldConfig must be provided")
 
         # Execute the query with dynamic conditions and grouping
-        return self.execute_query_grouped(base_sql, conditions_and_grouping, lambda row: UsageReport(**row))
+        return self._execute_usage_report_query(
+            table_or_view, conditions_and_grouping, lambda row: UsageReport(**row))
 
     def fetch_usage_report_generic(
             self,
@@ -134,7 +768,9 @@ class UsageDatabaseStorage(UsageStorage, BaseDatabaseAccessSinglePool):
         if not _IDENTIFIER_RE.match(table_or_view):
             raise ValueError(f"Invalid table/view name: {table_or_view}")
 
-        base_sql = f"FROM {table_or_view}"
+        # the report views are served by the rollup tables, these have the same columns
+        if table_or_view.lower() in USAGE_ROLLUP_VIEWS:
+            table_or_view = usage_report_source(table_or_view, self._use_usage_rollups())
 
         conditions_and_grouping = [
             fc for fc in kwargs.values()
@@ -143,58 +779,15 @@ class UsageDatabaseStorage(UsageStorage, BaseDatabaseAccessSinglePool):
         if not conditions_and_grouping:
             raise ValueError("At least one FieldConfig must be provided")
 
-        return self.execute_query_grouped(
-            base_sql,
+        return self._execute_usage_report_query(
+            table_or_view,
             conditions_and_grouping,
             lambda row: model(**row)  # -> T
         )
 
     def fetch_user_project_current_usage_report(self, user_id: str,
                                                 project_id: str = None) -> UserProjectCurrentUsageReport | None:
-        kwargs = {
-            "table_or_view": "user_project_current_usage_report",
-            "model": UserProjectCurrentUsageReport,
-            "user_id": FieldConfig("user_id", value=user_id, use_in_group_by=True, use_in_where=True),
-            "tier_id": FieldConfig("tier_id", value=None, use_in_group_by=True, use_in_where=False),
-
-            ### tier / quota token limits for a period
-            "limit_per_minute": FieldConfig("limit_token_per_minute", value=None, use_in_where=False, aggregate="MAX"),
-            "limit_per_hour": FieldConfig("limit_token_per_hour", value=None, use_in_where=False, aggregate="MAX"),
-            "limit_per_day": FieldConfig("limit_token_per_day", value=None, use_in_where=False, aggregate="MAX"),
-            "limit_per_month": FieldConfig("limit_token_per_month", value=None, use_in_where=False, aggregate="MAX"),
-            "limit_per_year": FieldConfig("limit_token_per_year", value=None, use_in_where=False, aggregate="MAX"),
-
-            ### tier / quotas cost limits for a period
-            "limit_cost_per_minute": FieldConfig("limit_cost_per_minute", value=None, use_in_where=True,
-                                                 aggregate="MAX"),
-            "limit_cost_per_hour": FieldConfig("limit_cost_per_hour", value=None, use_in_where=True, aggregate="MAX"),
-            "limit_cost_per_day": FieldConfig("limit_cost_per_day", value=None, use_in_where=True, aggregate="MAX"),
-            "limit_cost_per_month": FieldConfig("limit_cost_per_month", value=None, use_in_where=True, aggregate="MAX"),
-            "limit_cost_per_year": FieldConfig("limit_cost_per_year", value=None, use_in_where=True, aggregate="MAX"),
-
-            # current running costs
-            "cur_minute_total_cost": FieldConfig("cur_minute_total_cost", value=None, use_in_where=True,
-                                                 aggregate="SUM"),
-            "cur_hour_total_cost": FieldConfig("cur_hour_total_cost", value=None, use_in_where=True, aggregate="SUM"),
-            "cur_day_total_cost": FieldConfig("cur_day_total_cost", value=None, use_in_where=True, aggregate="SUM"),
-            "cur_month_total_cost": FieldConfig("cur_month_total_cost", value=None, use_in_where=True, aggregate="SUM"),
-            "cur_year_total_cost": FieldConfig("cur_year_total_cost", value=None, use_in_where=True, aggregate="SUM"),
-
-            ##
-            "pct_minute_tokens_used": FieldConfig("pct_minute_tokens_used", value=None, aggregate="SUM"),
-            "pct_hour_tokens_used": FieldConfig("pct_hour_tokens_used", value=None, aggregate="SUM"),
-            "pct_day_tokens_used": FieldConfig("pct_day_tokens_used", value=None, aggregate="SUM"),
-            "pct_month_tokens_used": FieldConfig("pct_month_tokens_used", value=None, aggregate="SUM"),
-            "pct_year_tokens_used": FieldConfig("pct_year_tokens_used", value=None, aggregate="SUM"),
-            "pct_minute_cost_used": FieldConfig("pct_minute_cost_used", value=None, aggregate="SUM"),
-            "pct_hour_cost_used": FieldConfig("pct_hour_cost_used", value=None, aggregate="SUM"),
-            "pct_day_cost_used": FieldConfig("pct_day_cost_used", value=None, aggregate="SUM"),
-            "pct_month_cost_used": FieldConfig("pct_month_cost_used", value=None, aggregate="SUM"),
-            "pct_year_cost_used": FieldConfig("pct_year_cost_used", value=None, aggregate="SUM"),
-        }
-
-        if project_id is not None:
-            kwargs["project_id"] = FieldConfig("project_id", value=project_id, use_in_group_by=True, use_in_where=True)
+        kwargs = user_project_current_usage_report_fields(user_id=user_id, project_id=project_id)
 
         # Fetch the report
         report = self.fetch_usage_report_generic(**kwargs)
@@ -266,3 +859,18 @@ class UsageDatabaseStorage(UsageStorage, BaseDatabaseAccessSinglePool):
     #
     #     # Execute the query with dynamic conditions and grouping
     #     return self.execute_query_grouped(base_sql, conditions_and_grouping, lambda row: UsageReport(**row))
+
+
+def _reset_after_fork():
+    # the locks may have been held by another thread at the fork
+    # the threads of the refreshers are not running in the child, these are started again on first read
+    UsageDatabaseStorage._rollup_refreshers = {}
+    UsageDatabaseStorage._rollup_refreshers_lock = threading.Lock()
+    UsageDatabaseStorage._usage_writers_lock = threading.Lock()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+# the buffered usage events are written before the interpreter exits
+atexit.register(UsageDatabaseStorage.close_usage_writers)
@@ -0,0 +1,269 @@
+import logging as log
+
+from typing import Any, Dict, List, Optional, Sequence, Tuple, Union
+
+from ismdb.base import BaseDatabaseAccessSinglePool, compile_where
+from ismdb.misc_utils import map_rows_to_dicts
+
+logging = log.getLogger(__name__)
+
+# pgvector distance operator and index operator class by distance metric
+VECTOR_METRICS = {
+    'l2': ('<->', 'vector_l2_ops'),
+    'cosine': ('<=>', 'vector_cosine_ops'),
+    'inner_product': ('<#>', 'vector_ip_ops'),
+}
+
+VECTOR_INDEX_METHODS = ('hnsw', 'ivfflat')
+
+
+def quote_identifier(name: str) -> str:
+    return '"' + name.replace('"', '""') + '"'
+
+
+def format_vector(vector: Union[str, Sequence[float]]) -> str:
+    """Format a vector in the pgvector text representation, e.g. [0.1,0.2,0.3]"""
+    if isinstance(vector, str):
+        return vector
+
+    if hasattr(vector, 'tolist'):
+        vector = vector.tolist()
+
+    return '[' + ','.join(str(float(value)) for value in vector) + ']'
+
+
+def build_filter_clauses(filters: Optional[Dict[str, Any]], alias: str = None) -> Tuple[List[str], List[Any]]:
+    """
+    Build the where clauses of metadata filters on the table columns, the filter values follow the
+    conventions of compile_where, e.g. a list of values matches any of the values (= ANY).
+    """
+    prefix = f'{alias}.' if alias else ''
+    where_sql, params = compile_where({
+        f'{prefix}{quote_identifier(field)}': value
+        for field, value in (filters or {}).items()
+    })
+
+    return ([where_sql] if where_sql else []), params
+
+
+class VectorDatabaseStorage(BaseDatabaseAccessSinglePool):
+    """
+    Approximate nearest neighbour index management and similarity search on pgvector VECTOR columns,
+    such as the embedding columns of the tables created by the StateDatabaseProcessor.
+    """
+
+    @staticmethod
+    def _metric(metric: str) -> Tuple[str, str]:
+        if metric not in VECTOR_METRICS:
+            raise ValueError(f'unsupported distance metric {metric}, must be one of {list(VECTOR_METRICS)}')
+
+        return VECTOR_METRICS[metric]
+
+    def create_vector_index(self,
+                            table: str,
+                            column: str,
+                            method: str = 'hnsw',
+                            metric: str = 'cosine',
+                            m: int = 16,
+                            ef_construction: int = 64,
+                            lists: int = 100,
+                            index_name: str = None) -> str:
+        """
+        Create an approximate nearest neighbour index on a vector column, if it does not exist.
+
+        :param table: the table name
+        :param column: the vector column name
+        :param method: hnsw or ivfflat
+        :param metric: the distance metric the index serves, l2, cosine or inner_product
+        :param m: hnsw, the maximum number of connections per layer
+        :param ef_construction: hnsw, the size of the candidate list when building the graph
+        :param lists: ivfflat, the number of inverted lists, build the index after loading the data
+        :param index_name: the index name, {table}_{column}_{method}_{metric}_idx by default
+        :return: the index name
+        """
+        if method not in VECTOR_INDEX_METHODS:
+            raise ValueError(f'unsupported index method {method}, must be one of {VECTOR_INDEX_METHODS}')
+
+        _, operator_class = self._metric(metric)
+        index_name = index_name or f'{table}_{column}_{method}_{metric}_idx'
+
+        if method == 'hnsw':
+            parameters = f'm = {int(m)}, ef_construction = {int(ef_construction)}'
+        else:
+            parameters = f'lists = {int(lists)}'
+
+        sql = f"""
+            CREATE INDEX IF NOT EXISTS {quote_identifier(index_name)}
+                ON {quote_identifier(table)}
+             USING {method} ({quote_identifier(column)} {operator_class})
+              WITH ({parameters})
+        """
+
+        conn = self.create_connection()
+
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute(sql)
+            conn.commit()
+        except Exception as e:
+            logging.error(e)
+            raise e
+        finally:
+            self.release_connection(conn)
+
+        logging.info(f'created {method} index {index_name} on {table}.{column} ({parameters})')
+        return index_name
+
+    def drop_vector_index(self, index_name: str):
+        conn = self.create_connection()
+
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute(f'DROP INDEX IF EXISTS {quote_identifier(index_name)}')
+            conn.commit()
+        except Exception as e:
+            logging.error(e)
+            raise e
+        finally:
+            self.release_connection(conn)
+
+    def fetch_vector_indexes(self, table: str) -> Optional[List[Dict[str, Any]]]:
+        return self.execute_query_fixed(
+            sql="""
+                SELECT indexname AS index_name, indexdef AS definition
+                  FROM pg_indexes
+                 WHERE schemaname = current_schema()
+                   AND tablename = %s
+                   AND (indexdef ILIKE '%%USING hnsw%%' OR indexdef ILIKE '%%USING ivfflat%%')
+            """,
+            params=[table],
+            mapper=lambda row: row)
+
+    @staticmethod
+    def _apply_search_settings(cursor, ef_search: int = None, probes: int = None) -> Dict[str, Optional[str]]:
+        # settings are local to the search transaction, the previous values are returned for a restore
+        settings = {}
+        if ef_search:
+            settings['hnsw.ef_search'] = int(ef_search)
+        if probes:
+            settings['ivfflat.probes'] = int(probes)
+
+        previous = {}
+        for name, value in settings.items():
+            cursor.execute('SELECT current_setting(%s, true)', [name])
+            previous[name] = cursor.fetchone()[0]
+            cursor.execute('SELECT set_config(%s, %s, true)', [name, str(value)])
+
+        return previous
+
+    @staticmethod
+    def _restore_search_settings(cursor, previous: Dict[str, Optional[str]]):
+        # a unit of work continues after the search, its settings must not be changed by it
+        for name, value in previous.items():
+            if value is None:
+                cursor.execute(f'RESET {name}')
+            else:
+                cursor.execute('SELECT set_config(%s, %s, true)', [name, value])
+
+    def search(self,
+               table: str,
+               column: str,
+               query_vector: Union[str, Sequence[float]],
+               k: int = 10,
+               metric: str = 'cosine',
+               columns: List[str] = None,
+               id_column: str = 'id',
+               filters: Dict[str, Any] = None,
+               ef_search: int = None,
+               probes: int = None) -> List[Dict[str, Any]]:
+        """
+        Top-k nearest neighbour search of a single query vector.
+
+        :param table: the table name
+        :param column: the vector column name
+        :param query_vector: the query vector, a sequence of floats or a pgvector text literal
+        :param k: the number of neighbours to return
+        :param metric: the distance metric, l2, cosine or inner_product (negative inner product)
+        :param columns: additional columns to return with each neighbour
+        :param id_column: the id column returned as id
+        :param filters: metadata filters on the table columns, see build_filter_clauses
+        :param ef_search: hnsw, the size of the candidate list at query time (recall vs. latency)
+        :param probes: ivfflat, the number of lists probed at query time (recall vs. latency)
+        :return: the neighbours, nearest first, each with the id, distance and selected columns
+        """
+        return self.search_many(
+            table=table, column=column, query_vectors=[query_vector], k=k, metric=metric, columns=columns,
+            id_column=id_column, filters=filters, ef_search=ef_search, probes=probes)[0]
+
+    def search_many(self,
+                    table: str,
+                    column: str,
+                    query_vectors: List[Union[str, Sequence[float]]],
+                    k: int = 10,
+                    metric: str = 'cosine',
+                    columns: List[str] = None,
+                    id_column: str = 'id',
+                    filters: Dict[str, Any] = None,
+                    ef_search: int = None,
+                    probes: int = None) -> List[List[Dict[str, Any]]]:
+        """
+        Top-k nearest neighbour search of many query vectors in a single statement, each query vector is
+        searched by a lateral subquery such that every query is served by the vector index.
+
+        See search for the parameters.
+        :return: one list of neighbours per query vector, in the order of the query vectors
+        """
+        if not query_vectors:
+            return []
+
+        operator, _ = self._metric(metric)
+        vector_column = f'source.{quote_identifier(column)}'
+
+        select_columns = [f'source.{quote_identifier(id_column)} AS id']
+        select_columns += [f'source.{quote_identifier(name)}' for name in columns or []]
+        select_columns.append(f'{vector_column} {operator} query.vector AS distance')
+
+        where_clauses, filter_params = build_filter_clauses(filters, alias='source')
+        where_clauses.insert(0, f'{vector_column} IS NOT NULL')
+
+        sql = f"""
+            SELECT query.position, neighbour.*
+              FROM UNNEST(%s::vector[]) WITH ORDINALITY AS query(vector, position)
+             CROSS JOIN LATERAL (
+                SELECT {', '.join(select_columns)}
+                  FROM {quote_identifier(table)} AS source
+                 WHERE {' AND '.join(where_clauses)}
+                 ORDER BY {vector_column} {operator} query.vector
+                 LIMIT %s
+             ) AS neighbour
+             ORDER BY query.position, neighbour.distance
+        """
+
+        params = [[format_vector(vector) for vector in query_vectors], *filter_params, k]
+
+        transaction = self._active_transaction()
+        conn = self.create_connection(read_only=True)
+
+        try:
+            with conn.cursor() as cursor:
+                previous = self._apply_search_settings(cursor, ef_search=ef_search, probes=probes)
+                cursor.execute(sql, params)
+                rows = map_rows_to_dicts(cursor, cursor.fetchall())
+
+                # the commit of a unit of work is deferred to its end, which does not reset the local settings
+                if transaction is not None:
+                    self._restore_search_settings(cursor, previous)
+
+            # end the read transaction, resetting the local search settings
+            conn.commit()
+        except Exception as e:
+            logging.error(e)
+            raise e
+        finally:
+            self.release_connection(conn)
+
+        results = [[] for _ in query_vectors]
+        for row in rows:
+            results[row.pop('position') - 1].append(row)
+
+        return results
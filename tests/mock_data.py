@@ -1,3 +1,4 @@
+import json
 import os
 import random
 
@@ -499,3 +500,25 @@ def create_mock_workflow_nodes(project_id: str):
     ]
 
     return nodes, edges
+
+
+def create_mock_mixed_state(state_id: str, rows: int = 25) -> State:
+    state = State(
+        id=state_id,
+        config=StateConfig(
+            name="Test Bulk State",
+            primary_key=[
+                StateDataKeyDefinition(name="name")
+            ]
+        )
+    )
+
+    for index in range(rows):
+        state.apply_query_state(query_state={
+            "name": f"row {index}",
+            "text": f"tab\there, newline\nhere, backslash \\ here {index}",
+            "payload": json.dumps({"index": index, "tags": ["a", "b"]})
+        })
+
+    state.columns["payload"].data_type = "json"
+    return state
@@ -0,0 +1,99 @@
+import asyncio
+
+import pytest
+
+from ismdb.async_base import AsyncConnectionPool, execute_async
+from ismdb.async_postgres_storage_class import AsyncPostgresDatabaseStorage
+from ismdb.connection_pool import ConnectionPoolTimeout
+from tests.mock_data import db_storage, create_mock_mixed_state, DATABASE_URL
+
+
+@pytest.mark.asyncio
+async def test_async_pool_checkout_timeout():
+    connection_pool = AsyncConnectionPool(0, 1, DATABASE_URL, timeout=0.1)
+    conn = await connection_pool.getconn()
+
+    with pytest.raises(ConnectionPoolTimeout):
+        await connection_pool.getconn()
+
+    # the timed out waiter must not hold on to the released connection
+    connection_pool.putconn(conn)
+    assert connection_pool.stats()['waiting'] == 0
+    assert await connection_pool.getconn(timeout=0) is conn
+    connection_pool.closeall()
+
+
+@pytest.mark.asyncio
+async def test_async_pool_serves_many_tasks():
+    connection_pool = AsyncConnectionPool(0, 2, DATABASE_URL, timeout=10)
+
+    async def worker(number: int):
+        conn = await connection_pool.getconn()
+        try:
+            cursor = await execute_async(conn, "select %s", [number])
+            return cursor.fetchone()[0]
+        finally:
+            connection_pool.putconn(conn)
+
+    results = await asyncio.gather(*[worker(number) for number in range(100)])
+    assert results == list(range(100))
+    assert connection_pool.stats()['size'] <= 2
+    connection_pool.closeall()
+
+
+@pytest.mark.asyncio
+async def test_async_load_state_matches_sync():
+    state_id = "b0000000-0000-0000-0000-0000000000c1"
+    db_storage.delete_state_cascade(state_id=state_id)
+    db_storage.save_state(state=create_mock_mixed_state(state_id=state_id))
+
+    storage = AsyncPostgresDatabaseStorage(database_url=DATABASE_URL)
+    loaded_state = await storage.load_state(state_id=state_id)
+    expected_state = db_storage.load_state(state_id=state_id)
+
+    assert loaded_state.count == expected_state.count
+    for column in ["name", "text", "payload", "state_key"]:
+        assert loaded_state.data[column].values == expected_state.data[column].values
+
+    storage.close()
+
+
+@pytest.mark.asyncio
+async def test_async_append_state_data_direct_concurrent():
+    state_id = "b0000000-0000-0000-0000-0000000000c2"
+    db_storage.delete_state_cascade(state_id=state_id)
+    db_storage.save_state(state=create_mock_mixed_state(state_id=state_id, rows=5))
+
+    storage = AsyncPostgresDatabaseStorage(database_url=DATABASE_URL)
+
+    async def append(writer: int):
+        return await storage.append_state_data_direct(state_id=state_id, query_states=[
+            {"name": f"writer {writer} row {index}", "text": "appended", "payload": {"writer": writer}}
+            for index in range(10)
+        ])
+
+    await asyncio.gather(*[append(writer) for writer in range(5)])
+
+    state = await storage.load_state(state_id=state_id)
+    assert state.count == 55
+    assert None not in state.data["name"].values
+    assert len(set(state.data["name"].values)) == 55
+
+    storage.close()
+
+
+@pytest.mark.asyncio
+async def test_async_transaction_rollback():
+    state_id = "b0000000-0000-0000-0000-0000000000c3"
+    db_storage.delete_state_cascade(state_id=state_id)
+
+    storage = AsyncPostgresDatabaseStorage(database_url=DATABASE_URL)
+    state = create_mock_mixed_state(state_id=state_id)
+
+    with pytest.raises(RuntimeError):
+        async with storage.transaction():
+            await storage.insert_state(state=state)
+            raise RuntimeError("fail the unit of work")
+
+    assert await storage.fetch_state(state_id=state_id) is None
+    storage.close()
@@ -0,0 +1,159 @@
+import time
+
+import pytest
+
+from ismdb.buffered_writer import BackgroundCopyWriter, BufferedCopyWriter
+from ismdb.connection_pool import BlockingConnectionPool
+from tests.mock_data import DATABASE_URL
+
+TABLE = "test_buffered_writer"
+
+
+@pytest.fixture
+def connection_pool():
+    connection_pool = BlockingConnectionPool(0, 2, DATABASE_URL, timeout=5)
+
+    conn = connection_pool.getconn()
+    with conn.cursor() as cursor:
+        cursor.execute(f"DROP TABLE IF EXISTS {TABLE}")
+        cursor.execute(f"CREATE TABLE {TABLE} (id INT NOT NULL, name TEXT NULL, payload JSONB NULL)")
+    conn.commit()
+    connection_pool.putconn(conn)
+
+    yield connection_pool
+
+    conn = connection_pool.getconn()
+    with conn.cursor() as cursor:
+        cursor.execute(f"DROP TABLE IF EXISTS {TABLE}")
+    conn.commit()
+    connection_pool.putconn(conn)
+    connection_pool.closeall()
+
+
+def fetch_rows(connection_pool):
+    conn = connection_pool.getconn()
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute(f"SELECT id, name, payload FROM {TABLE} ORDER BY id")
+            return cursor.fetchall()
+    finally:
+        connection_pool.putconn(conn)
+
+
+@pytest.mark.parametrize("method", ["copy", "insert"])
+def test_buffered_writer_flushes_by_batch_size(connection_pool, method):
+    writer = BufferedCopyWriter(connection_pool, TABLE, ["id", "name", "payload"],
+                                batch_size=1000, flush_interval=60, method=method)
+
+    for index in range(2500):
+        payload = {"index": index} if method == "copy" else None
+        writer.write((index, f"tab\there {index}" if index % 2 else None, payload))
+
+    # two full batches were written, the remainder is still buffered
+    assert writer.stats()["batches"] == 2
+    assert writer.stats()["buffered"] == 500
+    assert len(fetch_rows(connection_pool)) == 2000
+
+    writer.close()
+    stats = writer.stats()
+    assert stats["rows"] == 2500
+    assert stats["batches"] == 3
+    assert stats["rows_per_second"] > 0
+
+    rows = fetch_rows(connection_pool)
+    assert len(rows) == 2500
+    assert rows[1][1] == "tab\there 1"
+    assert rows[2][1] is None
+
+    with pytest.raises(ValueError):
+        writer.write((2500, None, None))
+
+
+def test_buffered_writer_flushes_by_interval(connection_pool):
+    with BufferedCopyWriter(connection_pool, TABLE, ["id", "name"], batch_size=1000, flush_interval=0) as writer:
+        writer.write((1, "one"))
+        writer.write((2, "two"))
+
+        # the flush interval elapsed, every write is flushed
+        assert len(fetch_rows(connection_pool)) == 2
+
+    assert writer.stats()["batches"] == 2
+
+
+def test_background_writer_flushes_from_thread(connection_pool):
+    writer = BackgroundCopyWriter(connection_pool, TABLE, ["id", "name"], batch_size=100, flush_interval=0.05)
+
+    for index in range(250):
+        assert writer.write((index, f"row {index}"))
+
+    # the full batches and, after the flush interval, the remainder are written by the flush thread
+    deadline = time.monotonic() + 5
+    while writer.stats()["rows"] < 250 and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+    assert len(fetch_rows(connection_pool)) == 250
+    assert writer.stats()["buffered"] == 0
+    assert writer.stats()["max_flush_seconds"] > 0
+
+    writer.close()
+    with pytest.raises(ValueError):
+        writer.write((250, None))
+
+
+def test_background_writer_drops_rows_when_full(connection_pool):
+    writer = BackgroundCopyWriter(connection_pool, TABLE, ["id", "name"], batch_size=10, flush_interval=60,
+                                  max_buffered=10)
+
+    # a full buffer the flush thread did not take yet
+    with writer._lock:
+        writer._buffer.extend((index, None) for index in range(10))
+        writer._buffered_at = time.monotonic()
+
+    assert not writer.write((10, None))
+    assert writer.write_many([(11, None), (12, None)]) == 2
+
+    # the buffered rows are flushed on close
+    writer.close()
+    stats = writer.stats()
+    assert stats["dropped"] == 3
+    assert stats["rows"] == 10
+    assert len(fetch_rows(connection_pool)) == 10
+
+
+def test_background_writer_keeps_failed_rows(connection_pool):
+    writer = BackgroundCopyWriter(connection_pool, TABLE, ["id", "name"], batch_size=10, flush_interval=60)
+
+    # the null id violates the not null constraint, the batch is written row by row
+    writer.write_many([(index if index != 3 else None, f"row {index}") for index in range(5)])
+    writer.close()
+
+    stats = writer.stats()
+    assert stats["rows"] == 4
+    assert stats["failed"] == 1
+    assert list(writer.dead_letters) == [(None, "row 3")]
+    assert len(fetch_rows(connection_pool)) == 4
+
+
+def test_background_writer_keeps_rows_while_database_unavailable(connection_pool):
+    # both connections held, such that the flush thread times out on getconn like on an unavailable database
+    held = [connection_pool.getconn(), connection_pool.getconn()]
+    connection_pool.timeout = 0.1
+
+    writer = BackgroundCopyWriter(connection_pool, TABLE, ["id", "name"], batch_size=10, flush_interval=0.1)
+    writer.write_many([(index, f"row {index}") for index in range(5)])
+    time.sleep(0.5)
+
+    # the batch is kept buffered for a retry, not written row by row into the dead letters
+    assert writer.stats()["failed"] == 0
+    assert not writer.dead_letters
+
+    writer.close(timeout=0.5)
+    # the flush thread may still hold the batch, it is counted once its retry failed
+    writer._thread.join(1)
+    stats = writer.stats()
+    assert stats["abandoned"] == 5
+    assert stats["rows"] == 0
+
+    for conn in held:
+        connection_pool.putconn(conn)
+    assert fetch_rows(connection_pool) == []
@@ -0,0 +1,236 @@
+import multiprocessing
+import threading
+import time
+
+import psycopg2
+import pytest
+
+from ismdb import base
+from ismdb.base import BaseDatabaseAccessSinglePool
+from ismdb.connection_pool import BlockingConnectionPool, ConnectionPoolTimeout
+from tests.mock_data import DATABASE_URL
+
+
+def test_pool_checkout_waits_for_release():
+    connection_pool = BlockingConnectionPool(0, 1, DATABASE_URL, timeout=5)
+    conn = connection_pool.getconn()
+
+    # release the only connection from another thread while the main thread waits on it
+    timer = threading.Timer(0.2, lambda: connection_pool.putconn(conn))
+    timer.start()
+
+    started = time.monotonic()
+    waited_conn = connection_pool.getconn()
+    assert waited_conn is conn
+    assert time.monotonic() - started >= 0.1
+
+    connection_pool.putconn(waited_conn)
+    connection_pool.closeall()
+
+
+def test_pool_checkout_timeout():
+    connection_pool = BlockingConnectionPool(0, 1, DATABASE_URL, timeout=0.1)
+    conn = connection_pool.getconn()
+
+    with pytest.raises(ConnectionPoolTimeout):
+        connection_pool.getconn()
+
+    # the timed out waiter must not hold on to the released connection
+    connection_pool.putconn(conn)
+    assert connection_pool.stats()['waiting'] == 0
+    assert connection_pool.getconn(timeout=0) is conn
+    connection_pool.closeall()
+
+
+def test_pool_waiters_are_served_in_fifo_order():
+    connection_pool = BlockingConnectionPool(0, 1, DATABASE_URL, timeout=5)
+    conn = connection_pool.getconn()
+    served = []
+
+    def worker(number: int):
+        worker_conn = connection_pool.getconn()
+        served.append(number)
+        connection_pool.putconn(worker_conn)
+
+    workers = []
+    for number in range(5):
+        thread = threading.Thread(target=worker, args=(number,))
+        thread.start()
+        workers.append(thread)
+
+        # wait for the worker to queue up before starting the next one
+        while connection_pool.stats()['waiting'] < number + 1:
+            time.sleep(0.01)
+
+    connection_pool.putconn(conn)
+    for thread in workers:
+        thread.join()
+
+    assert served == [0, 1, 2, 3, 4]
+    connection_pool.closeall()
+
+
+def test_pool_is_thread_safe_under_contention():
+    connection_pool = BlockingConnectionPool(1, 3, DATABASE_URL, timeout=10)
+    errors = []
+
+    def worker():
+        try:
+            for _ in range(20):
+                conn = connection_pool.getconn()
+                with conn.cursor() as cursor:
+                    cursor.execute("select 1")
+                    assert cursor.fetchone()[0] == 1
+                connection_pool.putconn(conn)
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=worker) for _ in range(10)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert not errors
+    stats = connection_pool.stats()
+    assert stats['size'] <= 3
+    assert stats['in_use'] == 0
+    connection_pool.closeall()
+
+
+def test_configure_pool_by_url():
+    database_url = f"{DATABASE_URL}?application_name=test_configure_pool"
+    BaseDatabaseAccessSinglePool.configure_pool(database_url, min_connections=0, max_connections=2, timeout=0.1)
+
+    storage = BaseDatabaseAccessSinglePool(database_url=database_url)
+    assert storage.connection_pool.maxconn == 2
+    assert storage.connection_pool.timeout == 0.1
+
+    conn1 = storage.create_connection()
+    conn2 = storage.create_connection()
+    with pytest.raises(ConnectionPoolTimeout):
+        storage.create_connection()
+
+    # growing the live pool applies immediately
+    BaseDatabaseAccessSinglePool.configure_pool(database_url, max_connections=3)
+    conn3 = storage.create_connection()
+
+    for conn in [conn1, conn2, conn3]:
+        storage.release_connection(conn)
+
+
+def test_pool_frees_slot_when_release_rollback_fails():
+    connection_pool = BlockingConnectionPool(0, 1, DATABASE_URL, timeout=5)
+    conn = connection_pool.getconn()
+    with conn.cursor() as cursor:
+        cursor.execute("select pg_backend_pid()")
+        backend_pid = cursor.fetchone()[0]
+
+    # the server drops the connection with its transaction still open, the rollback on release fails
+    other = psycopg2.connect(DATABASE_URL)
+    other.autocommit = True
+    with other.cursor() as cursor:
+        cursor.execute("select pg_terminate_backend(%s)", [backend_pid])
+    other.close()
+
+    connection_pool.putconn(conn)
+    assert connection_pool.stats()['size'] == 0
+    assert connection_pool.stats()['in_use'] == 0
+
+    # the slot is free for a new connection
+    conn = connection_pool.getconn(timeout=1)
+    connection_pool.putconn(conn)
+    connection_pool.closeall()
+
+
+def test_pool_connects_on_first_checkout():
+    connection_pool = BlockingConnectionPool(2, 3, DATABASE_URL, timeout=5)
+    assert connection_pool.stats()['size'] == 0
+
+    conn = connection_pool.getconn()
+    stats = connection_pool.stats()
+    assert stats['size'] == 2
+    assert stats['idle'] == 1
+
+    connection_pool.putconn(conn)
+    connection_pool.closeall()
+
+
+def _child_select(connection_pool, queue):
+    try:
+        conn = connection_pool.getconn()
+        with conn.cursor() as cursor:
+            cursor.execute("select pg_backend_pid()")
+            backend_pid = cursor.fetchone()[0]
+        connection_pool.putconn(conn)
+        queue.put(backend_pid)
+    except Exception as e:
+        queue.put(e)
+
+
+def test_pool_is_fork_safe():
+    connection_pool = BlockingConnectionPool(1, 2, DATABASE_URL, timeout=5)
+    conn = connection_pool.getconn()
+    with conn.cursor() as cursor:
+        cursor.execute("select pg_backend_pid()")
+        parent_backend_pid = cursor.fetchone()[0]
+
+    # the child process establishes its own connection, the inherited ones are left alone
+    queue = multiprocessing.get_context('fork').Queue()
+    processes = [multiprocessing.get_context('fork').Process(target=_child_select, args=(connection_pool, queue))
+                 for _ in range(2)]
+    for process in processes:
+        process.start()
+    results = [queue.get(timeout=30) for _ in processes]
+    for process in processes:
+        process.join()
+
+    assert all(isinstance(result, int) for result in results), results
+    assert parent_backend_pid not in results
+
+    # the session of the parent process survived the child process exit
+    with conn.cursor() as cursor:
+        cursor.execute("select pg_backend_pid()")
+        assert cursor.fetchone()[0] == parent_backend_pid
+
+    connection_pool.putconn(conn)
+    assert connection_pool.stats()['in_use'] == 0
+    connection_pool.closeall()
+
+
+def test_reset_and_close_all_pools(monkeypatch):
+    # a registry of its own, such that the pools shared by the other tests are neither reset nor closed
+    monkeypatch.setattr(BaseDatabaseAccessSinglePool, "_pools", {})
+    monkeypatch.setattr(BaseDatabaseAccessSinglePool, "_pool_settings", {})
+
+    database_url = f"{DATABASE_URL}?application_name=test_reset_pools"
+    BaseDatabaseAccessSinglePool.configure_pool(database_url, min_connections=1, max_connections=2)
+    storage = BaseDatabaseAccessSinglePool(database_url=database_url)
+    storage.connection_pool.open()
+    assert storage.connection_pool.stats()['idle'] == 1
+
+    # idle connections are closed, the pool reconnects on demand
+    BaseDatabaseAccessSinglePool.reset_pools()
+    assert storage.connection_pool.stats()['size'] == 0
+    conn = storage.create_connection()
+    storage.release_connection(conn)
+
+    BaseDatabaseAccessSinglePool.close_all_pools()
+    assert storage.connection_pool.closed
+    assert BaseDatabaseAccessSinglePool(database_url=database_url).connection_pool is not storage.connection_pool
+    BaseDatabaseAccessSinglePool.close_all_pools()
+
+
+def test_environment_replicas_serve_database_url_only(monkeypatch):
+    monkeypatch.setattr(BaseDatabaseAccessSinglePool, "_pools", {})
+    monkeypatch.setattr(BaseDatabaseAccessSinglePool, "_replica_settings", {})
+    monkeypatch.setattr(base, "DATABASE_URL", DATABASE_URL)
+    monkeypatch.setattr(base, "DATABASE_REPLICA_URLS", [f"{DATABASE_URL}?application_name=test_env_replica"])
+
+    assert len(BaseDatabaseAccessSinglePool(database_url=DATABASE_URL)._replica_pools()) == 1
+
+    # another database is not replicated by the replicas of the environment
+    other_url = f"{DATABASE_URL}?application_name=test_other_primary"
+    assert BaseDatabaseAccessSinglePool(database_url=other_url)._replica_pools() == []
+
+    BaseDatabaseAccessSinglePool.close_all_pools()
@@ -0,0 +1,81 @@
+import json
+
+from ismdb.embedding_cache import BatchEmbeddingCalculator, EmbeddingCacheDatabaseStorage
+from ismdb.memory_cache import MemoryCache
+from tests.mock_data import DATABASE_URL, db_storage
+
+MODEL_NAME = "test_embedding_model"
+
+
+class CountingEmbedding:
+    def __init__(self):
+        self.batches = []
+
+    def __call__(self, texts):
+        self.batches.append(list(texts))
+        return [json.dumps([float(len(text)), float(ord(text[0]))]) for text in texts]
+
+
+def test_batch_embedding_deduplicates_and_caches():
+    embed = CountingEmbedding()
+    calculator = BatchEmbeddingCalculator(embed_batch=embed, batch_size=2)
+
+    texts = ["apple", "banana", "apple", "cherry", "banana"]
+    embeddings = calculator.calculate_many(texts)
+
+    assert embeddings[0] == embeddings[2] == json.dumps([5.0, 97.0])
+    assert embeddings[1] == embeddings[4]
+
+    # three unique texts in batches of two
+    assert embed.batches == [["apple", "banana"], ["cherry"]]
+
+    # the per row contract is served from the cache
+    assert calculator.calculate("cherry") == embeddings[3]
+    assert len(embed.batches) == 2
+    assert calculator.stats()["texts_embedded"] == 3
+
+
+def test_batch_embedding_does_not_cache_missing_embeddings():
+    calls = []
+
+    def embed(texts):
+        calls.append(texts)
+        return [None for _ in texts]
+
+    calculator = BatchEmbeddingCalculator(embed_batch=embed)
+    assert calculator.calculate("apple") is None
+    assert calculator.calculate("apple") is None
+    assert len(calls) == 2
+
+
+def test_batch_embedding_serializes_and_keys_by_model():
+    cache = MemoryCache(maxsize=10, ttl=None)
+    first = BatchEmbeddingCalculator(embed_batch=lambda texts: [[1.0, 2.0] for _ in texts], model_name="first",
+                                     cache=cache)
+    second = BatchEmbeddingCalculator(embed_batch=lambda texts: [[3.0] for _ in texts], model_name="second",
+                                      cache=cache)
+
+    # a shared cache holds the embedding of each model, as json text
+    assert first.calculate("apple") == json.dumps([1.0, 2.0])
+    assert second.calculate("apple") == json.dumps([3.0])
+    assert first.calculate("apple") == json.dumps([1.0, 2.0])
+    assert len(cache) == 2
+
+
+def test_batch_embedding_persistent_store():
+    db_storage.execute_delete_query(sql="DELETE FROM embedding_cache", conditions={"model_name": MODEL_NAME})
+    store = EmbeddingCacheDatabaseStorage(database_url=DATABASE_URL)
+
+    embed = CountingEmbedding()
+    calculator = BatchEmbeddingCalculator(embed_batch=embed, model_name=MODEL_NAME, store=store)
+    expected = calculator.calculate_many(["apple", "banana"])
+    assert len(embed.batches) == 1
+
+    # a new calculator, e.g. another processor, reads the embeddings from the store
+    embed = CountingEmbedding()
+    calculator = BatchEmbeddingCalculator(embed_batch=embed, model_name=MODEL_NAME, store=store)
+    assert calculator.calculate_many(["banana", "apple", "cherry"]) == [expected[1], expected[0], json.dumps([6.0, 99.0])]
+    assert embed.batches == [["cherry"]]
+    assert calculator.stats()["store_hits"] == 2
+
+    db_storage.execute_delete_query(sql="DELETE FROM embedding_cache", conditions={"model_name": MODEL_NAME})
@@ -0,0 +1,86 @@
+from ismcore.model.filter import Filter, FilterItem, FilterOperator
+from ismcore.model.processor_state import State, StateConfig
+
+from ismdb.filter import FilterDatabaseStorage, compile_filter_item
+from tests.mock_data import db_storage, DATABASE_URL
+
+filter_storage = FilterDatabaseStorage(database_url=DATABASE_URL)
+
+
+def create_mock_filter_state(state_id: str) -> State:
+    state = State(id=state_id, config=StateConfig(name="Test Filter State"))
+
+    values = ["5", "5.0", "12", "-3", "abc", "Abc", "", "x5y", None, "1e5"]
+    for index, value in enumerate(values):
+        state.apply_query_state(query_state={
+            "value": value,
+            "name": f"row {index}",
+        })
+
+    return state
+
+
+def python_matches(filter: Filter, row: dict) -> bool:
+    # Filter fails on mixed type comparisons (e.g. "abc" > 5), the pushed down filter does not match these
+    try:
+        return filter.apply_filter_on_data(row)
+    except TypeError:
+        return False
+
+
+def test_compile_filter_item_numeric_and_text():
+    predicate_sql, params = compile_filter_item(
+        FilterItem(key="value", operator=FilterOperator.GT, value="4"), "c0.data_value", "str")
+    assert "::numeric" in predicate_sql and params == [4]
+
+    predicate_sql, params = compile_filter_item(
+        FilterItem(key="value", operator=FilterOperator.EQ, value="abc"), "c0.data_value", "str")
+    assert predicate_sql == "c0.data_value = %s" and params == ["abc"]
+
+
+def test_compile_filter_item_falls_back():
+    assert compile_filter_item(
+        FilterItem(key="value", operator=FilterOperator.REGEX, value="^a"), "c0.data_value", "str") is None
+    assert compile_filter_item(
+        FilterItem(key="value", operator=FilterOperator.EQ, value="a"), "c0.data_json_value", "json") is None
+    assert compile_filter_item(
+        FilterItem(key="value", operator=FilterOperator.EQ, value=True), "c0.data_value", "str") is None
+
+
+def test_filter_pushdown_matches_python_filter():
+    state_id = "b0000000-0000-0000-0000-0000000000f1"
+    db_storage.delete_state_cascade(state_id=state_id)
+    db_storage.save_state(state=create_mock_filter_state(state_id=state_id))
+
+    rows = filter_storage.fetch_filtered_state_rows(state_id=state_id, filter=Filter(filter_items={}))
+    assert len(rows) == 10
+
+    items = [
+        FilterItem(key="value", operator=FilterOperator.EQ, value="5"),
+        FilterItem(key="value", operator=FilterOperator.NE, value="abc"),
+        FilterItem(key="value", operator=FilterOperator.GTE, value=5),
+        FilterItem(key="value", operator=FilterOperator.LT, value="abc"),
+        FilterItem(key="value", operator=FilterOperator.BETWEEN, value=-5, secondary_value=6),
+        FilterItem(key="value", operator=FilterOperator.IN, value=["abc", "12", 5, None]),
+        FilterItem(key="value", operator=FilterOperator.NOT_IN, value=["abc", "12"]),
+        FilterItem(key="value", operator=FilterOperator.CONTAINS, value="5"),
+        FilterItem(key="value", operator=FilterOperator.NOT_CONTAINS, value="b"),
+        FilterItem(key="value", operator=FilterOperator.STARTS_WITH, value="A"),
+        FilterItem(key="value", operator=FilterOperator.ENDS_WITH, value="y"),
+        FilterItem(key="value", operator=FilterOperator.IS_NULL, value=None),
+        FilterItem(key="value", operator=FilterOperator.REGEX_CASE_INSENSITIVE, value="^a"),
+        FilterItem(key="missing", operator=FilterOperator.NOT_EXISTS, value=None),
+    ]
+
+    for item in items:
+        filter = Filter(filter_items={item.key: item})
+        expected = [index for index, row in enumerate(rows) if python_matches(filter, row)]
+        assert filter_storage.fetch_filtered_state_data_indexes(state_id=state_id, filter=filter) == expected, item
+
+    # pushed down and fallback items combined
+    filter = Filter(filter_items={
+        "value": FilterItem(key="value", operator=FilterOperator.REGEX, value="^[0-9]"),
+        "name": FilterItem(key="name", operator=FilterOperator.NE, value="row 2"),
+    })
+    matched = filter_storage.fetch_filtered_state_rows(state_id=state_id, filter=filter, columns=["value", "name"])
+    assert [row["name"] for row in matched] == ["row 0", "row 1", "row 9"]
@@ -803,3 +803,17 @@ def test_create_state():
     states = db_storage.fetch_states(project_id=user_project.project_id)
     # states = [s for s in states if s['id'] in [state_id_1, state_id_2]]
     assert len(states) == 2
+
+
+def test_storages_are_created_on_first_use():
+    storage = PostgresDatabaseStorage(database_url=DATABASE_URL)
+    assert not storage._storages
+
+    storage.fetch_templates()
+    assert list(storage._storages) == ['template_storage']
+    assert storage.fetch_templates.__self__ is storage._delegate_template_storage
+
+    # methods outside of the storage interfaces resolve to the defining storage
+    assert storage.fetch_filtered_state_data_indexes.__self__ is storage._delegate_filter_storage
+    assert 'fetch_filtered_state_data_indexes' in vars(storage)
+    assert not hasattr(storage, 'no_such_storage_method')
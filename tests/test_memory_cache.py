@@ -0,0 +1,77 @@
+import time
+
+from ismdb.memory_cache import MemoryCache
+
+
+def test_memory_cache_evicts_least_recently_used():
+    cache = MemoryCache(maxsize=2, ttl=None)
+    cache.set("a", 1)
+    cache.set("b", 2)
+
+    # touch a, such that b is the least recently used entry
+    assert cache.get("a") == 1
+    cache.set("c", 3)
+
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+    assert cache.stats()["evictions"] == 1
+
+
+def test_memory_cache_expires_entries():
+    cache = MemoryCache(maxsize=10, ttl=0.05)
+    cache.set("a", 1)
+    assert cache.get("a") == 1
+
+    time.sleep(0.1)
+    assert cache.get("a") is None
+    assert cache.stats()["expirations"] == 1
+    assert len(cache) == 0
+
+
+def test_memory_cache_stats():
+    cache = MemoryCache(maxsize=10)
+    cache.set("a", 1)
+
+    cache.get("a")
+    cache.get("a")
+    cache.get("b")
+
+    # peek does not count as a lookup
+    assert cache.peek("a") == 1
+
+    cache.delete("a")
+    cache.delete("a")
+
+    stats = cache.stats()
+    assert stats["hits"] == 2
+    assert stats["misses"] == 1
+    assert stats["hit_ratio"] == 2 / 3
+    assert stats["invalidations"] == 1
+    assert stats["size"] == 0
+
+
+def test_memory_cache_ttl_per_entry():
+    cache = MemoryCache(maxsize=10, ttl=60)
+    cache.set("short", 1, ttl=0.05)
+    cache.set("forever", 2, ttl=None)
+    cache.set("default", 3)
+
+    time.sleep(0.1)
+    assert cache.get("short") is None
+    assert cache.get("forever") == 2
+    assert cache.get("default") == 3
+
+
+def test_memory_cache_replace():
+    cache = MemoryCache(maxsize=2, ttl=None)
+    cache.set("a", {"count": 1})
+    cached = cache.get("a")
+
+    assert cache.replace("a", lambda value: {**value, "count": 2})
+    assert cache.get("a") == {"count": 2}
+
+    # the value read before is left as it was
+    assert cached == {"count": 1}
+    assert not cache.replace("b", lambda value: value)
+    assert cache.get("b") is None
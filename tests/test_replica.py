@@ -0,0 +1,79 @@
+import os
+import threading
+
+import pytest
+
+from ismdb.base import BaseDatabaseAccessSinglePool
+
+# a primary and a streaming replica of it, see tests/replica/docker-compose.yaml
+PRIMARY_DATABASE_URL = os.environ.get("PRIMARY_DATABASE_URL")
+REPLICA_DATABASE_URL = os.environ.get("REPLICA_DATABASE_URL")
+
+pytestmark = pytest.mark.skipif(
+    not PRIMARY_DATABASE_URL or not REPLICA_DATABASE_URL,
+    reason="requires PRIMARY_DATABASE_URL and REPLICA_DATABASE_URL, see tests/replica/docker-compose.yaml")
+
+IN_RECOVERY_SQL = "select pg_is_in_recovery() as in_recovery"
+
+
+def reads_from_replica(storage: BaseDatabaseAccessSinglePool) -> bool:
+    return storage.execute_query_fixed(IN_RECOVERY_SQL, None, lambda row: row['in_recovery'])[0]
+
+
+@pytest.fixture
+def storage():
+    BaseDatabaseAccessSinglePool.configure_replicas(
+        PRIMARY_DATABASE_URL, [REPLICA_DATABASE_URL], read_your_writes_seconds=0)
+    yield BaseDatabaseAccessSinglePool(database_url=PRIMARY_DATABASE_URL)
+    BaseDatabaseAccessSinglePool.configure_replicas(PRIMARY_DATABASE_URL, [])
+
+
+def test_reads_go_to_replica_and_writes_to_primary(storage):
+    assert reads_from_replica(storage)
+
+    conn = storage.create_connection()
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute(IN_RECOVERY_SQL)
+            assert not cursor.fetchone()[0]
+    finally:
+        storage.release_connection(conn)
+
+    assert storage.connection_pool.stats()['in_use'] == 0
+    assert BaseDatabaseAccessSinglePool.shared_pool(REPLICA_DATABASE_URL).stats()['in_use'] == 0
+
+
+def test_read_from_primary_override(storage):
+    with storage.read_from_primary():
+        assert not reads_from_replica(storage)
+    assert reads_from_replica(storage)
+
+    # the override is per thread
+    results = []
+    with storage.read_from_primary():
+        thread = threading.Thread(target=lambda: results.append(reads_from_replica(storage)))
+        thread.start()
+        thread.join()
+    assert results == [True]
+
+
+def test_unit_of_work_reads_from_primary(storage):
+    with storage.transaction():
+        assert not reads_from_replica(storage)
+
+
+def test_read_your_writes_window(storage):
+    BaseDatabaseAccessSinglePool.configure_replicas(
+        PRIMARY_DATABASE_URL, [REPLICA_DATABASE_URL], read_your_writes_seconds=60)
+
+    # in a new thread, the preceding tests wrote from the main thread
+    def read_write_read():
+        results.append(reads_from_replica(storage))
+        storage.release_connection(storage.create_connection())
+        results.append(reads_from_replica(storage))
+
+    results = []
+    thread = threading.Thread(target=read_write_read)
+    thread.start()
+    thread.join()
+    assert results == [True, False]
@@ -0,0 +1,32 @@
+import datetime as dt
+
+from ismcore.model.base_model import MonitorLogEvent, ProcessorState, ProcessorStateDirection
+
+from ismdb.misc_utils import map_rows, map_rows_to_dicts, model_mapper
+
+
+class MockCursor:
+    def __init__(self, columns):
+        self.description = [(column, None, None, None, None, None, None) for column in columns]
+
+
+def test_map_rows_to_dicts():
+    cursor = MockCursor(["id", "name"])
+    assert map_rows_to_dicts(cursor, [(1, "a"), (2, "b")]) == [{"id": 1, "name": "a"}, {"id": 2, "name": "b"}]
+
+
+def test_trusted_mapper_matches_validating_mapper():
+    cursor = MockCursor(["log_id", "log_type", "log_time", "user_id", "data"])
+    rows = [(index, "info", dt.datetime(2026, 1, 1), "user", f"data {index}") for index in range(3)]
+
+    validated = map_rows(cursor, rows, model_mapper(MonitorLogEvent))
+    trusted = map_rows(cursor, rows, model_mapper(MonitorLogEvent, trusted=True))
+    assert [event.model_dump() for event in trusted] == [event.model_dump() for event in validated]
+
+
+def test_trusted_mapper_does_not_coerce_values():
+    row = {"processor_id": "p", "state_id": "s", "direction": "OUTPUT"}
+
+    # only the validating mapper converts the stored value to the enum
+    assert model_mapper(ProcessorState)(row).direction == ProcessorStateDirection.OUTPUT
+    assert model_mapper(ProcessorState, trusted=True)(row).direction == "OUTPUT"
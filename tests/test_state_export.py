@@ -0,0 +1,38 @@
+import io
+
+import pytest
+
+pa = pytest.importorskip("pyarrow")
+pq = pytest.importorskip("pyarrow.parquet")
+
+from ismdb.state_export import export_state_data, pivot_state_data_chunk
+from tests.mock_data import db_storage, create_mock_mixed_state
+
+
+def test_pivot_state_data_chunk():
+    rows = [("a", 10, "a10"), ("b", 10, "b10"), ("a", 12, "a12"), ("c", 11, "ignored")]
+    chunk = pivot_state_data_chunk(rows=rows, column_names=["a", "b"], offset=10, size=3)
+    assert chunk == {"a": ["a10", None, "a12"], "b": ["b10", None, None]}
+
+
+@pytest.mark.parametrize("file_format", ["parquet", "arrow"])
+def test_export_state_data(file_format):
+    state_id = "b0000000-0000-0000-0000-0000000000c1"
+    db_storage.delete_state_cascade(state_id=state_id)
+    db_storage.save_state(state=create_mock_mixed_state(state_id=state_id, rows=25))
+
+    sink = io.BytesIO()
+    exported = export_state_data(storage=db_storage._delegate_state_storage, state_id=state_id,
+                                 sink=sink, file_format=file_format, chunk_size=7)
+    assert exported == 25
+
+    sink.seek(0)
+    if file_format == "parquet":
+        table = pq.read_table(sink)
+    else:
+        table = pa.ipc.open_file(sink).read_all()
+
+    assert table.num_rows == 25
+    assert table.column("data_index").to_pylist() == list(range(25))
+    assert table.column("name").to_pylist()[13] == "row 13"
+    assert table.column("text").to_pylist()[0] == "tab\there, newline\nhere, backslash \\ here 0"
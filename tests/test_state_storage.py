@@ -0,0 +1,349 @@
+import threading
+
+import pytest
+
+from ismcore.model.processor_state import StateConfigLM, StateDataKeyDefinition
+
+from ismdb.memory_cache import MemoryCache
+from ismdb.state_storage import StateDatabaseStorage
+from tests.mock_data import db_storage, create_mock_mixed_state, create_mock_random_state, DATABASE_URL
+
+
+def test_save_state_bulk_ingest():
+    state_id = "b0000000-0000-0000-0000-0000000000b1"
+    db_storage.delete_state_cascade(state_id=state_id)
+
+    state = create_mock_mixed_state(state_id=state_id)
+    saved_state = db_storage.save_state(state=state, options={"bulk_ingest": True})
+    assert saved_state.persisted_position == 24
+
+    loaded_state = db_storage.load_state(state_id=state_id)
+    assert loaded_state.count == 25
+    assert loaded_state.data["text"].values[3] == "tab\there, newline\nhere, backslash \\ here 3"
+    assert loaded_state.data["payload"].values[7] == {"index": 7, "tags": ["a", "b"]}
+    assert loaded_state.data["state_key"].values == state.data["state_key"].values
+
+
+def test_save_state_bulk_ingest_matches_merge():
+    bulk_state_id = "b0000000-0000-0000-0000-0000000000b2"
+    merge_state_id = "b0000000-0000-0000-0000-0000000000b3"
+    db_storage.delete_state_cascade(state_id=bulk_state_id)
+    db_storage.delete_state_cascade(state_id=merge_state_id)
+
+    db_storage.save_state(state=create_mock_mixed_state(state_id=bulk_state_id), options={"bulk_ingest": True})
+    db_storage.save_state(state=create_mock_mixed_state(state_id=merge_state_id), options={"bulk_ingest": False})
+
+    bulk_state = db_storage.load_state(state_id=bulk_state_id)
+    merge_state = db_storage.load_state(state_id=merge_state_id)
+
+    for column in ["name", "text", "payload", "state_key"]:
+        assert bulk_state.data[column].values == merge_state.data[column].values
+
+
+def test_save_state_bulk_ingest_overwrites_existing_rows():
+    state_id = "b0000000-0000-0000-0000-0000000000b4"
+    db_storage.delete_state_cascade(state_id=state_id)
+
+    state = create_mock_mixed_state(state_id=state_id, rows=5)
+    db_storage.save_state(state=state)
+
+    # re-save the same rows with updated values, non-incremental saves merge into existing rows
+    state.data["text"].values[0] = "updated"
+    state.data["payload"].values[0] = {"updated": True}
+    db_storage.insert_state_columns_data(state=state, incremental=False, bulk=True)
+
+    loaded_state = db_storage.load_state(state_id=state_id)
+    assert loaded_state.count == 5
+    assert loaded_state.data["text"].values[0] == "updated"
+    assert loaded_state.data["payload"].values[0] == {"updated": True}
+
+
+def count_state_mappings(state_id: str) -> int:
+    rows = db_storage.execute_query_fixed(
+        sql="select count(*) as cnt from state_column_data_mapping where state_id = %s",
+        params=[state_id],
+        mapper=lambda row: row['cnt'])
+    return rows[0]
+
+
+def test_insert_state_column_data_mapping_is_idempotent():
+    state_id = "b0000000-0000-0000-0000-0000000000b5"
+    db_storage.delete_state_cascade(state_id=state_id)
+
+    state = create_mock_mixed_state(state_id=state_id, rows=10)
+    db_storage.save_state(state=state)
+    assert count_state_mappings(state_id) == 10
+
+    # retrying the mapping insert must skip the existing pairs
+    db_storage.insert_state_column_data_mapping(state=state)
+    assert count_state_mappings(state_id) == 10
+
+    # append rows directly, new state keys are mapped in the same statement
+    db_storage.append_state_data_direct(state_id=state_id, query_states=[
+        {"name": f"row {index}", "text": "appended", "payload": "{}"}
+        for index in range(10, 15)
+    ])
+    assert count_state_mappings(state_id) == 15
+
+
+def test_load_state_data_columnar_matches_per_column_fetch():
+    state_id = "b0000000-0000-0000-0000-0000000000b6"
+    db_storage.delete_state_cascade(state_id=state_id)
+    db_storage.save_state(state=create_mock_mixed_state(state_id=state_id, rows=25))
+
+    state = db_storage.load_state_metadata(state_id=state_id)
+
+    # full load, a full page and a partial last page
+    for offset, limit in [(None, 1000), (0, 10), (20, 10)]:
+        data = db_storage.load_state_data(columns=state.columns, state_count=state.count,
+                                          offset=offset, limit=limit)
+
+        assert set(data.keys()) == set(state.columns.keys())
+        for column, column_definition in state.columns.items():
+            expected = db_storage.fetch_state_data_by_column_id(
+                column_definition.id, state.count, data_type=column_definition.data_type,
+                offset=offset, limit=limit)
+
+            assert data[column].values == expected.values
+            assert data[column].count == expected.count
+
+    # a page past the end of the state is empty
+    data = db_storage.load_state_data(columns=state.columns, state_count=state.count, offset=30, limit=10)
+    assert all(not column_data.values for column_data in data.values())
+
+
+def test_save_state_is_a_single_unit_of_work():
+    state_id = "b0000000-0000-0000-0000-0000000000b7"
+    db_storage.delete_state_cascade(state_id=state_id)
+
+    state = create_mock_mixed_state(state_id=state_id, rows=5)
+
+    # fail the save after the state, columns and data were written, nothing must be persisted
+    state_storage = db_storage._delegate_state_storage
+    original = state_storage.insert_state_primary_key_definition
+
+    def failing_insert(state):
+        raise RuntimeError("simulated failure")
+
+    state_storage.insert_state_primary_key_definition = failing_insert
+    try:
+        with pytest.raises(RuntimeError):
+            state_storage.save_state(state=state)
+    finally:
+        state_storage.insert_state_primary_key_definition = original
+
+    assert db_storage.fetch_state(state_id=state_id) is None
+    assert not db_storage.fetch_state_columns(state_id=state_id)
+
+    # the same save succeeds once the failure is removed
+    state = create_mock_mixed_state(state_id=state_id, rows=5)
+    db_storage.save_state(state=state)
+    assert db_storage.load_state(state_id=state_id).count == 5
+
+
+def test_transaction_groups_caller_defined_calls():
+    state_id = "b0000000-0000-0000-0000-0000000000b8"
+    db_storage.delete_state_cascade(state_id=state_id)
+
+    state = create_mock_mixed_state(state_id=state_id, rows=5)
+    with pytest.raises(ValueError):
+        with db_storage.transaction():
+            db_storage.insert_state(state=state)
+
+            # reads within the unit of work see its uncommitted writes
+            assert db_storage.fetch_state(state_id=state_id) is not None
+            raise ValueError("abort")
+
+    assert db_storage.fetch_state(state_id=state_id) is None
+
+    with db_storage.transaction():
+        db_storage.insert_state(state=state)
+        db_storage.insert_state_columns(state=state)
+
+    assert db_storage.fetch_state(state_id=state_id) is not None
+    assert set(db_storage.fetch_state_columns(state_id=state_id).keys()) == set(state.columns.keys())
+
+
+def save_iter_state(state_id: str, rows: int = 25):
+    """Each iter_state_rows test saves the state it reads, the tests do not depend on each other."""
+    db_storage.delete_state_cascade(state_id=state_id)
+    db_storage.save_state(state=create_mock_mixed_state(state_id=state_id, rows=rows))
+    return db_storage.load_state(state_id=state_id)
+
+
+def test_iter_state_rows():
+    state_id = "b0000000-0000-0000-0000-0000000000b9"
+    loaded_state = save_iter_state(state_id=state_id)
+
+    # a small batch size forces several round trips on the server side cursor
+    rows = list(db_storage.iter_state_rows(state_id=state_id, batch_size=4))
+    assert len(rows) == 25
+    for index, row in enumerate(rows):
+        for column in loaded_state.columns.keys():
+            assert row[column] == loaded_state.data[column].values[index]
+
+    rows = list(db_storage.iter_state_rows(state_id=state_id, columns=["name", "payload"]))
+    assert rows[10] == {"name": "row 10", "payload": {"index": 10, "tags": ["a", "b"]}}
+
+
+def test_iter_state_rows_aligned_and_bounded_by_count():
+    state_id = "b0000000-0000-0000-0000-0000000000bc"
+    save_iter_state(state_id=state_id, rows=10)
+
+    # a data index without values, and values beyond the count (e.g. of an append in progress)
+    with db_storage._delegate_state_storage.transaction() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute("DELETE FROM state_column_data WHERE data_index = 3 "
+                           "AND column_id IN (SELECT id FROM state_column WHERE state_id = %s)", [state_id])
+            cursor.execute("UPDATE state SET count = 8 WHERE id = %s", [state_id])
+
+    rows = list(db_storage.iter_state_rows(state_id=state_id, columns=["name"], batch_size=2))
+    assert len(rows) == 8
+    assert rows[3] == {"name": None}
+    assert rows[4] == {"name": "row 4"}
+    assert rows[7] == {"name": "row 7"}
+
+    db_storage.delete_state_cascade(state_id=state_id)
+
+
+def test_iter_state_rows_releases_connection_when_abandoned():
+    state_id = "b0000000-0000-0000-0000-0000000000bd"
+    save_iter_state(state_id=state_id)
+
+    connection_pool = db_storage._delegate_state_storage.connection_pool
+    in_use = connection_pool.stats()['in_use']
+
+    rows = db_storage.iter_state_rows(state_id=state_id, batch_size=2)
+    assert next(rows)["name"] == "row 0"
+    assert connection_pool.stats()['in_use'] == in_use + 1
+
+    rows.close()
+    assert connection_pool.stats()['in_use'] == in_use
+
+    db_storage.delete_state_cascade(state_id=state_id)
+
+
+def test_load_state_metadata_hydrated_matches_per_table_fetch():
+    state = create_mock_random_state()
+    state.config.state_join_key = [StateDataKeyDefinition(name="name")]
+    state = db_storage.save_state(state=state)
+
+    loaded_state = db_storage.load_state_metadata(state_id=state.id)
+    assert isinstance(loaded_state.config, StateConfigLM)
+    assert loaded_state.count == state.count
+
+    # the single query hydration must build the same config and columns as the per table fetches
+    key_definitions = {
+        definition_type: db_storage.fetch_state_key_definition(state_id=state.id, definition_type=definition_type)
+        for definition_type in ["primary_key", "query_state_inheritance", "state_join_key",
+                                "remap_query_state_columns", "template_columns"]
+    }
+    expected_config = db_storage.build_state_config(
+        state_type=state.state_type,
+        key_definitions=key_definitions,
+        config_attributes=db_storage.fetch_state_config(state_id=state.id))
+
+    assert loaded_state.config == expected_config
+    assert loaded_state.config.state_join_key[0].name == "name"
+    assert loaded_state.columns == db_storage.fetch_state_columns(state_id=state.id)
+
+    basic_state = db_storage.load_state_basic(state_id=state.id)
+    assert basic_state.config == loaded_state.config
+    assert not basic_state.columns
+
+    assert db_storage.load_state_metadata(state_id="b0000000-0000-0000-0000-00000000dead") is None
+
+
+def test_state_metadata_cache_write_through():
+    state_id = "b0000000-0000-0000-0000-0000000000ba"
+    db_storage.delete_state_cascade(state_id=state_id)
+    db_storage.save_state(state=create_mock_mixed_state(state_id=state_id, rows=5))
+
+    storage = StateDatabaseStorage(database_url=DATABASE_URL, metadata_cache=MemoryCache(maxsize=10))
+
+    # the first load misses, every following metadata load is served from the cache
+    for _ in range(3):
+        assert storage.load_state_metadata(state_id=state_id).count == 5
+    assert storage.fetch_state_metadata_cache_stats()["hits"] == 2
+
+    # callers modify their copy, not the cached entry
+    state = storage.load_state_basic(state_id=state_id)
+    state.count = 100
+    assert not state.columns
+    assert storage.fetch_state_columns(state_id=state_id) == db_storage.fetch_state_columns(state_id=state_id)
+    assert storage.load_state_metadata(state_id=state_id).count == 5
+
+    # appends write the new count through to the cached entry
+    storage.append_state_data_direct(state_id=state_id, query_states=[
+        {"name": "row 5", "text": "appended", "payload": "{}"}
+    ])
+    hits = storage.fetch_state_metadata_cache_stats()["hits"]
+    assert storage.load_state_metadata(state_id=state_id).count == 6
+    assert storage.fetch_state_metadata_cache_stats()["hits"] == hits + 1
+
+    # new columns invalidate the cached entry
+    storage.append_state_data_direct(state_id=state_id, query_states=[
+        {"name": "row 6", "text": "appended", "payload": "{}", "extra": "new column"}
+    ])
+    state = storage.load_state_metadata(state_id=state_id)
+    assert state.count == 7
+    assert "extra" in state.columns
+
+    storage.delete_state_cascade(state_id=state_id)
+    assert storage.load_state_metadata(state_id=state_id) is None
+
+
+def test_state_metadata_cache_appended_counts_out_of_order():
+    state_id = "b0000000-0000-0000-0000-0000000000be"
+    storage = StateDatabaseStorage(database_url=DATABASE_URL, metadata_cache=MemoryCache(maxsize=10))
+    storage.metadata_cache.set(state_id, create_mock_mixed_state(state_id=state_id, rows=5))
+
+    # the append reserving up to 200 writes its count through before the one reserving up to 100
+    storage.invalidate_state_metadata(state_id=state_id, count=200, appended=True)
+    storage.invalidate_state_metadata(state_id=state_id, count=100, appended=True)
+
+    cached = storage.metadata_cache.peek(state_id)
+    assert cached.count == 200
+    assert cached.persisted_position == 199
+
+    # a count set explicitly, e.g. a reset, applies as is
+    storage.invalidate_state_metadata(state_id=state_id, count=0)
+    assert storage.metadata_cache.peek(state_id).count == 0
+
+
+def test_append_state_data_direct_concurrent_writers():
+    state_id = "b0000000-0000-0000-0000-0000000000bb"
+    db_storage.delete_state_cascade(state_id=state_id)
+    db_storage.save_state(state=create_mock_mixed_state(state_id=state_id, rows=5))
+
+    workers, appends, rows = 4, 10, 5
+    errors = []
+
+    def append(worker: int):
+        try:
+            for append_index in range(appends):
+                db_storage.append_state_data_direct(state_id=state_id, query_states=[
+                    {"name": f"worker {worker} append {append_index} row {row}", "text": "appended", "payload": "{}"}
+                    for row in range(rows)
+                ])
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=append, args=(worker,)) for worker in range(workers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert not errors
+
+    # every appended row was written to its own data index, none were overwritten
+    expected = 5 + workers * appends * rows
+    state = db_storage.load_state(state_id=state_id, offset=0, limit=expected)
+    assert state.count == expected
+
+    names = state.data["name"].values
+    assert len(names) == expected
+    assert len(set(names)) == expected
+    assert all(name is not None for name in names)
+    assert count_state_mappings(state_id) == expected
@@ -1,6 +1,20 @@
+import datetime as dt
+
+import pytest
 from ismcore.storage.processor_state_storage import FieldConfig
 
-from tests.mock_data import db_storage
+from ismdb import usage_storage
+from ismdb.memory_cache import MemoryCache
+from ismdb.usage_storage import (next_bucket, truncate_to_bucket, usage_report_cache_key, usage_report_period_end,
+                                  usage_report_sql, UsageDatabaseStorage, USAGE_ROLLUPS)
+from tests.mock_data import db_storage, DATABASE_URL
+
+
+@pytest.fixture(autouse=True)
+def no_rollup_refresher(monkeypatch):
+    # the tests refresh the rollups themselves, a background refresh in between would skip theirs
+    monkeypatch.setattr(usage_storage, "USAGE_ROLLUP_REFRESH_SECONDS", 0)
+    UsageDatabaseStorage.stop_usage_rollup_refreshers()
 
 
 def test_fetch_usage_report_minutely():
@@ -103,3 +117,206 @@ def test_fetch_usage_report_total_grouping():
 
 
 
+
+
+def test_truncate_to_bucket():
+    timestamp = dt.datetime(2026, 3, 14, 15, 9, 26, 535, tzinfo=dt.timezone.utc)
+
+    assert truncate_to_bucket(timestamp, "minute") == dt.datetime(2026, 3, 14, 15, 9, tzinfo=dt.timezone.utc)
+    assert truncate_to_bucket(timestamp, "hour") == dt.datetime(2026, 3, 14, 15, tzinfo=dt.timezone.utc)
+    assert truncate_to_bucket(timestamp, "day") == dt.datetime(2026, 3, 14, tzinfo=dt.timezone.utc)
+    assert truncate_to_bucket(timestamp, "month") == dt.datetime(2026, 3, 1, tzinfo=dt.timezone.utc)
+
+
+def test_usage_rollups_match_report_views():
+    storage = db_storage._delegate_usage_storage
+    assert storage.refresh_usage_rollups()
+
+    user_id = "dc688d73-af47-b1df-a24e-b7dfdb618b54"
+    for granularity, view in [("hour", "USAGE_HOURLY_V"), ("day", "USAGE_DAILY_V")]:
+        expected = storage.execute_query_many(f"SELECT * FROM {view}", {"user_id": user_id}, lambda row: row)
+        rolled_up = storage.execute_query_many(usage_report_sql(granularity), {"user_id": user_id}, lambda row: row)
+        assert len(rolled_up or []) == len(expected or [])
+
+        def totals(rows):
+            date_columns = USAGE_ROLLUPS[granularity][2]
+            return {tuple(int(row[column]) for column in date_columns) + (row["resource_type"], row["resource_id"]):
+                        row["total_tokens"] for row in rows or []}
+
+        assert totals(rolled_up) == totals(expected)
+
+
+def test_usage_rollups_read_buckets_after_watermark():
+    from ismcore.model.base_model_usage_and_limits import Usage, UnitType, UnitSubType
+
+    storage = db_storage._delegate_usage_storage
+    assert storage.refresh_usage_rollups()
+
+    # recorded after the refresh, the buckets of the usage are after the watermarks and rolled up as read
+    usage = Usage(project_id='4cfa8c17-420e-4812-aa6b-544bb3ae49f9', resource_id='test_rollup_tail',
+                  resource_type='test', unit_type=UnitType.TOKEN, unit_subtype=UnitSubType.INPUT, unit_count=10)
+    assert storage.record_usage(usage)
+    storage.flush_usage()
+
+    try:
+        for granularity in ["minute", "hour", "day", "month", "year"]:
+            rows = storage.execute_query_many(
+                usage_report_sql(granularity), {"resource_id": "test_rollup_tail"}, lambda row: row)
+            assert sum(row["input_tokens"] for row in rows or []) == 10
+    finally:
+        with storage.transaction() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute("DELETE FROM usage WHERE resource_id = 'test_rollup_tail'")
+                cursor.execute("DELETE FROM usage_minute_rollup WHERE resource_id = 'test_rollup_tail'")
+
+
+def test_usage_rollups_never_recompute_closed_buckets():
+    storage = db_storage._delegate_usage_storage
+    assert storage.refresh_usage_rollups()
+
+    closed = storage.execute_query_fixed(
+        "SELECT bucket_utc, user_id, project_id, resource_type, resource_id, total_tokens FROM usage_report_daily "
+        "WHERE bucket_utc < (SELECT closed_before_utc FROM usage_report_rollup_watermark WHERE granularity = 'day') "
+        "LIMIT 1", None, lambda row: row)
+    if not closed:
+        pytest.skip("no closed daily usage bucket in the test database")
+
+    row = closed[0]
+    key = [row["bucket_utc"], row["user_id"], row["project_id"], row["resource_type"], row["resource_id"]]
+    key_sql = "bucket_utc = %s AND user_id = %s AND project_id = %s AND resource_type = %s AND resource_id = %s"
+    fetch_total = lambda: storage.execute_query_fixed(
+        f"SELECT total_tokens FROM usage_report_daily WHERE {key_sql}", key, lambda r: r["total_tokens"])[0]
+
+    # a tampered closed bucket survives a refresh, it is only recomputed by a rebuild
+    with storage.transaction() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute(f"UPDATE usage_report_daily SET total_tokens = -1 WHERE {key_sql}", key)
+
+    assert storage.refresh_usage_rollups()
+    assert fetch_total() == -1
+
+    assert storage.refresh_usage_rollups(since=row["bucket_utc"])
+    assert fetch_total() == row["total_tokens"]
+
+def test_record_usage_buffers_and_flushes():
+    from ismcore.model.base_model_usage_and_limits import Usage, UnitType, UnitSubType
+
+    usage = Usage(project_id='4cfa8c17-420e-4812-aa6b-544bb3ae49f9', resource_id='test_record_usage',
+                  resource_type='test', unit_type=UnitType.TOKEN, unit_subtype=UnitSubType.INPUT, unit_count=10)
+
+    rows_written = db_storage.usage_writer().stats()["rows"]
+    assert db_storage.record_usage(usage)
+    assert db_storage.record_usages([usage, usage]) == 0
+    db_storage.flush_usage()
+
+    stats = db_storage.usage_writer().stats()
+    assert stats["rows"] == rows_written + 3
+    assert stats["buffered"] == 0
+    assert stats["dropped"] == 0
+
+    conn = db_storage.create_connection()
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute("DELETE FROM usage WHERE resource_id = 'test_record_usage'")
+        conn.commit()
+    finally:
+        db_storage.release_connection(conn)
+
+
+def test_next_bucket():
+    assert next_bucket(dt.datetime(2026, 10, 16, 23, 59), "minute") == dt.datetime(2026, 10, 17, 0, 0)
+    assert next_bucket(dt.datetime(2026, 10, 16, 23), "hour") == dt.datetime(2026, 10, 17, 0)
+    assert next_bucket(dt.datetime(2026, 2, 28), "day") == dt.datetime(2026, 3, 1)
+    assert next_bucket(dt.datetime(2026, 11, 1), "month") == dt.datetime(2026, 12, 1)
+    assert next_bucket(dt.datetime(2026, 12, 1), "month") == dt.datetime(2027, 1, 1)
+
+
+def test_fetch_usage_series():
+    user_id = "dc688d73-af47-b1df-a24e-b7dfdb618b54"
+    end = dt.datetime.now(dt.timezone.utc)
+    start = end - dt.timedelta(days=30)
+
+    series = db_storage.fetch_usage_series(user_id, start, end, granularity="day", zero_fill=True)
+
+    # every day of the range, in order, the last one is today
+    assert len(series) in (30, 31)
+    assert [(report.year, report.month, report.day) for report in series] == \
+           sorted((report.year, report.month, report.day) for report in series)
+    assert (series[-1].year, series[-1].month, series[-1].day) == (end.year, end.month, end.day)
+
+    # the buckets with usage only, by resource type, hold the same usage
+    grouped = db_storage.fetch_usage_series(user_id, start, end, granularity="day", group_by=["resource_type"])
+    assert sum(report.total_tokens for report in grouped) == sum(report.total_tokens for report in series)
+
+    with pytest.raises(ValueError):
+        db_storage.fetch_usage_series(user_id, start, end, granularity="week")
+
+
+def test_usage_report_cache_key_is_normalised():
+    user_id = FieldConfig("user_id", value="user", use_in_group_by=True, use_in_where=True)
+    year = FieldConfig("year", value=2025, use_in_group_by=True, use_in_where=True)
+    total_cost = FieldConfig("total_cost", value=None, aggregate="sum")
+
+    key = usage_report_cache_key("FROM usage_minutely_v", [user_id, year, total_cost])
+    assert key == usage_report_cache_key("FROM usage_minutely_v", [total_cost, year, user_id])
+    assert key != usage_report_cache_key("FROM usage_hourly_v", [user_id, year, total_cost])
+    assert key != usage_report_cache_key("FROM usage_minutely_v", [
+        user_id, FieldConfig("year", value=2026, use_in_group_by=True, use_in_where=True), total_cost])
+
+
+def test_usage_report_period_end():
+    def fields(**values):
+        return [FieldConfig(name, value=value, use_in_where=True) for name, value in values.items()]
+
+    utc = dt.timezone.utc
+    assert usage_report_period_end(fields(year=2025)) == dt.datetime(2026, 1, 1, tzinfo=utc)
+    assert usage_report_period_end(fields(year=2025, month=12)) == dt.datetime(2026, 1, 1, tzinfo=utc)
+    assert usage_report_period_end(fields(year=2025, month=2, day=28, hour=23)) == \
+           dt.datetime(2025, 3, 1, tzinfo=utc)
+
+    # a day without the month is within the year only
+    assert usage_report_period_end(fields(year=2025, day=3)) == dt.datetime(2026, 1, 1, tzinfo=utc)
+    assert usage_report_period_end(fields(month=3)) is None
+    assert usage_report_period_end(fields(year=2025, month=13)) is None
+
+
+def test_usage_report_cache():
+    storage = UsageDatabaseStorage(database_url=DATABASE_URL, report_cache=MemoryCache(maxsize=10, ttl=60))
+    user_id = "dc688d73-af47-b1df-a24e-b7dfdb618b54"
+    assert storage.refresh_usage_rollups()
+
+    def fetch_year(year: int):
+        return storage.fetch_usage_report(
+            user_id=FieldConfig("user_id", value=user_id, use_in_group_by=True, use_in_where=True),
+            year=FieldConfig("year", value=year, use_in_group_by=True, use_in_where=True),
+            total_tokens=FieldConfig("total_tokens", value=None, aggregate="SUM"))
+
+    last_year = dt.datetime.now(dt.timezone.utc).year - 1
+    assert fetch_year(last_year) == fetch_year(last_year)
+
+    # a year before the rollup watermark is cached without expiry, the current usage for the cache ttl
+    assert storage.fetch_usage_report_cache_stats()["hits"] == 1
+    assert storage.report_cache._entries[next(iter(storage.report_cache._entries))][0] is None
+
+    # unless the rollups of the year are not closed yet
+    storage.report_cache.clear()
+    with storage.transaction() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT closed_before_utc FROM usage_report_rollup_watermark WHERE granularity = 'minute'")
+            watermark = cursor.fetchone()[0]
+            cursor.execute("UPDATE usage_report_rollup_watermark SET closed_before_utc = %s "
+                           "WHERE granularity = 'minute'", [dt.datetime(last_year, 6, 1, tzinfo=dt.timezone.utc)])
+    try:
+        fetch_year(last_year)
+        assert storage.report_cache._entries[next(iter(storage.report_cache._entries))][0] is not None
+    finally:
+        with storage.transaction() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute("UPDATE usage_report_rollup_watermark SET closed_before_utc = %s "
+                               "WHERE granularity = 'minute'", [watermark])
+
+    storage.fetch_user_project_current_usage_report(user_id=user_id)
+    storage.fetch_user_project_current_usage_report(user_id=user_id)
+    stats = storage.fetch_usage_report_cache_stats()
+    assert stats["hits"] == 2
+    assert stats["size"] == 2
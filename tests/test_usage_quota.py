@@ -0,0 +1,129 @@
+import calendar
+import threading
+import time
+
+from ismcore.model.base_model_usage_and_limits import UserProjectCurrentUsageReport
+
+from ismdb.usage_quota import UsageQuotaAccumulator, quota_periods
+
+
+class CurrentUsageReports:
+    """The current usage reports of the users, as fetch_user_project_current_usage_report returns them."""
+
+    def __init__(self, **reports):
+        self.reports = reports
+        self.fetches = 0
+
+    def fetch_user_project_current_usage_report(self, user_id: str, project_id: str = None):
+        self.fetches += 1
+        return self.reports.get(user_id)
+
+
+class SlowCurrentUsageReports(CurrentUsageReports):
+    """Current usage reports taking a while to fetch, such that concurrent checks overlap."""
+
+    def fetch_user_project_current_usage_report(self, user_id: str, project_id: str = None):
+        time.sleep(0.2)
+        return super().fetch_user_project_current_usage_report(user_id=user_id, project_id=project_id)
+
+
+def report(user_id: str, **fields) -> UserProjectCurrentUsageReport:
+    return UserProjectCurrentUsageReport(user_id=user_id, **fields)
+
+
+def test_quota_periods():
+    now = calendar.timegm((2026, 10, 16, 23, 59, 30))
+    minute, hour, day, month, year = quota_periods(now)
+
+    assert quota_periods(now + 29) == (minute, hour, day, month, year)
+    assert quota_periods(now + 31) == (minute + 1, hour + 1, day + 1, month, year)
+    assert quota_periods(calendar.timegm((2026, 11, 1, 0, 0, 0)))[3] == month + 1
+    assert year == 2026
+
+
+def test_quota_seeded_from_report_and_recorded_usage():
+    storage = CurrentUsageReports(
+        user=report("user", limit_token_per_minute=1000, pct_minute_tokens_used=50.0,
+                    limit_cost_per_day=10.0, cur_day_total_cost=5.0))
+    quotas = UsageQuotaAccumulator(storage, max_staleness=60)
+
+    assert quotas.check("user") == ("ok", "within allowed limits")
+
+    quotas.record("user", "project", tokens=400)
+    decision, reason = quotas.check("user")
+    assert decision == "warn" and reason.startswith("minute token")
+
+    quotas.record("user", "project", tokens=100, cost=5.0)
+    assert quotas.is_over_limit("user")
+
+    # answered from memory, the report was fetched once
+    assert storage.fetches == 1
+
+
+def test_quota_reconciles_when_stale():
+    storage = CurrentUsageReports(user=report("user", limit_token_per_hour=1000, pct_hour_tokens_used=10.0))
+    quotas = UsageQuotaAccumulator(storage, max_staleness=60)
+
+    quotas.check("user")
+    quotas.record("user", None, tokens=950)
+    assert quotas.is_over_limit("user")
+
+    # the recorded usage was written, the report of the database replaces it
+    storage.reports["user"] = report("user", limit_token_per_hour=1000, pct_hour_tokens_used=20.0)
+    assert not quotas.is_over_limit("user", max_staleness=0)
+    assert storage.fetches == 2
+
+    # unless it may not have been written yet
+    quotas = UsageQuotaAccumulator(storage, max_staleness=60, write_delay=60)
+    quotas.record("user", None, tokens=900)
+    assert quotas.is_over_limit("user")
+
+
+def test_quota_rolls_over_ended_periods():
+    now = [calendar.timegm((2026, 10, 16, 12, 0, 0))]
+    storage = CurrentUsageReports(
+        user=report("user", limit_token_per_minute=100, pct_minute_tokens_used=100.0,
+                    limit_token_per_day=1000, pct_day_tokens_used=50.0))
+    quotas = UsageQuotaAccumulator(storage, max_staleness=60, clock=lambda: now[0])
+
+    decision, reason = quotas.check("user")
+    assert decision == "block" and reason.startswith("minute token")
+
+    now[0] += 60
+    assert quotas.check("user") == ("ok", "within allowed limits")
+
+    quotas.record("user", None, tokens=450)
+    decision, reason = quotas.check("user")
+    assert decision == "block" and reason.startswith("minute token")
+
+
+def test_concurrent_checks_reconcile_once():
+    storage = SlowCurrentUsageReports(user=report("user", limit_token_per_hour=1000, pct_hour_tokens_used=10.0))
+    quotas = UsageQuotaAccumulator(storage, max_staleness=60)
+
+    # the checks waiting on the reconciliation of the first one are answered from its report
+    threads = [threading.Thread(target=quotas.check, args=("user",)) for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert storage.fetches == 1
+    assert quotas.stats()['reconciliations'] == 1
+
+
+def test_quota_invalidated_while_reconciled_is_reconciled_again():
+    class InvalidatingCurrentUsageReports(CurrentUsageReports):
+        def fetch_user_project_current_usage_report(self, user_id: str, project_id: str = None):
+            if not self.fetches:
+                quotas.invalidate("user")
+            return super().fetch_user_project_current_usage_report(user_id=user_id, project_id=project_id)
+
+    storage = InvalidatingCurrentUsageReports(
+        user=report("user", limit_token_per_hour=1000, pct_hour_tokens_used=100.0))
+    quotas = UsageQuotaAccumulator(storage, max_staleness=60)
+
+    # the quota dropped by the invalidation is not taken as unlimited
+    decision, reason = quotas.check("user")
+    assert decision == "block" and reason.startswith("hour token")
+    assert storage.fetches == 2
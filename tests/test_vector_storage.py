@@ -0,0 +1,98 @@
+import pytest
+
+from ismdb.base import Condition
+from ismdb.vector_storage import VectorDatabaseStorage, format_vector
+from tests.mock_data import DATABASE_URL
+
+TABLE = "test_vector_storage"
+
+vector_storage = VectorDatabaseStorage(database_url=DATABASE_URL)
+
+
+@pytest.fixture(scope="module", autouse=True)
+def vector_table():
+    conn = vector_storage.create_connection()
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT 1 FROM pg_available_extensions WHERE name = 'vector'")
+            if not cursor.fetchone():
+                pytest.skip("pgvector extension is not available")
+
+            cursor.execute("CREATE EXTENSION IF NOT EXISTS vector")
+            cursor.execute(f"DROP TABLE IF EXISTS {TABLE}")
+            cursor.execute(f"""
+                CREATE TABLE {TABLE} (id INT PRIMARY KEY, category TEXT, score INT, embedding VECTOR(3))
+            """)
+
+            # points on the x axis at increasing distance from the origin, alternating categories
+            for index in range(1, 21):
+                cursor.execute(f"INSERT INTO {TABLE} VALUES (%s, %s, %s, %s)",
+                               [index, "even" if index % 2 == 0 else "odd", index, format_vector([index, 1, 0])])
+            cursor.execute(f"INSERT INTO {TABLE} VALUES (0, 'none', 0, NULL)")
+        conn.commit()
+    finally:
+        vector_storage.release_connection(conn)
+
+    yield
+
+    conn = vector_storage.create_connection()
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute(f"DROP TABLE IF EXISTS {TABLE}")
+        conn.commit()
+    finally:
+        vector_storage.release_connection(conn)
+
+
+def test_vector_search_top_k():
+    neighbours = vector_storage.search(TABLE, "embedding", [10.2, 1, 0], k=3, metric="l2", columns=["category"])
+
+    assert [neighbour["id"] for neighbour in neighbours] == [10, 11, 9]
+    assert neighbours[0]["category"] == "even"
+    assert neighbours[0]["distance"] == pytest.approx(0.2, abs=1e-5)
+
+
+def test_vector_search_with_filters():
+    neighbours = vector_storage.search(TABLE, "embedding", [10.2, 1, 0], k=3, metric="l2",
+                                       filters={"category": "odd", "score": Condition("<", 11)})
+    assert [neighbour["id"] for neighbour in neighbours] == [9, 7, 5]
+
+    neighbours = vector_storage.search(TABLE, "embedding", [1, 1, 0], k=2, metric="l2",
+                                       filters={"id": [4, 15, 20]})
+    assert [neighbour["id"] for neighbour in neighbours] == [4, 15]
+
+
+def test_vector_search_many():
+    results = vector_storage.search_many(TABLE, "embedding", [[1, 1, 0], [20, 1, 0], [5.4, 1, 0]], k=2, metric="l2")
+
+    assert [[neighbour["id"] for neighbour in neighbours] for neighbours in results] == [[1, 2], [20, 19], [5, 6]]
+
+
+@pytest.mark.parametrize("method", ["hnsw", "ivfflat"])
+def test_vector_index_management(method):
+    index_name = vector_storage.create_vector_index(TABLE, "embedding", method=method, metric="cosine",
+                                                    m=8, ef_construction=32, lists=2)
+
+    indexes = vector_storage.fetch_vector_indexes(TABLE)
+    assert index_name in [index["index_name"] for index in indexes]
+
+    neighbours = vector_storage.search(TABLE, "embedding", [3, 1, 0], k=1, metric="cosine",
+                                       ef_search=40, probes=2)
+    assert neighbours[0]["id"] == 3
+
+    vector_storage.drop_vector_index(index_name)
+    assert not vector_storage.fetch_vector_indexes(TABLE)
+
+
+def test_vector_search_keeps_settings_of_unit_of_work():
+    with vector_storage.transaction() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute("SET LOCAL hnsw.ef_search = 100")
+
+        neighbours = vector_storage.search(TABLE, "embedding", [3, 1, 0], k=1, metric="l2", ef_search=40)
+        assert neighbours[0]["id"] == 3
+
+        # the unit of work continues after the search, with its own settings
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT current_setting('hnsw.ef_search')")
+            assert cursor.fetchone()[0] == "100"
@@ -0,0 +1,39 @@
+from ismdb.base import compile_where, append_where, _compile_where_shape, Condition, SQLNull, SQLNotNull
+
+
+def test_compile_where_operator_kinds():
+    where_sql, params = compile_where({
+        "id": "a",
+        "deleted_at": SQLNull,
+        "created_at": SQLNotNull,
+        "age": Condition(">=", 18),
+        "price": (100, 200),
+        "status": ["active", "pending"],
+        "skipped": None,
+    })
+
+    assert where_sql == ("id = %s AND deleted_at IS NULL AND created_at IS NOT NULL AND age >= %s "
+                         "AND price BETWEEN %s AND %s AND status = ANY(%s)")
+    assert params == ["a", 18, 100, 200, ["active", "pending"]]
+
+
+def test_compile_where_without_conditions():
+    assert compile_where({}) == ("", [])
+    assert compile_where({"id": None}) == ("", [])
+    assert append_where("SELECT * FROM state", {"id": None}) == ("SELECT * FROM state", [])
+
+
+def test_compile_where_is_cached_by_shape():
+    conditions = {"where_cache_state_id": "a", "where_cache_count": Condition(">", 1)}
+    compile_where(conditions)
+    hits = _compile_where_shape.cache_info().hits
+
+    # same shape with different values is a cache hit, only the parameters differ
+    where_sql, params = compile_where({"where_cache_state_id": "b", "where_cache_count": Condition(">", 2)})
+    assert _compile_where_shape.cache_info().hits == hits + 1
+    assert where_sql == "where_cache_state_id = %s AND where_cache_count > %s"
+    assert params == ["b", 2]
+
+    # a different operator is a different shape
+    where_sql, _ = compile_where({"where_cache_state_id": "b", "where_cache_count": Condition("<", 2)})
+    assert where_sql == "where_cache_state_id = %s AND where_cache_count < %s"